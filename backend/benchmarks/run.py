@@ -0,0 +1,349 @@
+"""Benchmark de la API contra un S3 simulado en proceso (moto) y un SQLite temporal.
+
+Uso (desde el directorio backend):
+
+    python -m benchmarks.run --sizes 1KB,1MB,16MB --concurrency 1,8 --requests 50 --output resultados.json
+    python -m benchmarks.run --compare resultados.json --threshold 0.2
+
+Mide register, login, upload, list y download y emite un JSON con p50/p95/p99,
+operaciones por segundo y bytes por segundo de cada combinación, además del
+arranque en frío (importar la app y esperar a /readyz). Con --compare
+falla (código 1) si el p95 de alguna medida empeora más que el umbral.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper()
+    for unit in ("KB", "MB", "GB", "B"):
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * UNITS[unit])
+    return int(value)
+
+def format_size(size: int) -> str:
+    for unit in ("GB", "MB", "KB"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}"
+    return f"{size}B"
+
+def percentile(values: List[float], pct: float) -> float:
+    # Percentil por rango más cercano sobre valores ordenados
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize(name: str, latencies: List[float], errors: int, elapsed: float, concurrency: int,
+              size: Optional[int] = None, transferred: int = 0) -> dict:
+    ok = len(latencies)
+    return {
+        "operation": name,
+        "size": size,
+        "size_label": format_size(size) if size is not None else None,
+        "concurrency": concurrency,
+        "requests": ok + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+        "throughput_bytes_s": round(transferred / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+def prepare_environment(workdir: str):
+    """Configura un S3 simulado y una base de datos temporal antes de importar la app."""
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ["AWS_BUCKET_NAME"] = "geocrypt-benchmark"
+    os.environ.pop("S3_ENDPOINT_URL", None)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.chdir(workdir)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    from moto import mock_aws
+    mock = mock_aws()
+    mock.start()
+    import boto3
+    boto3.client("s3", region_name=os.environ["AWS_DEFAULT_REGION"]).create_bucket(
+        Bucket=os.environ["AWS_BUCKET_NAME"]
+    )
+    return mock
+
+async def run_concurrently(count: int, concurrency: int, operation) -> dict:
+    """Ejecuta operation(i) count veces con como mucho concurrency en vuelo."""
+    slots = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+    transferred = 0
+
+    async def one(i: int):
+        nonlocal errors, transferred
+        async with slots:
+            started = time.perf_counter()
+            try:
+                amount = await operation(i)
+                latencies.append(time.perf_counter() - started)
+                transferred += amount
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"  error: {str(e)}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(count)])
+    return {
+        "latencies": latencies,
+        "errors": errors,
+        "elapsed": time.perf_counter() - started,
+        "transferred": transferred,
+    }
+
+def random_location():
+    return random.uniform(-60, 60), random.uniform(-170, 170)
+
+async def wait_ready(client, timeout: float = 60) -> float:
+    """Espera a que /readyz responda 200 y devuelve los segundos transcurridos."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if (await client.get("/readyz")).status_code == 200:
+            return time.perf_counter() - started
+        await asyncio.sleep(0.005)
+    raise RuntimeError("La aplicación no estuvo lista a tiempo")
+
+async def benchmark(args) -> Tuple[List[dict], dict]:
+    import geohash2
+    import httpx
+
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = []
+
+    await main.app.router.startup()
+    startup_done = time.perf_counter()
+    try:
+        async with httpx.AsyncClient(app=main.app, base_url="http://benchmark", timeout=None) as client:
+            # Arranque en frío: importar la app, ejecutar el startup y esperar a /readyz
+            ready_after = await wait_ready(client)
+            cold_start = {
+                "import_ms": round((imported - started) * 1000, 3),
+                "startup_ms": round((startup_done - imported) * 1000, 3),
+                "ready_ms": round((startup_done - imported + ready_after) * 1000, 3),
+                "total_ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+            print(f"Arranque en frío: {cold_start['total_ms']} ms hasta /readyz")
+
+            async def expect(response: httpx.Response):
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{response.request.url.path}: {response.status_code} {response.text[:200]}")
+                return response
+
+            tokens: List[str] = []
+            for concurrency in levels:
+                prefix = f"bench{concurrency}_{int(time.time() * 1000)}"
+
+                async def register(i: int) -> int:
+                    user = {"username": f"{prefix}_{i}", "email": f"{prefix}_{i}@example.com", "password": "benchmark"}
+                    await expect(await client.post("/auth/register", json=user))
+                    return 0
+
+                measured = await run_concurrently(args.requests, concurrency, register)
+                results.append(summarize("register", measured["latencies"], measured["errors"], measured["elapsed"], concurrency))
+
+                async def login(i: int) -> int:
+                    response = await expect(await client.post(
+                        "/auth/token", data={"username": f"{prefix}_{i}", "password": "benchmark"}
+                    ))
+                    tokens.append(response.json()["access_token"])
+                    return 0
+
+                measured = await run_concurrently(args.requests, concurrency, login)
+                results.append(summarize("login", measured["latencies"], measured["errors"], measured["elapsed"], concurrency))
+                print(f"register/login con concurrencia {concurrency} completados")
+            if not tokens:
+                raise RuntimeError("No se pudo iniciar sesión con ningún usuario")
+
+            headers = lambda i: {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+            for size in sizes:
+                # Un archivo de muestra por tamaño; cada subida usa otra ubicación
+                # para que la deduplicación no evite el cifrado
+                path = os.path.join(os.getcwd(), f"sample_{size}")
+                with open(path, "wb") as f:
+                    remaining = size
+                    while remaining:
+                        block = min(remaining, 8 * 1024 * 1024)
+                        f.write(os.urandom(block) if not args.compressible else b"geocrypt,benchmark\n" * (block // 19 + 1))
+                        remaining -= block
+                    f.truncate(size)
+
+                for concurrency in levels:
+                    uploaded = []
+
+                    async def upload(i: int) -> int:
+                        latitude, longitude = random_location()
+                        with open(path, "rb") as sample:
+                            response = await expect(await client.post(
+                                "/files/upload",
+                                headers=headers(i),
+                                files={"file": (os.path.basename(path), sample, "application/octet-stream")},
+                                data={"latitude": str(latitude), "longitude": str(longitude)},
+                            ))
+                        uploaded.append((i, response.json()["file_id"], geohash2.encode(latitude, longitude, precision=7)))
+                        return size
+
+                    count = max(1, args.requests if size <= UNITS["MB"] else args.requests // 5)
+                    measured = await run_concurrently(count, concurrency, upload)
+                    results.append(summarize("upload", measured["latencies"], measured["errors"], measured["elapsed"],
+                                             concurrency, size, measured["transferred"]))
+
+                    async def download(i: int) -> int:
+                        owner, file_id, gh = uploaded[i % len(uploaded)]
+                        received = 0
+                        async with client.stream(
+                            "GET", f"/files/download/{file_id}", params={"geohash": gh}, headers=headers(owner)
+                        ) as response:
+                            await expect(response)
+                            async for chunk in response.aiter_bytes():
+                                received += len(chunk)
+                        if received != size:
+                            raise RuntimeError(f"Descarga incompleta: {received} de {size} bytes")
+                        return received
+
+                    if uploaded:
+                        measured = await run_concurrently(count, concurrency, download)
+                        results.append(summarize("download", measured["latencies"], measured["errors"], measured["elapsed"],
+                                                 concurrency, size, measured["transferred"]))
+                    print(f"upload/download de {format_size(size)} con concurrencia {concurrency} completados")
+                os.remove(path)
+
+            for concurrency in levels:
+                async def list_files(i: int) -> int:
+                    response = await expect(await client.get("/files/", params={"limit": 100}, headers=headers(i)))
+                    return len(response.content)
+
+                measured = await run_concurrently(args.requests, concurrency, list_files)
+                results.append(summarize("list", measured["latencies"], measured["errors"], measured["elapsed"],
+                                         concurrency, transferred=measured["transferred"]))
+    finally:
+        await main.app.router.shutdown()
+    return results, cold_start
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def result_key(result: dict) -> str:
+    return f"{result['operation']}|{result['size_label']}|{result['concurrency']}"
+
+def compare(results: List[dict], baseline_path: str, threshold: float) -> List[str]:
+    """Medidas cuyo p95 empeora más que el umbral respecto a la referencia."""
+    with open(baseline_path) as f:
+        baseline = {result_key(result): result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result_key(result))
+        if previous is None or not previous["p95_ms"]:
+            continue
+        change = result["p95_ms"] / previous["p95_ms"] - 1
+        if change > threshold:
+            regressions.append(
+                f"{result_key(result)}: p95 {previous['p95_ms']} ms -> {result['p95_ms']} ms (+{change:.0%})"
+            )
+    return regressions
+
+def print_table(results: List[dict]):
+    print(f"\n{'operación':<10}{'tamaño':>8}{'conc':>6}{'req':>6}{'err':>5}{'rps':>10}{'MB/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for r in results:
+        print(
+            f"{r['operation']:<10}{r['size_label'] or '-':>8}{r['concurrency']:>6}{r['requests']:>6}{r['errors']:>5}"
+            f"{r['throughput_rps']:>10}{r['throughput_bytes_s'] / UNITS['MB']:>9.2f}"
+            f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1KB,1MB,16MB", help="Tamaños de archivo separados por comas (1KB a 1GB)")
+    parser.add_argument("--concurrency", default="1,8", help="Niveles de concurrencia separados por comas")
+    parser.add_argument("--requests", type=int, default=50, help="Peticiones por medida (una quinta parte para archivos > 1MB)")
+    parser.add_argument("--compressible", action="store_true", help="Usar contenido de texto en lugar de bytes aleatorios")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None, help="Coste de bcrypt durante el benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Archivo JSON de resultados")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Empeoramiento de p95 tolerado (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Las rutas se resuelven antes de cambiar al directorio temporal
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+    if args.bcrypt_rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    workdir = tempfile.mkdtemp(prefix="geocrypt-benchmark-")
+    started = datetime.utcnow()
+    mock = prepare_environment(workdir)
+    try:
+        results, cold_start = asyncio.run(benchmark(args))
+    finally:
+        mock.stop()
+
+    report = {
+        "started_at": started.isoformat() + "Z",
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {
+            "sizes": args.sizes,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "compressible": args.compressible,
+            "bcrypt_rounds": int(os.getenv("BCRYPT_ROUNDS", 12)),
+            "seed": args.seed,
+        },
+        "cold_start": cold_start,
+        "results": results,
+    }
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResultados guardados en {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for regression in regressions:
+            print(f"REGRESIÓN {regression}")
+        if regressions:
+            sys.exit(1)
+        print("Sin regresiones respecto a la referencia")
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,117 @@
+import logging
 import os
-import boto3
+import threading
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 # Cargar variables de entorno desde .env
 load_dotenv()
 
-# Configuración de S3
-try:
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_DEFAULT_REGION', 'us-east-1')
-    )
-    print("Cliente S3 creado exitosamente")
-except Exception as e:
-    print(f"Error al crear cliente S3: {str(e)}")
-    raise
+# Subidas por lotes: archivos como máximo y archivos cifrados/subidos en paralelo
+UPLOAD_BATCH_MAX_FILES = max(int(os.getenv('UPLOAD_BATCH_MAX_FILES', 100)), 1)
+UPLOAD_BATCH_CONCURRENCY = max(int(os.getenv('UPLOAD_BATCH_CONCURRENCY', 8)), 1)
+
+# Subidas asíncronas: directorio de los archivos recibidos, workers, trabajos en cola
+# como máximo antes de responder 503 e intentos por trabajo
+UPLOAD_JOBS_DIR = os.getenv('UPLOAD_JOBS_DIR', 'jobs')
+UPLOAD_JOB_WORKERS = max(int(os.getenv('UPLOAD_JOB_WORKERS', 2)), 1)
+UPLOAD_JOBS_MAX_PENDING = max(int(os.getenv('UPLOAD_JOBS_MAX_PENDING', 100)), 1)
+UPLOAD_JOB_MAX_ATTEMPTS = max(int(os.getenv('UPLOAD_JOB_MAX_ATTEMPTS', 3)), 1)
+
+# Exportación ZIP: descargas anticipadas y tamaño máximo de objeto que se anticipa en memoria
+EXPORT_PREFETCH_WINDOW = max(int(os.getenv('EXPORT_PREFETCH_WINDOW', 8)), 1)
+EXPORT_PREFETCH_MAX_BYTES = int(os.getenv('EXPORT_PREFETCH_MAX_BYTES', 8 * 1024 * 1024))
+
+# Compresión zstd previa al cifrado (solo si el contenido se reduce) y su nivel
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ZSTD_LEVEL = int(os.getenv('ZSTD_LEVEL', 3))
+
+# Operaciones S3 simultáneas por worker y tamaño del pool de conexiones HTTP
+S3_MAX_INFLIGHT = max(int(os.getenv('S3_MAX_INFLIGHT', 32)), 1)
+S3_MAX_POOL_CONNECTIONS = max(int(os.getenv('S3_MAX_POOL_CONNECTIONS', S3_MAX_INFLIGHT)), 1)
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', 5))
+
+# Configuración de S3: el cliente se crea en el primer uso (o en el calentamiento
+# al arrancar), de modo que importar la aplicación no espera a boto3 ni a S3
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                import boto3
+                from botocore.config import Config
+                try:
+                    _s3_client = boto3.client(
+                        's3',
+                        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                        region_name=os.getenv('AWS_DEFAULT_REGION', 'us-east-1'),
+                        endpoint_url=os.getenv('S3_ENDPOINT_URL') or None,  # Permite usar un S3 local (moto, minio)
+                        config=Config(
+                            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                            connect_timeout=S3_CONNECT_TIMEOUT,
+                            retries={'max_attempts': 3, 'mode': 'standard'}
+                        )
+                    )
+                    logger.info("Cliente S3 creado exitosamente")
+                except Exception as e:
+                    logger.error("Error al crear cliente S3: %s", e)
+                    raise
+    return _s3_client
 
 BUCKET_NAME = os.getenv('AWS_BUCKET_NAME')
 if not BUCKET_NAME:
-    print("ADVERTENCIA: AWS_BUCKET_NAME no está configurado en las variables de entorno")
+    logger.warning("AWS_BUCKET_NAME no está configurado en las variables de entorno")
     BUCKET_NAME = "geocrypt-files"  # Valor por defecto para pruebas
-    print(f"Usando bucket por defecto: {BUCKET_NAME}")
-
-# Verificar acceso a S3
-try:
-    s3.head_bucket(Bucket=BUCKET_NAME)
-    print(f"Acceso al bucket {BUCKET_NAME} verificado")
-except Exception as e:
-    print(f"Error al verificar acceso al bucket: {str(e)}")
-    print("ADVERTENCIA: No se pudo verificar el acceso al bucket S3") 
\ No newline at end of file
+    logger.info("Usando bucket por defecto: %s", BUCKET_NAME)
+
+# Subidas multiparte: los objetos mayores que una parte se suben por partes en paralelo
+S3_MULTIPART_PART_SIZE = max(int(os.getenv('S3_MULTIPART_PART_SIZE', 8 * 1024 * 1024)), 5 * 1024 * 1024)
+S3_MULTIPART_CONCURRENCY = max(int(os.getenv('S3_MULTIPART_CONCURRENCY', 4)), 1)
+S3_PART_MAX_RETRIES = max(int(os.getenv('S3_PART_MAX_RETRIES', 3)), 0)
+
+# Almacenamiento de blobs: s3, local o memory; con write-behind las subidas se
+# confirman al guardarlas en WRITE_BEHIND_DIR y un worker las replica después
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 's3').lower()
+STORAGE_LOCAL_DIR = os.getenv('STORAGE_LOCAL_DIR', 'storage')
+STORAGE_WRITE_BEHIND = os.getenv('STORAGE_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+WRITE_BEHIND_DIR = os.getenv('WRITE_BEHIND_DIR', 'uploads')
+WRITE_BEHIND_BATCH_SIZE = max(int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 16)), 1)
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv('WRITE_BEHIND_MAX_BACKOFF', 60))
+
+# Caché de lectura del texto cifrado: bytes en memoria, bytes en disco (0 desactiva
+# cada nivel) y tamaño máximo de objeto que se cachea
+BLOB_CACHE_MEMORY_BYTES = max(int(os.getenv('BLOB_CACHE_MEMORY_BYTES', 64 * 1024 * 1024)), 0)
+BLOB_CACHE_DISK_BYTES = max(int(os.getenv('BLOB_CACHE_DISK_BYTES', 0)), 0)
+BLOB_CACHE_DIR = os.getenv('BLOB_CACHE_DIR', 'cache')
+BLOB_CACHE_MAX_OBJECT_BYTES = max(int(os.getenv('BLOB_CACHE_MAX_OBJECT_BYTES', 32 * 1024 * 1024)), 0)
+
+# Transferencias directas con S3: validez de las URLs prefirmadas (segundos) y
+# tamaño máximo de una subida prefirmada (límite de un PUT de S3)
+PRESIGNED_URL_EXPIRES = max(int(os.getenv('PRESIGNED_URL_EXPIRES', 300)), 1)
+PRESIGNED_UPLOAD_MAX_BYTES = int(os.getenv('PRESIGNED_UPLOAD_MAX_BYTES', 5 * 1024 ** 3))
+
+# Subidas reanudables: tamaño de cada tramo (se redondea a segmentos completos y no
+# baja de 5 MiB, el mínimo de una parte de S3), tamaño máximo, segundos sin actividad
+# tras los que caduca una sesión e intervalo de la limpieza de las caducadas
+UPLOAD_SESSION_CHUNK_SIZE = max(int(os.getenv('UPLOAD_SESSION_CHUNK_SIZE', 8 * 1024 ** 2)), 5 * 1024 ** 2)
+UPLOAD_SESSION_MAX_BYTES = int(os.getenv('UPLOAD_SESSION_MAX_BYTES', 5 * 1024 ** 3))
+UPLOAD_SESSION_TTL = max(float(os.getenv('UPLOAD_SESSION_TTL', 86400)), 1)
+UPLOAD_SESSION_CLEANUP_INTERVAL = max(float(os.getenv('UPLOAD_SESSION_CLEANUP_INTERVAL', 300)), 1)
+
+# Borrado diferido: los objetos sin referencias se marcan con una lápida y un worker
+# los borra por lotes (DeleteObjects admite 1000 claves por llamada), reintentando
+# con espera exponencial; DELETE_BATCH_MAX_FILES limita los archivos por petición
+GC_INTERVAL = max(float(os.getenv('GC_INTERVAL', 30)), 0.1)
+GC_BATCH_SIZE = max(int(os.getenv('GC_BATCH_SIZE', 1000)), 1)
+GC_MAX_BACKOFF = float(os.getenv('GC_MAX_BACKOFF', 3600))
+GC_CLAIM_TIMEOUT = float(os.getenv('GC_CLAIM_TIMEOUT', 300))
+DELETE_BATCH_MAX_FILES = max(int(os.getenv('DELETE_BATCH_MAX_FILES', 1000)), 1)
+
+# Calentamiento en segundo plano al arrancar: espera máxima entre reintentos
+# cuando la base de datos o S3 no responden
+WARMUP_MAX_BACKOFF = float(os.getenv('WARMUP_MAX_BACKOFF', 30))
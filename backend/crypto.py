@@ -1,34 +1,501 @@
+import asyncio
+import hashlib
+import hmac
+import struct
+import time
+from typing import AsyncIterator, Iterable, Iterator, Optional, Tuple
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 import geohash2
+import metrics
+
+try:
+    import zstandard
+except ImportError:  # La compresión es opcional
+    zstandard = None
+
+# Formato segmentado:
+#   cabecera = MAGIC (4) + versión (1) + flags (1) + tamaño de segmento (4)
+#   segmento = nonce (12) + texto cifrado (<= tamaño de segmento) + tag (16)
+# Cada segmento se autentica con la cabecera, su índice y si es el último,
+# de modo que no se pueden reordenar, truncar ni mezclar segmentos.
+MAGIC = b"GCRY"
+FORMAT_VERSION = 1
+HEADER = struct.Struct(">4sBBI")
+HEADER_SIZE = HEADER.size
+NONCE_SIZE = 12
+TAG_SIZE = 16
+SEGMENT_OVERHEAD = NONCE_SIZE + TAG_SIZE
+DEFAULT_SEGMENT_SIZE = 64 * 1024
+
+# Flags de la cabecera
+FLAG_ZSTD = 0x01  # El texto plano se comprimió con zstd antes de cifrarse
+
+# Tipos de contenido que ya vienen comprimidos y no merece la pena recomprimir
+INCOMPRESSIBLE_PREFIXES = ("image/", "video/", "audio/")
+INCOMPRESSIBLE_TYPES = {
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/vnd.rar",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/zstd",
+    "application/pdf",
+}
+# Excepciones de texto dentro de los prefijos anteriores
+COMPRESSIBLE_TYPES = {"image/svg+xml", "image/bmp", "image/x-ms-bmp", "image/tiff"}
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+COMPRESSION_MIN_RATIO = 0.9  # Comprimir solo si la muestra se reduce al menos un 10 %
+
+# Formato antiguo de un solo bloque: nonce (16) + tag (16) + texto cifrado
+LEGACY_NONCE_SIZE = 16
+LEGACY_TAG_SIZE = 16
 
 def derive_key_from_location(latitude: float, longitude: float) -> bytes:
     """Deriva una clave AES de 32 bytes a partir de la ubicación."""
     gh = geohash2.encode(latitude, longitude, precision=7)
+    return derive_key_from_geohash(gh)
+
+def derive_key_from_geohash(gh: str) -> bytes:
+    """Deriva la clave AES de 32 bytes a partir de un geohash de precisión 7."""
     # Usar el geohash como semilla para generar una clave de 32 bytes
     key = gh.encode('utf-8') * (32 // len(gh) + 1)
     return key[:32]
 
-def encrypt_file(content: bytes, latitude: float, longitude: float) -> bytes:
-    """Cifra el contenido del archivo usando AES en modo GCM."""
-    key = derive_key_from_location(latitude, longitude)
-    cipher = AES.new(key, AES.MODE_GCM)
-    ciphertext, tag = cipher.encrypt_and_digest(content)
-    
-    # Combinar nonce, tag y texto cifrado
-    return cipher.nonce + tag + ciphertext
+def build_header(segment_size: int = DEFAULT_SEGMENT_SIZE, flags: int = 0) -> bytes:
+    """Construye la cabecera versionada del formato segmentado."""
+    return HEADER.pack(MAGIC, FORMAT_VERSION, flags, segment_size)
 
-def decrypt_file(encrypted_content: bytes, latitude: float, longitude: float) -> bytes:
-    """Descifra el contenido del archivo usando AES en modo GCM."""
-    key = derive_key_from_location(latitude, longitude)
-    
+def parse_header(data: bytes) -> Optional[Tuple[int, int, int]]:
+    """Devuelve (versión, flags, tamaño de segmento) o None si no es formato segmentado."""
+    if len(data) < HEADER_SIZE:
+        return None
+    magic, version, flags, segment_size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or segment_size <= 0:
+        return None
+    return version, flags, segment_size
+
+def _segment_aad(header: bytes, index: int, last: bool) -> bytes:
+    return header + struct.pack(">Q?", index, last)
+
+def encrypt_segment(key: bytes, header: bytes, index: int, plaintext: bytes, last: bool) -> bytes:
+    """Cifra un segmento con su propio nonce y tag."""
+    cipher = AES.new(key, AES.MODE_GCM, nonce=get_random_bytes(NONCE_SIZE))
+    cipher.update(_segment_aad(header, index, last))
+    ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+    return cipher.nonce + ciphertext + tag
+
+def decrypt_segment(key: bytes, header: bytes, index: int, segment: bytes, last: bool) -> bytes:
+    """Descifra y verifica un segmento."""
+    if len(segment) < SEGMENT_OVERHEAD:
+        raise ValueError("Segmento cifrado truncado")
+    nonce = segment[:NONCE_SIZE]
+    ciphertext = segment[NONCE_SIZE:-TAG_SIZE]
+    tag = segment[-TAG_SIZE:]
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(_segment_aad(header, index, last))
+    return cipher.decrypt_and_verify(ciphertext, tag)
+
+def compression_available() -> bool:
+    return zstandard is not None
+
+def should_compress(content_type: Optional[str], sample: bytes) -> bool:
+    """Decide si comprimir según el tipo de contenido y lo que se reduce una muestra."""
+    if zstandard is None or not sample:
+        return False
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type not in COMPRESSIBLE_TYPES and (
+        content_type in INCOMPRESSIBLE_TYPES or content_type.startswith(INCOMPRESSIBLE_PREFIXES)
+    ):
+        return False
+    compressed = zstandard.ZstdCompressor(level=1).compress(sample[:COMPRESSION_SAMPLE_SIZE])
+    return len(compressed) < len(sample[:COMPRESSION_SAMPLE_SIZE]) * COMPRESSION_MIN_RATIO
+
+class StreamEncryptor:
+    """Cifra un flujo de bytes en segmentos de tamaño fijo con memoria acotada.
+
+    Con compression_level se comprime con zstd antes de segmentar; el flag de
+    la cabecera lo indica al descifrar.
+    """
+
+    def __init__(
+        self,
+        key: bytes,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        compression_level: Optional[int] = None
+    ):
+        if compression_level is not None and zstandard is None:
+            raise RuntimeError("zstandard no está instalado")
+        self.key = key
+        self.segment_size = segment_size
+        self.compressed = compression_level is not None
+        self.header = build_header(segment_size, FLAG_ZSTD if self.compressed else 0)
+        self.plaintext_size = 0
+        self.stored_size = 0
+        self.ciphertext_size = 0
+        self.compress_seconds = 0.0
+        self._compressor = (
+            zstandard.ZstdCompressor(level=compression_level).compressobj()
+            if self.compressed else None
+        )
+        self._buffer = bytearray()
+        self._index = 0
+        self._started = False
+        self._finalized = False
+
+    def _emit(self, plaintext: bytes, last: bool) -> bytes:
+        segment = encrypt_segment(self.key, self.header, self._index, plaintext, last)
+        self._index += 1
+        return segment
+
+    def update(self, data: bytes) -> bytes:
+        """Añade texto plano y devuelve los segmentos completos ya cifrados."""
+        if self._finalized:
+            raise ValueError("El cifrador ya fue finalizado")
+        self.plaintext_size += len(data)
+        if self._compressor is not None:
+            started = time.thread_time()
+            data = self._compressor.compress(data)
+            self.compress_seconds += time.thread_time() - started
+        self.stored_size += len(data)
+        self._buffer += data
+        out = bytearray()
+        if not self._started:
+            out += self.header
+            self._started = True
+        # Se retiene siempre el último segmento para poder marcarlo como final
+        while len(self._buffer) > self.segment_size:
+            out += self._emit(bytes(self._buffer[:self.segment_size]), last=False)
+            del self._buffer[:self.segment_size]
+        self.ciphertext_size += len(out)
+        return bytes(out)
+
+    def finalize(self) -> bytes:
+        """Cifra el último segmento pendiente."""
+        if self._finalized:
+            raise ValueError("El cifrador ya fue finalizado")
+        if self._compressor is not None:
+            started = time.thread_time()
+            tail = self._compressor.flush()
+            self.compress_seconds += time.thread_time() - started
+            self.stored_size += len(tail)
+            self._buffer += tail
+        out = bytearray()
+        if not self._started:
+            out += self.header
+            self._started = True
+        # Los segmentos completos que deje la compresión final van antes del último
+        while len(self._buffer) > self.segment_size:
+            out += self._emit(bytes(self._buffer[:self.segment_size]), last=False)
+            del self._buffer[:self.segment_size]
+        out += self._emit(bytes(self._buffer), last=True)
+        self._buffer.clear()
+        self._finalized = True
+        self.ciphertext_size += len(out)
+        return bytes(out)
+
+    @property
+    def compression_ratio(self) -> float:
+        """Tamaño almacenado / tamaño original (1.0 sin compresión)."""
+        return self.stored_size / self.plaintext_size if self.plaintext_size else 1.0
+
+def segment_count(plaintext_size: int, segment_size: int = DEFAULT_SEGMENT_SIZE) -> int:
+    """Número de segmentos de un blob segmentado (al menos uno, aunque esté vacío)."""
+    return max(1, -(-plaintext_size // segment_size))
+
+def encrypted_size(plaintext_size: int, segment_size: int = DEFAULT_SEGMENT_SIZE) -> int:
+    """Tamaño total del blob segmentado para un texto plano dado."""
+    return HEADER_SIZE + plaintext_size + segment_count(plaintext_size, segment_size) * SEGMENT_OVERHEAD
+
+def encrypt_segments(
+    key: bytes,
+    data: bytes,
+    first_index: int,
+    last: bool,
+    segment_size: int = DEFAULT_SEGMENT_SIZE
+) -> bytes:
+    """Cifra un tramo de texto plano que empieza en el segmento first_index, sin compresión.
+
+    Cada tramo se cifra por separado y se puede repetir sin tocar los demás
+    (subidas reanudables): el primero lleva la cabecera y solo el que tiene
+    last incluye el segmento final.
+    """
+    if not last and (not data or len(data) % segment_size):
+        raise ValueError("Un tramo intermedio debe ocupar segmentos completos")
+    header = build_header(segment_size)
+    count = segment_count(len(data), segment_size) if last else len(data) // segment_size
+    out = bytearray(header if first_index == 0 else b"")
+    for i in range(count):
+        segment = data[i * segment_size:(i + 1) * segment_size]
+        out += encrypt_segment(key, header, first_index + i, segment, last=last and i == count - 1)
+    return bytes(out)
+
+def plaintext_size(ciphertext_size: int, segment_size: int = DEFAULT_SEGMENT_SIZE) -> Optional[int]:
+    """Tamaño del texto plano de un blob segmentado sin comprimir, o None si no cuadra."""
+    body = ciphertext_size - HEADER_SIZE
+    if body < SEGMENT_OVERHEAD:
+        return None
+    full, rest = divmod(body, segment_size + SEGMENT_OVERHEAD)
+    if rest == 0:
+        return full * segment_size
+    if rest < SEGMENT_OVERHEAD:
+        return None
+    return full * segment_size + rest - SEGMENT_OVERHEAD
+
+def format_parameters(parsed_header: Optional[Tuple[int, int, int]]) -> dict:
+    """Parámetros que necesita un cliente para descifrar el blob por su cuenta."""
+    if parsed_header is None:
+        return {
+            "format": "legacy",
+            "cipher": "AES-256-GCM",
+            "layout": "nonce || tag || ciphertext",
+            "nonce_size": LEGACY_NONCE_SIZE,
+            "tag_size": LEGACY_TAG_SIZE,
+        }
+    version, flags, segment_size = parsed_header
+    return {
+        "format": "segmented",
+        "version": version,
+        "cipher": "AES-256-GCM",
+        "header_size": HEADER_SIZE,
+        "segment_size": segment_size,
+        "layout": "header || (nonce || ciphertext || tag)*",
+        "nonce_size": NONCE_SIZE,
+        "tag_size": TAG_SIZE,
+        "aad": "header || uint64_be(index) || uint8(last)",
+        "compression": "zstd" if flags & FLAG_ZSTD else None,
+    }
+
+def encrypted_range(start: int, end: int, segment_size: int) -> Tuple[int, int, int, int]:
+    """Traduce un rango de texto plano [start, end] al rango cifrado que lo contiene.
+
+    Devuelve (inicio cifrado, fin cifrado inclusivo, primer segmento, bytes a descartar).
+    """
+    first = start // segment_size
+    last = end // segment_size
+    encrypted_segment = segment_size + SEGMENT_OVERHEAD
+    return (
+        HEADER_SIZE + first * encrypted_segment,
+        HEADER_SIZE + (last + 1) * encrypted_segment - 1,
+        first,
+        start - first * segment_size,
+    )
+
+class StreamDecryptor:
+    """Descifra de forma incremental blobs segmentados o del formato antiguo.
+
+    Para descifrar solo un rango de segmentos se pasa la cabecera ya leída, el
+    índice del primer segmento y el total de segmentos del blob.
+    """
+
+    def __init__(
+        self,
+        key: bytes,
+        header: Optional[bytes] = None,
+        first_index: int = 0,
+        total_segments: Optional[int] = None
+    ):
+        self.key = key
+        self.header: Optional[bytes] = None
+        self.segment_size: Optional[int] = None
+        self.flags = 0
+        self.legacy = False
+        self._decompressor = None
+        self.total_segments = total_segments
+        self._buffer = bytearray()
+        self._index = first_index
+        self._finalized = False
+        if header is not None:
+            parsed = parse_header(header)
+            if parsed is None:
+                raise ValueError("Cabecera de blob cifrado no válida")
+            self._set_header(header[:HEADER_SIZE], parsed)
+
+    def _set_header(self, header: bytes, parsed: Tuple[int, int, int]):
+        self.header = header
+        self.flags = parsed[1]
+        self.segment_size = parsed[2]
+        if self.flags & FLAG_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("El blob está comprimido con zstd y zstandard no está instalado")
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def _plaintext(self, data: bytes) -> bytes:
+        if self._decompressor is None or not data:
+            return data
+        return self._decompressor.decompress(data)
+
+    @property
+    def _encrypted_segment_size(self) -> int:
+        return self.segment_size + SEGMENT_OVERHEAD
+
+    def _read_header(self) -> bool:
+        if len(self._buffer) < HEADER_SIZE:
+            return False
+        parsed = parse_header(bytes(self._buffer[:HEADER_SIZE]))
+        if parsed is None:
+            # Sin cabecera: blob de un solo bloque del formato antiguo
+            self.legacy = True
+        else:
+            self._set_header(bytes(self._buffer[:HEADER_SIZE]), parsed)
+            del self._buffer[:HEADER_SIZE]
+        return True
+
+    def update(self, data: bytes) -> bytes:
+        """Añade texto cifrado y devuelve el texto plano ya verificado."""
+        if self._finalized:
+            raise ValueError("El descifrador ya fue finalizado")
+        self._buffer += data
+        if self.header is None and not self.legacy and not self._read_header():
+            return b""
+        if self.legacy:
+            # El formato antiguo solo se puede verificar con el blob completo
+            return b""
+        out = bytearray()
+        size = self._encrypted_segment_size
+        while len(self._buffer) > size:
+            out += decrypt_segment(self.key, self.header, self._index, bytes(self._buffer[:size]), last=False)
+            del self._buffer[:size]
+            self._index += 1
+        return self._plaintext(bytes(out))
+
+    def finalize(self) -> bytes:
+        """Descifra el último segmento y verifica que el flujo esté completo."""
+        if self._finalized:
+            raise ValueError("El descifrador ya fue finalizado")
+        self._finalized = True
+        if self.header is None and not self.legacy:
+            # Blob más corto que una cabecera: solo puede ser del formato antiguo
+            self.legacy = True
+        if self.legacy:
+            content = bytes(self._buffer)
+            self._buffer.clear()
+            return _decrypt_legacy(self.key, content)
+        last = self.total_segments is None or self._index == self.total_segments - 1
+        out = decrypt_segment(self.key, self.header, self._index, bytes(self._buffer), last=last)
+        self._buffer.clear()
+        return self._plaintext(out)
+
+def _decrypt_legacy(key: bytes, encrypted_content: bytes) -> bytes:
     # Separar nonce, tag y texto cifrado
-    nonce = encrypted_content[:16]
-    tag = encrypted_content[16:32]
-    ciphertext = encrypted_content[32:]
-    
+    nonce = encrypted_content[:LEGACY_NONCE_SIZE]
+    tag = encrypted_content[LEGACY_NONCE_SIZE:LEGACY_NONCE_SIZE + LEGACY_TAG_SIZE]
+    ciphertext = encrypted_content[LEGACY_NONCE_SIZE + LEGACY_TAG_SIZE:]
+
     # Crear cipher con el nonce original
     cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
-    
+
     # Descifrar y verificar
-    return cipher.decrypt_and_verify(ciphertext, tag) 
\ No newline at end of file
+    return cipher.decrypt_and_verify(ciphertext, tag)
+
+def encrypt_chunks(
+    chunks: Iterable[bytes],
+    key: bytes,
+    segment_size: int = DEFAULT_SEGMENT_SIZE,
+    compression_level: Optional[int] = None
+) -> Iterator[bytes]:
+    """Generador que cifra un iterable de bloques de texto plano."""
+    encryptor = StreamEncryptor(key, segment_size, compression_level)
+    for chunk in chunks:
+        out = encryptor.update(chunk)
+        if out:
+            yield out
+    yield encryptor.finalize()
+
+def decrypt_chunks(chunks: Iterable[bytes], key: bytes) -> Iterator[bytes]:
+    """Generador que descifra un iterable de bloques de texto cifrado."""
+    decryptor = StreamDecryptor(key)
+    for chunk in chunks:
+        out = decryptor.update(chunk)
+        if out:
+            yield out
+    out = decryptor.finalize()
+    if out:
+        yield out
+
+async def encrypt_upload(upload, encryptor: StreamEncryptor) -> AsyncIterator[bytes]:
+    """Lee un UploadFile en bloques acotados y produce el texto cifrado segmentado.
+
+    El cifrado se ejecuta en el executor por defecto para no bloquear el event
+    loop y permitir cifrar varios archivos en paralelo.
+    """
+    loop = asyncio.get_running_loop()
+    encrypt_seconds = 0.0
+    while True:
+        chunk = await upload.read(encryptor.segment_size)
+        if not chunk:
+            break
+        started = time.perf_counter()
+        out = await loop.run_in_executor(None, encryptor.update, chunk)
+        encrypt_seconds += time.perf_counter() - started
+        if out:
+            yield out
+    started = time.perf_counter()
+    final = encryptor.finalize()
+    metrics.observe_stage("encrypt", encrypt_seconds + time.perf_counter() - started)
+    yield final
+
+async def digest_upload(upload, key: bytes, chunk_size: int = DEFAULT_SEGMENT_SIZE) -> Tuple[str, int]:
+    """Calcula HMAC-SHA256 del texto plano con la clave de ubicación leyendo en bloques.
+
+    Al estar ligado a la clave, el resumen identifica el contenido dentro de
+    una ubicación sin revelar el hash del archivo a quien no la conoce.
+    """
+    loop = asyncio.get_running_loop()
+    mac = hmac.new(key, digestmod=hashlib.sha256)
+    size = 0
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        await loop.run_in_executor(None, mac.update, chunk)
+    return mac.hexdigest(), size
+
+async def decrypt_stream(
+    chunks: AsyncIterator[bytes],
+    key: bytes,
+    decryptor: Optional[StreamDecryptor] = None
+) -> AsyncIterator[bytes]:
+    """Descifra un flujo asíncrono de bloques de texto cifrado."""
+    decryptor = decryptor or StreamDecryptor(key)
+    decrypt_seconds = 0.0
+    sent = 0
+    try:
+        async for chunk in chunks:
+            started = time.perf_counter()
+            out = decryptor.update(chunk)
+            decrypt_seconds += time.perf_counter() - started
+            if out:
+                sent += len(out)
+                yield out
+        out = decryptor.finalize()
+        if out:
+            sent += len(out)
+            yield out
+    finally:
+        # También cuenta las descargas que el cliente corta a mitad
+        metrics.observe_stage("decrypt", decrypt_seconds)
+        metrics.BYTES_OUT.inc(sent)
+
+def encrypt_file(
+    content: bytes,
+    latitude: float,
+    longitude: float,
+    compression_level: Optional[int] = None
+) -> bytes:
+    """Cifra el contenido del archivo usando AES en modo GCM (formato segmentado)."""
+    key = derive_key_from_location(latitude, longitude)
+    return b"".join(encrypt_chunks([content], key, compression_level=compression_level))
+
+def decrypt_file(encrypted_content: bytes, latitude: float, longitude: float) -> bytes:
+    """Descifra el contenido del archivo usando AES en modo GCM."""
+    key = derive_key_from_location(latitude, longitude)
+    return decrypt_bytes(encrypted_content, key)
+
+def decrypt_bytes(encrypted_content: bytes, key: bytes) -> bytes:
+    """Descifra un blob completo (segmentado o antiguo) con una clave ya derivada."""
+    return b"".join(decrypt_chunks([encrypted_content], key))
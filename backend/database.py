@@ -1,18 +1,127 @@
-from sqlmodel import SQLModel, create_engine, Session
+import asyncio
+from typing import Optional
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 import os
 
-# Configuración de la base de datos SQLite
-DATABASE_URL = "sqlite:///./geocrypt.db"
-engine = create_engine(
-    DATABASE_URL, 
-    echo=True,  # Habilitar logs de SQL
-    connect_args={"check_same_thread": False}  # Permitir acceso desde múltiples hilos
-)
+# Configuración de la base de datos (SQLite por defecto, Postgres vía DATABASE_URL)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./geocrypt.db")
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "false").lower() in ("1", "true", "yes")  # Logs de SQL
+DATABASE_POOL_SIZE = max(int(os.getenv("DATABASE_POOL_SIZE", 5)), 1)
+DATABASE_MAX_OVERFLOW = max(int(os.getenv("DATABASE_MAX_OVERFLOW", 10)), 0)
 
-def init_db():
+def _async_url(url: str) -> str:
+    # Usar los drivers asíncronos aunque la URL indique el driver por defecto
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    if url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    return url
+
+def _create_engine():
+    url = _async_url(DATABASE_URL)
+    options = {"echo": DATABASE_ECHO}
+    if url.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+        if ":memory:" in url or url.endswith("://"):
+            # Una base de datos en memoria solo existe dentro de su conexión
+            options["poolclass"] = StaticPool
+        else:
+            # aiosqlite usa NullPool por defecto: reutilizar conexiones ya configuradas
+            options["poolclass"] = AsyncAdaptedQueuePool
+            options["pool_size"] = DATABASE_POOL_SIZE
+            options["max_overflow"] = DATABASE_MAX_OVERFLOW
+    else:
+        options["pool_size"] = DATABASE_POOL_SIZE
+        options["max_overflow"] = DATABASE_MAX_OVERFLOW
+        options["pool_pre_ping"] = True
+    engine = create_async_engine(url, **options)
+    if url.startswith("sqlite"):
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL permite lecturas concurrentes con una escritura; NORMAL es seguro con WAL
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.close()
+
+# El engine se crea en el primer uso: importar el módulo no carga el driver ni conecta
+_engine = None
+_session_factory = None
+
+def get_engine():
+    global _engine, _session_factory
+    if _engine is None:
+        _engine = _create_engine()
+        _session_factory = sessionmaker(_engine, class_=AsyncSession, expire_on_commit=False)
+    return _engine
+
+def async_session() -> AsyncSession:
+    get_engine()
+    return _session_factory()
+
+# Índices que ya no forman parte del modelo (redundantes con uno compuesto)
+_OBSOLETE_INDEXES = ("ix_file_geohash",)
+
+def _create_all(connection):
     # Crear todas las tablas si no existen
-    SQLModel.metadata.create_all(engine)
+    SQLModel.metadata.create_all(connection)
+    # create_all no añade columnas ni índices nuevos a tablas que ya existían
+    inspector = inspect(connection)
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                # Sin valor para las filas existentes: hace falta una migración manual
+                raise RuntimeError(
+                    f'La columna obligatoria "{table.name}.{column.name}" no existe en la base de datos '
+                    "y no puede añadirse automáticamente; migra el esquema antes de arrancar"
+                )
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+            )
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    for name in _OBSOLETE_INDEXES:
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS "{name}"')
+
+_initialized = False
+_init_lock: Optional[asyncio.Lock] = None
+
+async def init_db():
+    # Se ejecuta una vez: en el calentamiento o en la primera petición que llegue antes
+    global _initialized, _init_lock
+    if _initialized:
+        return
+    if _init_lock is None:
+        _init_lock = asyncio.Lock()
+    async with _init_lock:
+        if not _initialized:
+            async with get_engine().begin() as connection:
+                await connection.run_sync(_create_all)
+            _initialized = True
+
+async def close_db():
+    # Cerrar las conexiones del pool (aiosqlite mantiene un hilo por conexión)
+    if _engine is not None:
+        await _engine.dispose()
 
-def get_session():
-    with Session(engine) as session:
-        yield session 
\ No newline at end of file
+async def get_session():
+    await init_db()
+    async with async_session() as session:
+        yield session
@@ -0,0 +1,147 @@
+import math
+from typing import List, Tuple
+import geohash2
+
+# Alfabeto base32 de geohash; su orden coincide con el orden lexicográfico ASCII
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def is_valid_geohash(value: str, max_length: int = 12) -> bool:
+    """Indica si la cadena es un geohash (o prefijo) no vacío."""
+    return 0 < len(value) <= max_length and all(char in BASE32 for char in value)
+
+def prefix_range(prefix: str) -> Tuple[str, str]:
+    """Devuelve (p, p_next) tal que geohash >= p AND geohash < p_next selecciona el prefijo."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def neighbors(gh: str) -> List[str]:
+    """Devuelve la celda y sus 8 vecinas (sin repetir) a la misma precisión."""
+    lat, lon, lat_err, lon_err = geohash2.decode_exactly(gh)
+    cells = []
+    for dy in (-1, 0, 1):
+        cell_lat = lat + 2 * lat_err * dy
+        if cell_lat < -90 or cell_lat > 90:
+            continue
+        for dx in (-1, 0, 1):
+            # Dar la vuelta en el antimeridiano
+            cell_lon = (lon + 2 * lon_err * dx + 180) % 360 - 180
+            cell = geohash2.encode(cell_lat, cell_lon, precision=len(gh))
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+EARTH_RADIUS_M = 6371008.8
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia en metros entre dos puntos sobre la esfera terrestre."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def bbox_for_radius(latitude: float, longitude: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """Caja (min_lon, min_lat, max_lon, max_lat) que contiene el círculo dado."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    min_lat = max(latitude - dlat, -90.0)
+    max_lat = min(latitude + dlat, 90.0)
+    cos_lat = math.cos(math.radians(latitude))
+    if max_lat >= 90.0 or min_lat <= -90.0 or cos_lat < 1e-9:
+        return -180.0, min_lat, 180.0, max_lat
+    dlon = math.degrees(radius_m / (EARTH_RADIUS_M * cos_lat))
+    if dlon >= 180.0:
+        return -180.0, min_lat, 180.0, max_lat
+    min_lon = (longitude - dlon + 180) % 360 - 180
+    max_lon = (longitude + dlon + 180) % 360 - 180
+    return min_lon, min_lat, max_lon, max_lat
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Alto y ancho en grados de una celda de la precisión dada."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** (bits - bits // 2)
+
+def _split_antimeridian(bbox: Tuple[float, float, float, float]) -> List[Tuple[float, float, float, float]]:
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon <= max_lon:
+        return [bbox]
+    return [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+
+def _grid_span(low: float, high: float, origin: float, size: float, cells: int) -> Tuple[int, int]:
+    first = int((low - origin) // size)
+    last = int((high - origin) // size)
+    return max(first, 0), min(last, cells - 1)
+
+def _cells_in_bbox(bbox: Tuple[float, float, float, float], precision: int) -> List[str]:
+    height, width = cell_size(precision)
+    rows, cols = round(180.0 / height), round(360.0 / width)
+    cells = []
+    for min_lon, min_lat, max_lon, max_lat in _split_antimeridian(bbox):
+        first_row, last_row = _grid_span(min_lat, max_lat, -90.0, height, rows)
+        first_col, last_col = _grid_span(min_lon, max_lon, -180.0, width, cols)
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                cells.append(geohash2.encode(
+                    -90.0 + (row + 0.5) * height,
+                    -180.0 + (col + 0.5) * width,
+                    precision=precision
+                ))
+    return cells
+
+def _count_cells(bbox: Tuple[float, float, float, float], precision: int) -> int:
+    height, width = cell_size(precision)
+    rows, cols = round(180.0 / height), round(360.0 / width)
+    total = 0
+    for min_lon, min_lat, max_lon, max_lat in _split_antimeridian(bbox):
+        first_row, last_row = _grid_span(min_lat, max_lat, -90.0, height, rows)
+        first_col, last_col = _grid_span(min_lon, max_lon, -180.0, width, cols)
+        total += (last_row - first_row + 1) * (last_col - first_col + 1)
+    return total
+
+def cover_bbox(
+    bbox: Tuple[float, float, float, float],
+    max_cells: int = 32,
+    max_precision: int = 7
+) -> List[str]:
+    """Conjunto mínimo de prefijos de geohash que cubre la caja (min_lon, min_lat, max_lon, max_lat).
+
+    Se elige la mayor precisión que no supere max_cells celdas y después se
+    sustituyen por su padre los grupos completos de 32 celdas hermanas.
+    """
+    precision = 1
+    for candidate in range(max_precision, 0, -1):
+        if _count_cells(bbox, candidate) <= max_cells:
+            precision = candidate
+            break
+    cells = set(_cells_in_bbox(bbox, precision))
+    # Fusionar hermanos completos en su celda padre
+    while True:
+        parents = {}
+        for cell in cells:
+            if len(cell) > 1:
+                parents.setdefault(cell[:-1], set()).add(cell)
+        complete = [parent for parent, children in parents.items() if len(children) == len(BASE32)]
+        if not complete:
+            break
+        for parent in complete:
+            cells -= parents[parent]
+            cells.add(parent)
+    return sorted(cells)
+
+def in_bbox(latitude: float, longitude: float, bbox: Tuple[float, float, float, float]) -> bool:
+    """Indica si el punto cae dentro de la caja (admite cajas que cruzan el antimeridiano)."""
+    return any(
+        min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon
+        for min_lon, min_lat, max_lon, max_lat in _split_antimeridian(bbox)
+    )
+
+def cell_bounds(gh: str) -> Tuple[float, float, float, float]:
+    """Caja (min_lon, min_lat, max_lon, max_lat) de la celda del geohash."""
+    lat, lon, lat_err, lon_err = geohash2.decode_exactly(gh)
+    return lon - lon_err, lat - lat_err, lon + lon_err, lat + lat_err
+
+def bbox_overlaps(cell: Tuple[float, float, float, float], bbox: Tuple[float, float, float, float]) -> bool:
+    """Indica si la celda se solapa con la caja (admite cajas que cruzan el antimeridiano)."""
+    cell_min_lon, cell_min_lat, cell_max_lon, cell_max_lat = cell
+    return any(
+        cell_min_lat <= max_lat and cell_max_lat >= min_lat and cell_min_lon <= max_lon and cell_max_lon >= min_lon
+        for min_lon, min_lat, max_lon, max_lat in _split_antimeridian(bbox)
+    )
@@ -1,28 +1,30 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, status
-from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select
-from typing import List
-import boto3
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from dotenv import load_dotenv
+import logging
 import os
-from datetime import timedelta, datetime
-from pydantic import BaseModel
+import time
 import auth
-import crypto
-from models import User, File, UserBase
-from database import init_db, get_session
-import geohash2
-from dotenv import load_dotenv
+import metrics
+from database import close_db
 from routes import auth_router, files_router
-from fastapi.middleware.cors import CORSMiddleware
-from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from schemas.auth import UserCreate, UserResponse
-from schemas.files import FileResponse, FileCreate
-import shutil
+from services.s3_service import S3Service
+from services.password_service import PasswordService
+from services.storage import storage
+from services.tombstone_service import TombstoneService
+from services.upload_jobs import UploadJobService
+from services.upload_session_service import UploadSessionService
+from services.warmup import WarmupService
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
 app = FastAPI()
 
 # Configuración de CORS
@@ -45,15 +47,102 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Inicializar la base de datos al arrancar
+if metrics.METRICS_ENABLED:
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        # La plantilla de la ruta mantiene acotado el número de series
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, route=path)
+        metrics.HTTP_REQUESTS.inc(method=request.method, route=path, status=response.status_code)
+        return response
+
+def _write_behind_pending() -> dict:
+    stats = storage.stats()
+    while stats is not None and "pending" not in stats:
+        stats = stats.get("inner")
+    return {(): stats["pending"]} if stats is not None else {}
+
+metrics.Gauge(
+    "geocrypt_s3_in_flight",
+    "Operaciones S3 en curso y en cola en este worker",
+    lambda: {
+        ("running",): S3Service.pool_stats()["in_flight"],
+        ("queued",): S3Service.pool_stats()["queued"],
+    },
+    ("state",),
+)
+metrics.Gauge(
+    "geocrypt_password_hashes_pending",
+    "Hashes de contraseña pendientes en el pool de procesos",
+    lambda: {(): PasswordService.pending()},
+)
+metrics.Gauge(
+    "geocrypt_upload_jobs_pending",
+    "Subidas asíncronas en cola o en proceso",
+    lambda: {(): UploadJobService.pending()},
+)
+metrics.Gauge(
+    "geocrypt_write_behind_pending",
+    "Objetos guardados en local pendientes de replicar",
+    _write_behind_pending,
+)
+metrics.Gauge(
+    "geocrypt_auth_cache_entries",
+    "Tokens en la caché de usuarios autenticados",
+    lambda: {(): auth.user_cache.stats()["entries"]},
+)
+metrics.Gauge(
+    "geocrypt_auth_cache_events",
+    "Consultas y descartes acumulados de la caché de usuarios autenticados",
+    lambda: {(event,): value for event, value in auth.user_cache.stats().items()
+             if event in ("hits", "misses", "evictions", "invalidations")},
+    ("event",),
+)
+
+# Preparar las dependencias al arrancar
 @app.on_event("startup")
-def on_startup():
-    init_db()
+async def on_startup():
+    # La base de datos y S3 se preparan en segundo plano; /readyz indica cuándo terminan
+    WarmupService.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await WarmupService.stop()
+    await UploadSessionService.stop()
+    await TombstoneService.stop()
+    await UploadJobService.stop()
+    await storage.stop()
+    PasswordService.shutdown()
+    await close_db()
 
 @app.get("/")
 def read_root():
     return {"message": "Hello World"}
 
+@app.get("/healthz")
+def healthz():
+    # Vivo: el proceso atiende peticiones, aunque las dependencias no estén listas
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    # Listo: base de datos y almacenamiento preparados
+    status = WarmupService.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/storage/stats")
+def storage_stats():
+    # Ocupación del pool de operaciones S3 de este worker y estado del almacenamiento
+    return {**S3Service.pool_stats(), "storage": storage.stats(), "gc": TombstoneService.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    # Formato de texto de Prometheus
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Incluir routers
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(files_router, prefix="/files", tags=["files"])
\ No newline at end of file
@@ -1,5 +1,6 @@
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import Index, UniqueConstraint
 from sqlmodel import SQLModel, Field
 
 class UserBase(SQLModel):
@@ -14,11 +15,100 @@ class User(UserBase, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class File(SQLModel, table=True):
+    __table_args__ = (
+        # Consultas por prefijo de geohash dentro de los archivos de un usuario
+        Index("ix_file_user_id_geohash", "user_id", "geohash"),
+        # Paginación por clave del listado de archivos
+        Index("ix_file_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     filename: str
     s3_key: str
-    geohash: str
+    geohash: str  # Cubierto por ix_file_user_id_geohash
     user_id: int = Field(foreign_key="user.id")
     size: int
     content_type: str
-    created_at: datetime = Field(default_factory=datetime.utcnow) 
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.utcnow) 
+
+class Blob(SQLModel, table=True):
+    """Objeto cifrado direccionado por contenido y compartido por varios File."""
+    __table_args__ = (
+        UniqueConstraint("geohash", "content_hash", name="uq_blob_geohash_content_hash"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    s3_key: str = Field(unique=True, index=True)
+    geohash: str
+    content_hash: str
+    size: int
+    ref_count: int = 1
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Estadísticas de la compresión previa al cifrado (None en blobs anteriores)
+    compressed: Optional[bool] = None
+    stored_size: Optional[int] = None
+    compression_ratio: Optional[float] = None
+    compression_cpu_ms: Optional[float] = None
+
+class UploadJob(SQLModel, table=True):
+    """Subida asíncrona: los bytes ya están en disco y un worker los cifra y registra."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    filename: str
+    content_type: str
+    latitude: float
+    longitude: float
+    staged_path: str
+    size: int
+    status: str = Field(default="pending", index=True)  # pending, processing, done, failed
+    attempts: int = 0
+    file_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class GeohashTile(SQLModel, table=True):
+    """Número de archivos y bytes de un usuario por celda de geohash, para los mapas de calor."""
+    # La clave primaria (user_id, precision, prefix) permite leer una caja con rangos del índice
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    precision: int = Field(primary_key=True)
+    prefix: str = Field(primary_key=True)
+    file_count: int = 0
+    total_bytes: int = 0
+
+class Tombstone(SQLModel, table=True):
+    """Objeto del almacenamiento que ya no usa ningún archivo y está pendiente de borrar."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    s3_key: str = Field(unique=True, index=True)
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    # Worker que lo está borrando y desde cuándo (None si está libre)
+    claim: Optional[str] = None
+    claimed_at: Optional[datetime] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class UploadSession(SQLModel, table=True):
+    """Subida reanudable: los tramos numerados se cifran y se guardan como partes según llegan."""
+    # Identificador aleatorio, también último componente de la clave del objeto
+    id: str = Field(primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    filename: str
+    content_type: str
+    geohash: str
+    size: int
+    chunk_size: int
+    s3_key: str
+    upload_id: str
+    status: str = Field(default="active", index=True)  # active, completing, completed
+    file_id: Optional[int] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)
+
+class UploadSessionPart(SQLModel, table=True):
+    """Tramo recibido de una subida reanudable (numerado desde 0) y ETag de su parte."""
+    session_id: str = Field(foreign_key="uploadsession.id", primary_key=True)
+    number: int = Field(primary_key=True)
+    etag: str
+    size: int
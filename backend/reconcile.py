@@ -0,0 +1,293 @@
+"""Conciliación entre la base de datos y los objetos del bucket.
+
+Uso (desde el directorio backend):
+
+    python reconcile.py --concurrency 8 --output informe.jsonl
+    python reconcile.py --endpoint-url http://localhost:5000 --repair
+
+Reparte el espacio de claves en fragmentos (blobs/ por prefijo de geohash y
+{usuario}/ para las claves anteriores a los blobs), lista cada fragmento con
+list_objects_v2 paginado y lo cruza en orden con las filas de la base de
+datos, sin cargar ninguno de los dos lados en memoria. Emite una línea JSON
+por discrepancia:
+
+- orphaned: objeto sin Blob ni File (los más recientes que --min-age se ignoran)
+- missing: fila sin objeto (pending si aún está en la cola de escritura diferida)
+- size_mismatch: el tamaño del objeto no corresponde al de la fila
+
+Con --repair los huérfanos se entregan al recolector (lápidas), que vuelve a
+comprobar las referencias antes de borrar. Los objetos que faltan y los de
+tamaño incorrecto solo se informan. Sale con código 1 si hay discrepancias o
+fragmentos que no se pudieron conciliar (error).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Tuple
+from sqlmodel import select
+import crypto
+import geo
+from database import async_session, close_db, get_engine, init_db
+from models import Blob, File, Tombstone, User
+from services.s3_service import S3Service
+from services.storage import LocalStorageBackend
+from services.tombstone_service import TombstoneService
+from config.settings import GC_BATCH_SIZE, STORAGE_BACKEND, STORAGE_WRITE_BEHIND, WRITE_BEHIND_DIR
+
+# Tamaño de los lotes de huérfanos que se comprueban y entierran juntos
+ORPHAN_BATCH_SIZE = 500
+
+class Report:
+    """Escribe las discrepancias a medida que aparecen y lleva los totales."""
+
+    def __init__(self, output):
+        self.output = output
+        self.totals: Dict[str, int] = {
+            "shards": 0, "objects": 0, "rows": 0, "ok": 0,
+            "orphaned": 0, "missing": 0, "pending": 0, "size_mismatch": 0,
+            "recent": 0, "tombstoned": 0, "buried": 0, "error": 0,
+        }
+
+    def count(self, name: str, amount: int = 1):
+        self.totals[name] += amount
+
+    def emit(self, kind: str, key: str, **fields):
+        self.count(kind)
+        self.output.write(json.dumps({"type": kind, "key": key, **fields}, default=str) + "\n")
+
+    @property
+    def discrepancies(self) -> int:
+        return sum(self.totals[name] for name in ("orphaned", "missing", "size_mismatch", "error"))
+
+async def _next(iterator: AsyncIterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+class Reconciler:
+    def __init__(self, report: Report, concurrency: int, depth: int, min_age: float, repair: bool):
+        self.report = report
+        self.concurrency = concurrency
+        self.depth = depth
+        self.min_age = timedelta(seconds=min_age)
+        self.repair = repair
+        self.started_at = datetime.now(timezone.utc)
+
+        self.dialect = get_engine().dialect.name
+        # Los objetos aún sin replicar están en el directorio de la escritura diferida
+        self.staging = LocalStorageBackend(WRITE_BEHIND_DIR) if STORAGE_WRITE_BEHIND else None
+
+    def _ordered(self, column):
+        # El orden de la base de datos tiene que coincidir con el orden binario de S3
+        return column.collate("C") if self.dialect == "postgresql" else column
+
+    async def _user_prefixes(self) -> AsyncIterator[str]:
+        prefix = self._ordered(User.username.concat("/"))
+        async with async_session() as session:
+            result = await session.stream(select(prefix).order_by(prefix))
+            async for (value,) in result:
+                yield value
+
+    async def _shards(self) -> AsyncIterator[Tuple[str, str]]:
+        """Fragmentos (tipo, prefijo); los prefijos del bucket y los de los usuarios se unen en orden."""
+        if self.depth > 0:
+            for chars in itertools.product(geo.BASE32, repeat=self.depth):
+                yield "blobs", "blobs/" + "".join(chars)
+        else:
+            yield "blobs", "blobs/"
+
+        bucket = S3Service.list_objects(delimiter="/")
+        users = self._user_prefixes()
+        entry, user = await _next(bucket), await _next(users)
+        while entry is not None or user is not None:
+            if user is None or (entry is not None and entry["key"] < user):
+                if entry["size"] is not None:
+                    # Clave suelta en la raíz del bucket: no pertenece a nadie
+                    await self._orphans("", [entry])
+                elif entry["key"] != "blobs/":
+                    yield "user", entry["key"]
+                entry = await _next(bucket)
+            elif entry is None or user < entry["key"]:
+                if user != "blobs/":
+                    yield "user", user
+                user = await _next(users)
+            else:
+                if user != "blobs/":
+                    yield "user", user
+                entry, user = await _next(bucket), await _next(users)
+
+    async def _rows(self, kind: str, prefix: str) -> AsyncIterator[Tuple[str, int, bool]]:
+        """Filas (clave, tamaño esperado del texto almacenado, comprimido) del fragmento, en orden."""
+        low, high = geo.prefix_range(prefix)
+        async with async_session() as session:
+            if kind == "blobs":
+                key = self._ordered(Blob.s3_key)
+                statement = select(Blob.s3_key, Blob.size, Blob.stored_size, Blob.compressed) \
+                    .where(Blob.s3_key >= low, Blob.s3_key < high).order_by(key)
+                result = await session.stream(statement)
+                async for s3_key, size, stored_size, compressed in result:
+                    yield s3_key, stored_size if compressed else size, bool(compressed)
+            else:
+                key = self._ordered(File.s3_key)
+                # Varios File pueden compartir una clave antigua: basta con una fila
+                statement = select(File.s3_key, File.size) \
+                    .where(File.s3_key >= low, File.s3_key < high).order_by(key, File.id)
+                result = await session.stream(statement)
+                previous = None
+                async for s3_key, size in result:
+                    if s3_key != previous:
+                        yield s3_key, size, False
+                        previous = s3_key
+
+    async def _size_matches(self, key: str, object_size: int, expected: int, compressed: bool) -> bool:
+        if object_size == crypto.encrypted_size(expected):
+            return True
+        # Formato anterior a los segmentos: nonce + tag + texto cifrado
+        if not compressed and object_size == expected + crypto.LEGACY_NONCE_SIZE + crypto.LEGACY_TAG_SIZE:
+            return True
+        # Tamaño de segmento distinto del habitual (subidas prefirmadas): se lee la cabecera
+        header = b""
+        async for chunk in S3Service.download_stream(key, (0, crypto.HEADER_SIZE - 1)):
+            header += chunk
+        parsed = crypto.parse_header(header)
+        return parsed is not None and crypto.encrypted_size(expected, parsed[2]) == object_size
+
+    async def _orphans(self, shard: str, entries: List[dict]):
+        """Informa de un lote de objetos sin filas y, con --repair, los entierra."""
+        if not entries:
+            return
+        keys = [entry["key"] for entry in entries]
+        async with async_session() as session:
+            tombstoned = set((await session.exec(select(Tombstone.s3_key).where(Tombstone.s3_key.in_(keys)))).all())
+            orphaned = []
+            for entry in entries:
+                if entry["key"] in tombstoned:
+                    # Ya está pendiente de recolectar
+                    self.report.count("tombstoned")
+                elif self.started_at - entry["last_modified"] < self.min_age:
+                    # Puede ser una subida cuya fila aún no se ha confirmado
+                    self.report.count("recent")
+                else:
+                    self.report.emit("orphaned", entry["key"], shard=shard, size=entry["size"],
+                                     last_modified=entry["last_modified"])
+                    orphaned.append(entry["key"])
+            if self.repair and orphaned:
+                await TombstoneService.bury(session, orphaned)
+                await session.commit()
+                self.report.count("buried", len(orphaned))
+
+    async def _missing(self, shard: str, key: str):
+        if self.staging is not None and await self.staging.head(key) is not None:
+            self.report.emit("pending", key, shard=shard)
+        else:
+            self.report.emit("missing", key, shard=shard)
+
+    async def reconcile_shard(self, kind: str, prefix: str):
+        """Cruce ordenado de las claves del bucket con las filas del fragmento."""
+        objects = S3Service.list_objects(prefix)
+        rows = self._rows(kind, prefix)
+        entry, row = await _next(objects), await _next(rows)
+        orphans: List[dict] = []
+        while entry is not None or row is not None:
+            if row is None or (entry is not None and entry["key"] < row[0]):
+                self.report.count("objects")
+                orphans.append(entry)
+                if len(orphans) >= ORPHAN_BATCH_SIZE:
+                    await self._orphans(prefix, orphans)
+                    orphans = []
+                entry = await _next(objects)
+            elif entry is None or row[0] < entry["key"]:
+                self.report.count("rows")
+                await self._missing(prefix, row[0])
+                row = await _next(rows)
+            else:
+                self.report.count("objects")
+                self.report.count("rows")
+                key, expected, compressed = row
+                if await self._size_matches(key, entry["size"], expected, compressed):
+                    self.report.count("ok")
+                else:
+                    self.report.emit("size_mismatch", key, shard=prefix, size=entry["size"],
+                                     expected_plaintext=expected, compressed=compressed)
+                entry, row = await _next(objects), await _next(rows)
+        await self._orphans(prefix, orphans)
+        self.report.count("shards")
+
+    async def run(self):
+        # Cola acotada: los fragmentos se generan a medida que los workers los consumen
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+
+        async def worker():
+            while True:
+                shard = await queue.get()
+                try:
+                    if shard is None:
+                        return
+                    await self.reconcile_shard(*shard)
+                except Exception as e:
+                    # Un fragmento que falla no detiene a los demás
+                    self.report.emit("error", shard[1], error=str(e))
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+        try:
+            async for shard in self._shards():
+                await queue.put(shard)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+        if self.repair and self.report.totals["buried"]:
+            while await TombstoneService.collect() >= GC_BATCH_SIZE:
+                pass
+
+async def reconcile(args, output) -> Report:
+    await init_db()
+    report = Report(output)
+    try:
+        await Reconciler(report, args.concurrency, args.depth, args.min_age, args.repair).run()
+    finally:
+        await close_db()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8, help="Fragmentos que se concilian a la vez")
+    parser.add_argument("--depth", type=int, default=1, help="Caracteres de geohash con los que se fragmenta blobs/")
+    parser.add_argument("--min-age", type=float, default=3600, help="Segundos que debe tener un huérfano para informarlo")
+    parser.add_argument("--repair", action="store_true", help="Entregar los huérfanos al recolector")
+    parser.add_argument("--endpoint-url", help="S3 alternativo (moto, minio); sustituye a S3_ENDPOINT_URL")
+    parser.add_argument("--output", help="Archivo JSON Lines de discrepancias (por defecto, la salida estándar)")
+    args = parser.parse_args()
+    if args.concurrency < 1 or args.depth < 0:
+        parser.error("--concurrency debe ser positivo y --depth no negativo")
+
+    # El cliente de S3 se crea en la primera llamada y lee entonces S3_ENDPOINT_URL
+    if args.endpoint_url:
+        os.environ["S3_ENDPOINT_URL"] = args.endpoint_url
+    if STORAGE_BACKEND != "s3":
+        parser.error(f"La conciliación necesita STORAGE_BACKEND=s3 (actual: {STORAGE_BACKEND})")
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    started = time.perf_counter()
+    try:
+        report = asyncio.run(reconcile(args, output))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    summary = dict(report.totals, elapsed_s=round(time.perf_counter() - started, 3))
+    print(json.dumps({"type": "summary", **summary}), file=sys.stderr)
+    sys.exit(1 if report.discrepancies else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,60 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import timedelta
 from typing import List
 from database import get_session
 from models import User
 from schemas.auth import Token, UserCreate, UserResponse
+from services.password_service import PasswordService
 import auth
 
 router = APIRouter()
 
 @router.post("/register", response_model=UserResponse)
-def register(user: UserCreate, session: Session = Depends(get_session)):
+async def register(user: UserCreate, session: AsyncSession = Depends(get_session)):
     # Verificar si el username ya existe
-    db_user = session.exec(select(User).where(User.username == user.username)).first()
+    db_user = (await session.exec(select(User).where(User.username == user.username))).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
     # Verificar si el email ya existe
-    db_user = session.exec(select(User).where(User.email == user.email)).first()
+    db_user = (await session.exec(select(User).where(User.email == user.email))).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = auth.get_password_hash(user.password)
+    hashed_password = await PasswordService.hash(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password
     )
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    await session.commit()
+    await session.refresh(db_user)
     return db_user
 
 @router.post("/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_session)):
+    user = (await session.exec(select(User).where(User.username == form_data.username))).first()
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = await PasswordService.verify_and_update(form_data.password, user.hashed_password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    if new_hash:
+        # El coste de bcrypt cambió: rehacer el hash de forma transparente
+        user.hashed_password = new_hash
+        session.add(user)
+        await session.commit()
+        auth.invalidate_user(user.username)
+    
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -1,14 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File as FastAPIFile, Form, status
-from sqlmodel import Session, select
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile, File as FastAPIFile, Form, status
+from fastapi.responses import StreamingResponse
+from sqlmodel import and_, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import delete, tuple_
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+from urllib.parse import quote
+import asyncio
+import base64
+import logging
 import os
+import zipfile
 import geohash2
-from models import User, File
+import geo
+from models import User, File, UploadJob
 from database import get_session
 import auth
 import crypto
-from schemas.files import FileResponse, FileCreate
-from services.s3_service import S3Service
+import metrics
+from schemas.files import (
+    BulkDeleteRequest,
+    FileResponse,
+    FileCreate,
+    FileListItem,
+    FilePage,
+    FileSearchResult,
+    PresignedUploadComplete,
+    PresignedUploadRequest,
+    TileResponse,
+    UploadJobStatus,
+    UploadSessionRequest,
+    UploadSessionStatus,
+)
+from services.storage import storage
+from services.blob_service import BlobService
+from services.ingest_service import IngestService
+from services.upload_jobs import UploadJobService
+from services.upload_session_service import UploadSessionService
+from services.presigned_service import PresignedService
+from services.tile_service import TileService
+from services.tombstone_service import TombstoneService
+from config.settings import (
+    UPLOAD_BATCH_CONCURRENCY,
+    UPLOAD_BATCH_MAX_FILES,
+    EXPORT_PREFETCH_WINDOW,
+    EXPORT_PREFETCH_MAX_BYTES,
+    DELETE_BATCH_MAX_FILES,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -18,65 +58,311 @@ async def upload_file(
     latitude: float = Form(...),
     longitude: float = Form(...),
     current_user: User = Depends(auth.get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_session)
 ):
     try:
-        # Leer el contenido del archivo
-        content = await file.read()
-        print(f"Contenido del archivo leído: {len(content)} bytes")
-        
-        # Cifrar el archivo
-        encrypted_content = crypto.encrypt_file(content, latitude, longitude)
-        print(f"Contenido cifrado: {len(encrypted_content)} bytes")
-        
-        # Generar geohash
-        gh = geohash2.encode(latitude, longitude, precision=7)
-        print(f"Geohash generado: {gh}")
-        
-        # Subir a S3
-        s3_key = f"{current_user.username}/{gh}/{file.filename}"
-        print(f"Intentando subir a S3: {s3_key}")
-        
-        if not await S3Service.upload_file(encrypted_content, s3_key):
-            # En caso de error, simular el almacenamiento localmente
-            os.makedirs("uploads", exist_ok=True)
-            local_path = os.path.join("uploads", s3_key)
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            with open(local_path, "wb") as f:
-                f.write(encrypted_content)
-            print(f"Archivo guardado localmente en: {local_path}")
-        
-        # Guardar en la base de datos
-        db_file = File(
-            filename=file.filename,
-            s3_key=s3_key,
-            geohash=gh,
-            user_id=current_user.id,
-            size=len(content),
-            content_type=file.content_type or "application/octet-stream"
-        )
-        session.add(db_file)
-        session.commit()
-        session.refresh(db_file)
+        db_file = await IngestService.ingest(session, file, latitude, longitude, current_user.id)
+        with metrics.span("db_commit"):
+            await session.commit()
+        await session.refresh(db_file)
         
         return {"message": "File uploaded successfully", "file_id": db_file.id}
     except Exception as e:
-        print(f"Error general: {str(e)}")
+        logger.error("Error general: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error al procesar el archivo: {str(e)}"
         )
 
+@router.post("/upload/async", status_code=status.HTTP_202_ACCEPTED)
+async def upload_file_async(
+    response: Response,
+    file: UploadFile = FastAPIFile(...),
+    latitude: float = Form(...),
+    longitude: float = Form(...),
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    # Responder en cuanto los bytes están en disco; el cifrado y la subida siguen en segundo plano
+    job = await UploadJobService.submit(session, file, latitude, longitude, current_user.id)
+    response.headers["Location"] = f"/files/jobs/{job.id}"
+    return {"message": "Upload accepted", "job_id": job.id, "status": job.status}
+
+@router.get("/jobs/{job_id}", response_model=UploadJobStatus)
+async def get_upload_job(
+    job_id: int,
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    job = (await session.exec(
+        select(UploadJob).where(UploadJob.id == job_id, UploadJob.user_id == current_user.id)
+    )).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return UploadJobService.describe(job, UploadJobService.progress(job_id))
+
+@router.post("/upload/presigned")
+async def start_presigned_upload(
+    upload: PresignedUploadRequest,
+    current_user: User = Depends(auth.get_current_user)
+):
+    # El cliente cifra y sube el objeto directamente a S3 con la URL devuelta
+    return PresignedService.start_upload(
+        current_user,
+        upload.filename,
+        upload.content_type,
+        upload.size,
+        upload.latitude,
+        upload.longitude
+    )
+
+@router.post("/upload/presigned/complete")
+async def complete_presigned_upload(
+    completion: PresignedUploadComplete,
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    db_file = await PresignedService.complete_upload(session, current_user, completion.upload_token)
+    return {"message": "File uploaded successfully", "file_id": db_file.id}
+
+@router.post("/upload/sessions", response_model=UploadSessionStatus, status_code=status.HTTP_201_CREATED)
+async def create_upload_session(
+    upload: UploadSessionRequest,
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    # El cliente envía después los tramos con PUT y finaliza con /complete
+    upload_session = await UploadSessionService.create(
+        session,
+        current_user,
+        upload.filename,
+        upload.content_type,
+        upload.size,
+        upload.latitude,
+        upload.longitude
+    )
+    return UploadSessionService.describe(upload_session, [])
+
+@router.get("/upload/sessions/{session_id}", response_model=UploadSessionStatus)
+async def get_upload_session(
+    session_id: str,
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    # Tras un corte, offset y next_chunk indican desde dónde seguir
+    upload_session = await UploadSessionService.get(session, current_user, session_id)
+    return UploadSessionService.describe(
+        upload_session, await UploadSessionService.received(session, session_id)
+    )
+
+@router.put("/upload/sessions/{session_id}/chunks/{number}", response_model=UploadSessionStatus)
+async def put_upload_chunk(
+    session_id: str,
+    number: int,
+    request: Request,
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    return await UploadSessionService.put_chunk(session, current_user, session_id, number, request.stream())
+
+@router.post("/upload/sessions/{session_id}/complete")
+async def complete_upload_session(
+    session_id: str,
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    db_file = await UploadSessionService.complete(session, current_user, session_id)
+    return {"message": "File uploaded successfully", "file_id": db_file.id}
+
+@router.delete("/upload/sessions/{session_id}")
+async def abort_upload_session(
+    session_id: str,
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    await UploadSessionService.abort(session, current_user, session_id)
+    return {"message": "Upload session deleted"}
+
+@router.post("/upload/batch")
+async def upload_files_batch(
+    files: List[UploadFile] = FastAPIFile(...),
+    latitude: float = Form(...),
+    longitude: float = Form(...),
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Se admiten como máximo {UPLOAD_BATCH_MAX_FILES} archivos por lote"
+        )
+    
+    # Una sola derivación de clave y geohash para todo el lote
+    gh = geohash2.encode(latitude, longitude, precision=7)
+    with metrics.span("key_derivation"):
+        key = crypto.derive_key_from_location(latitude, longitude)
+    slots = asyncio.Semaphore(UPLOAD_BATCH_CONCURRENCY)
+    
+    async def digest(file: UploadFile):
+        async with slots:
+            try:
+                with metrics.span("body_read"):
+                    content_hash, size = await crypto.digest_upload(file, key)
+                metrics.BYTES_IN.inc(size)
+                return (content_hash, size), None
+            except Exception as e:
+                logger.error("Error al leer %s: %s", file.filename, e)
+                return None, str(e)
+    
+    async def upload(file: UploadFile, content_hash: str):
+        async with slots:
+            try:
+                await file.seek(0)
+                encryptor = await IngestService.store(file, key, BlobService.key_for(gh, content_hash))
+                return IngestService.blob_stats(encryptor), None
+            except Exception as e:
+                logger.error("Error al subir %s: %s", file.filename, e)
+                return None, str(e)
+    
+    digests = await asyncio.gather(*[digest(file) for file in files])
+    errors = [error for _, error in digests]
+    
+    # Cifrar y subir una sola vez cada contenido que aún no existe en la ubicación
+    to_upload = {}
+    for file, (result, _) in zip(files, digests):
+        if result is not None and result[0] not in to_upload:
+            if await BlobService.find(session, gh, result[0]) is None:
+                to_upload[result[0]] = file
+            else:
+                await TombstoneService.revive(BlobService.key_for(gh, result[0]))
+    uploads = dict(zip(
+        to_upload,
+        await asyncio.gather(*[upload(file, content_hash) for content_hash, file in to_upload.items()])
+    ))
+    
+    # Todas las filas en una sola transacción
+    db_files = []
+    try:
+        for index, (file, (result, _)) in enumerate(zip(files, digests)):
+            if result is None:
+                continue
+            content_hash, size = result
+            stats, upload_error = uploads.get(content_hash, (None, None))
+            if upload_error:
+                errors[index] = upload_error
+                continue
+            # Las estadísticas solo se guardan al subir el objeto
+            s3_key, existed = await BlobService.register(session, gh, content_hash, size, stats)
+            if not existed and stats is None:
+                await IngestService.restore(session, file, key, s3_key)
+            db_file = File(
+                filename=file.filename,
+                s3_key=s3_key,
+                geohash=gh,
+                user_id=current_user.id,
+                size=size,
+                content_type=file.content_type or "application/octet-stream"
+            )
+            session.add(db_file)
+            db_files.append((index, db_file))
+        await TileService.add(session, current_user.id, [(gh, db_file.size) for _, db_file in db_files])
+        await session.flush()
+        file_ids = {index: db_file.id for index, db_file in db_files}
+        with metrics.span("db_commit"):
+            await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logger.error("Error al guardar el lote: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al guardar el lote: {str(e)}"
+        )
+    
+    results = []
+    for index, file in enumerate(files):
+        if index in file_ids:
+            results.append({"filename": file.filename, "status": "uploaded", "file_id": file_ids[index]})
+        else:
+            results.append({"filename": file.filename, "status": "error", "detail": errors[index]})
+    return {
+        "uploaded": len(file_ids),
+        "failed": len(files) - len(file_ids),
+        "results": results
+    }
+
+def _parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Interpreta una cabecera Range de un solo rango; devuelve (inicio, fin) inclusivos."""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_str, _, end_str = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        else:
+            # Sufijo: los últimos N bytes
+            start = max(size - int(end_str), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+async def _open_encrypted(s3_key: str, byte_range: Optional[Tuple[int, int]] = None):
+    """Abre el blob cifrado en el almacenamiento configurado."""
+    try:
+        return await _prime(storage.get_stream(s3_key, byte_range))
+    except Exception as e:
+        logger.error("Error al leer %s del almacenamiento: %s", s3_key, e)
+        raise HTTPException(
+            status_code=500,
+            detail="No se pudo recuperar el archivo del almacenamiento"
+        )
+
+async def _prime(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # Obtener el primer bloque antes de responder para poder devolver errores HTTP
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = b""
+
+    async def primed():
+        if first:
+            yield first
+        async for chunk in stream:
+            yield chunk
+    return primed()
+
+async def _trim(stream: AsyncIterator[bytes], skip: int, length: int) -> AsyncIterator[bytes]:
+    # Recortar el texto plano al rango pedido dentro de los segmentos descifrados
+    async for chunk in stream:
+        if skip:
+            if len(chunk) <= skip:
+                skip -= len(chunk)
+                continue
+            chunk = chunk[skip:]
+            skip = 0
+        if len(chunk) >= length:
+            yield chunk[:length]
+            return
+        length -= len(chunk)
+        yield chunk
+
 @router.get("/download/{file_id}")
 async def download_file(
     file_id: int,
     geohash: str,
+    request: Request,
+    mode: str = Query("proxy", regex="^(proxy|presigned)$"),
     current_user: User = Depends(auth.get_current_user),
-    save_path: str = "downloads",
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_session)
 ):
     # Obtener el archivo de la base de datos
-    file = session.exec(select(File).where(File.id == file_id)).first()
+    file = (await session.exec(select(File).where(File.id == file_id))).first()
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
     
@@ -84,62 +370,361 @@ async def download_file(
     if file.user_id != current_user.id and file.geohash != geohash:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    try:
-        # Intentar descargar de S3
-        encrypted_content = await S3Service.download_file(file.s3_key)
-    except Exception as e:
-        print(f"Error al descargar de S3: {str(e)}")
-        # Si falla S3, intentar leer del almacenamiento local
-        local_path = os.path.join("uploads", file.s3_key)
-        try:
-            with open(local_path, "rb") as f:
-                encrypted_content = f.read()
-        except Exception as local_error:
-            raise HTTPException(
-                status_code=500,
-                detail="No se pudo recuperar el archivo ni de S3 ni del almacenamiento local"
-            )
+    lat, lon, me1, me2 = geohash2.decode_exactly(geohash)
+    key = crypto.derive_key_from_location(float(lat), float(lon))
+    if mode == "presigned":
+        # El cliente descarga el texto cifrado de S3 y lo descifra con estos parámetros
+        return await PresignedService.download(file, key)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file.filename)}",
+    }
+    media_type = file.content_type or "application/octet-stream"
+    
+    byte_range = _parse_range(request.headers.get("range"), file.size)
+    if byte_range is not None:
+        # Solo los blobs segmentados sin comprimir admiten rangos; se lee primero la cabecera
+        header_stream = await _open_encrypted(file.s3_key, (0, crypto.HEADER_SIZE - 1))
+        header = b"".join([chunk async for chunk in header_stream])
+        parsed = crypto.parse_header(header)
+        if parsed is None or parsed[1] & crypto.FLAG_ZSTD:
+            byte_range = None
     
-    # Descifrar el archivo
     try:
-        lat, lon, me1, me2 = geohash2.decode_exactly(geohash)
-        decrypted_content = crypto.decrypt_file(encrypted_content, float(lat), float(lon))
-        
-        # Guardar el archivo descifrado
-        os.makedirs(save_path, exist_ok=True)
-        output_file_path = os.path.join(save_path, file.filename)
-        with open(output_file_path, "wb") as output_file:
-            output_file.write(decrypted_content)
+        if byte_range is None:
+            encrypted_stream = await _open_encrypted(file.s3_key)
+            plaintext = await _prime(crypto.decrypt_stream(encrypted_stream, key))
+            headers["Content-Length"] = str(file.size)
+            return StreamingResponse(plaintext, media_type=media_type, headers=headers)
         
-        return {"message": "File downloaded and decrypted successfully", "path": output_file_path}
+        # Pedir a S3 únicamente los segmentos que contienen el rango solicitado
+        start, end = byte_range
+        segment_size = parsed[2]
+        enc_start, enc_end, first_index, skip = crypto.encrypted_range(start, end, segment_size)
+        decryptor = crypto.StreamDecryptor(
+            key,
+            header=header,
+            first_index=first_index,
+            total_segments=crypto.segment_count(file.size, segment_size)
+        )
+        encrypted_stream = await _open_encrypted(file.s3_key, (enc_start, enc_end))
+        plaintext = await _prime(crypto.decrypt_stream(encrypted_stream, key, decryptor))
+        headers["Content-Length"] = str(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{file.size}"
+        return StreamingResponse(
+            _trim(plaintext, skip, end - start + 1),
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            media_type=media_type,
+            headers=headers
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error al descifrar el archivo: {str(e)}"
         )
 
-@router.get("/", response_model=List[FileResponse])
-def list_files(
+class _ZipSink:
+    """Destino no posicionable para zipfile que acumula los bytes hasta vaciarlos."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def _fetch_for_export(file: File) -> Tuple[File, Optional[bytes]]:
+    # Los objetos pequeños se descargan por adelantado; los grandes se leen al escribirlos
+    if file.size > EXPORT_PREFETCH_MAX_BYTES:
+        return file, None
+    stream = await _open_encrypted(file.s3_key)
+    return file, b"".join([chunk async for chunk in stream])
+
+async def _export_zip(files: List[File]) -> AsyncIterator[bytes]:
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True)
+    loop = asyncio.get_running_loop()
+    remaining = iter(files)
+    pending = {}
+    errors = []
+    
+    def schedule():
+        # Ventana acotada de descargas simultáneas
+        while len(pending) < EXPORT_PREFETCH_WINDOW:
+            file = next(remaining, None)
+            if file is None:
+                return
+            pending[asyncio.ensure_future(_fetch_for_export(file))] = file
+    
+    schedule()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                file = pending.pop(task)
+                try:
+                    _, encrypted_content = task.result()
+                    key = crypto.derive_key_from_geohash(file.geohash)
+                    info = zipfile.ZipInfo(
+                        f"{file.geohash}/{file.id}_{os.path.basename(file.filename)}",
+                        date_time=file.created_at.timetuple()[:6]
+                    )
+                    with archive.open(info, mode="w", force_zip64=True) as entry:
+                        if encrypted_content is not None:
+                            entry.write(await loop.run_in_executor(None, crypto.decrypt_bytes, encrypted_content, key))
+                            yield sink.drain()
+                        else:
+                            stream = await _open_encrypted(file.s3_key)
+                            async for chunk in crypto.decrypt_stream(stream, key):
+                                entry.write(chunk)
+                                yield sink.drain()
+                    yield sink.drain()
+                except Exception as e:
+                    logger.error("Error al exportar %s: %s", file.s3_key, e)
+                    errors.append(f"{file.id}\t{file.filename}\t{str(e)}")
+            schedule()
+        if errors:
+            archive.writestr("errores.txt", "\n".join(errors) + "\n")
+        archive.close()
+        yield sink.drain()
+    finally:
+        for task in pending:
+            task.cancel()
+
+@router.get("/export")
+async def export_files(
+    geohash_prefix: str,
     current_user: User = Depends(auth.get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_session)
 ):
-    files = session.exec(
-        select(File).where(File.user_id == current_user.id)
-    ).all()
-    return files
+    # ZIP con los archivos descifrados bajo un prefijo de geohash, generado al vuelo
+    if not geo.is_valid_geohash(geohash_prefix):
+        raise HTTPException(status_code=400, detail="geohash_prefix no válido")
+    low, high = geo.prefix_range(geohash_prefix)
+    files = (await session.exec(
+        select(File).where(
+            File.user_id == current_user.id,
+            File.geohash >= low,
+            File.geohash < high
+        ).order_by(File.geohash, File.id)
+    )).all()
+    return StreamingResponse(
+        _export_zip(files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="geocrypt-{geohash_prefix}.zip"'}
+    )
+
+@router.get("/near", response_model=List[FileResponse])
+async def list_files_near(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    precision: int = Query(6, ge=1, le=7),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    # Archivos en la celda de la ubicación y sus 8 vecinas
+    gh = geohash2.encode(latitude, longitude, precision=precision)
+    # Una sola consulta con un rango del índice (user_id, geohash) por celda
+    ranges = [geo.prefix_range(cell) for cell in geo.neighbors(gh)]
+    return (await session.exec(
+        select(File).where(
+            File.user_id == current_user.id,
+            or_(*[and_(File.geohash >= low, File.geohash < high) for low, high in ranges])
+        ).order_by(File.geohash, File.id).limit(limit)
+    )).all()
+
+def _parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox debe ser min_lon,min_lat,max_lon,max_lat")
+    if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise HTTPException(status_code=400, detail="bbox fuera de rango")
+    return min_lon, min_lat, max_lon, max_lat
+
+@router.get("/search", response_model=List[FileSearchResult])
+async def search_files(
+    bbox: Optional[str] = None,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    radius_m: Optional[float] = Query(None, gt=0),
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    # Búsqueda por caja (min_lon,min_lat,max_lon,max_lat) o por radio alrededor de un punto
+    if bbox is not None:
+        area = _parse_bbox(bbox)
+    elif lat is not None and lon is not None and radius_m is not None:
+        area = geo.bbox_for_radius(lat, lon, radius_m)
+    else:
+        raise HTTPException(status_code=400, detail="Se requiere bbox o lat, lon y radius_m")
+    
+    # Una sola consulta con un rango del índice por cada prefijo de la cobertura
+    ranges = [geo.prefix_range(prefix) for prefix in geo.cover_bbox(area)]
+    candidates = (await session.exec(
+        select(File).where(
+            File.user_id == current_user.id,
+            or_(*[and_(File.geohash >= low, File.geohash < high) for low, high in ranges])
+        )
+    )).all()
+    
+    # Filtrar por la distancia exacta al centro de la celda de cada archivo
+    results = []
+    for file in candidates:
+        file_lat, file_lon, _, _ = geohash2.decode_exactly(file.geohash)
+        if bbox is not None:
+            if geo.in_bbox(file_lat, file_lon, area):
+                results.append(FileSearchResult(**file.dict()))
+        else:
+            distance = geo.haversine_m(lat, lon, file_lat, file_lon)
+            if distance <= radius_m:
+                results.append(FileSearchResult(**file.dict(), distance_m=distance))
+    if bbox is None:
+        results.sort(key=lambda result: result.distance_m)
+    return results
+
+@router.get("/tiles", response_model=List[TileResponse])
+async def list_tiles(
+    bbox: str,
+    precision: int = Query(5, ge=3, le=7),
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    # Archivos y bytes por celda desde los agregados: coste proporcional a las celdas, no a los archivos
+    tiles = await TileService.tiles(session, current_user.id, _parse_bbox(bbox), precision)
+    results = []
+    for tile in tiles:
+        latitude, longitude, _, _ = geohash2.decode_exactly(tile.prefix)
+        results.append(TileResponse(
+            geohash=tile.prefix,
+            precision=tile.precision,
+            file_count=tile.file_count,
+            total_bytes=tile.total_bytes,
+            latitude=latitude,
+            longitude=longitude
+        ))
+    return results
+
+LIST_FIELDS = tuple(FileListItem.__fields__)
+
+def _encode_cursor(created_at: datetime, file_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{file_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, file_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(file_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor no válido")
+
+@router.get("/", response_model=FilePage, response_model_exclude_unset=True)
+async def list_files(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    geohash_prefix: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    # Selección opcional de campos (separados por comas)
+    selected = LIST_FIELDS
+    if fields:
+        selected = tuple(field.strip() for field in fields.split(",") if field.strip())
+        unknown = set(selected) - set(LIST_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(sorted(unknown))}")
+    columns = list(dict.fromkeys(("id", "created_at") + selected))
+    
+    # Paginación por clave (created_at, id) descendente sobre el índice (user_id, created_at, id)
+    query = select(*[getattr(File, column) for column in columns]).where(File.user_id == current_user.id)
+    if geohash_prefix:
+        if not geo.is_valid_geohash(geohash_prefix):
+            raise HTTPException(status_code=400, detail="geohash_prefix no válido")
+        low, high = geo.prefix_range(geohash_prefix)
+        query = query.where(File.geohash >= low, File.geohash < high)
+    if cursor:
+        created_at, file_id = _decode_cursor(cursor)
+        query = query.where(tuple_(File.created_at, File.id) < tuple_(created_at, file_id))
+    query = query.order_by(File.created_at.desc(), File.id.desc()).limit(limit + 1)
+    
+    rows = (await session.exec(query)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
+    items = [FileListItem(**{field: getattr(row, field) for field in selected}) for row in rows]
+    return FilePage(items=items, next_cursor=next_cursor)
+
+@router.post("/delete/batch")
+async def delete_files_batch(
+    request: BulkDeleteRequest,
+    current_user: User = Depends(auth.get_current_user),
+    session: AsyncSession = Depends(get_session)
+):
+    # Borrado de una lista de ids o de todos los archivos bajo un prefijo de geohash
+    if (request.ids is None) == (request.geohash_prefix is None):
+        raise HTTPException(status_code=400, detail="Se requiere ids o geohash_prefix")
+    if request.ids is not None:
+        if len(request.ids) > DELETE_BATCH_MAX_FILES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Se admiten como máximo {DELETE_BATCH_MAX_FILES} archivos por petición"
+            )
+        files = (await session.exec(
+            select(File).where(File.user_id == current_user.id, File.id.in_(request.ids))
+        )).all() if request.ids else []
+        found = {file.id for file in files}
+        not_found = [file_id for file_id in dict.fromkeys(request.ids) if file_id not in found]
+        has_more = False
+    else:
+        if not geo.is_valid_geohash(request.geohash_prefix, max_length=7):
+            raise HTTPException(status_code=400, detail="geohash_prefix no es un geohash válido")
+        # Un rango sobre el índice (user_id, geohash); los prefijos grandes se borran por tandas
+        low, high = geo.prefix_range(request.geohash_prefix)
+        files = (await session.exec(
+            select(File).where(
+                File.user_id == current_user.id,
+                File.geohash >= low,
+                File.geohash < high
+            ).order_by(File.geohash, File.id).limit(DELETE_BATCH_MAX_FILES + 1)
+        )).all()
+        has_more = len(files) > DELETE_BATCH_MAX_FILES
+        files = files[:DELETE_BATCH_MAX_FILES]
+        not_found = []
+
+    queued = await _delete_files(session, current_user.id, files) if files else 0
+    return {
+        "deleted": len(files),
+        "objects_queued": queued,
+        "not_found": not_found,
+        "has_more": has_more,
+    }
 
 @router.get("/{file_id}", response_model=FileResponse)
-def get_file(
+async def get_file(
     file_id: int,
     current_user: User = Depends(auth.get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_session)
 ):
-    file = session.exec(
+    file = (await session.exec(
         select(File).where(
             File.id == file_id,
             File.user_id == current_user.id
         )
-    ).first()
+    )).first()
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
     return file
@@ -148,22 +733,28 @@ def get_file(
 async def delete_file(
     file_id: int,
     current_user: User = Depends(auth.get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_session)
 ):
-    file = session.exec(
+    file = (await session.exec(
         select(File).where(
             File.id == file_id,
             File.user_id == current_user.id
         )
-    ).first()
+    )).first()
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Eliminar de S3
-    await S3Service.delete_file(file.s3_key)
-    
-    # Eliminar de la base de datos
-    session.delete(file)
-    session.commit()
-    
-    return {"message": "File deleted successfully"} 
\ No newline at end of file
+    await _delete_files(session, current_user.id, [file])
+    return {"message": "File deleted successfully"}
+
+async def _delete_files(session: AsyncSession, user_id: int, files: List[File]) -> int:
+    """Borra los archivos en una transacción; los objetos sin referencias se borran en segundo plano."""
+    orphaned = await BlobService.release_many(session, files)
+    await session.execute(delete(File).where(File.id.in_([file.id for file in files])))
+    await TileService.remove(session, user_id, [(file.geohash, file.size) for file in files])
+    # La lápida se confirma con el borrado: el objeto no se pierde de vista aunque S3 falle
+    await TombstoneService.bury(session, orphaned)
+    with metrics.span("db_commit"):
+        await session.commit()
+    TombstoneService.notify()
+    return len(orphaned) 
\ No newline at end of file
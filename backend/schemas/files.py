@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import List, Optional
 
 class FileBase(BaseModel):
     filename: str
@@ -13,4 +14,80 @@ class FileResponse(FileBase):
     created_at: datetime
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+
+class FileSearchResult(FileResponse):
+    distance_m: Optional[float] = None
+
+class TileResponse(BaseModel):
+    geohash: str
+    precision: int
+    file_count: int
+    total_bytes: int
+    # Centro de la celda
+    latitude: float
+    longitude: float
+
+class UploadJobStatus(BaseModel):
+    id: int
+    status: str
+    stage: str
+    filename: str
+    size: int
+    bytes_processed: int
+    progress: float
+    file_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+class PresignedUploadRequest(BaseModel):
+    filename: str
+    content_type: str = "application/octet-stream"
+    size: int = Field(..., ge=0)
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+
+class PresignedUploadComplete(BaseModel):
+    upload_token: str
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    content_type: str = "application/octet-stream"
+    size: int = Field(..., ge=0)
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+
+class UploadSessionStatus(BaseModel):
+    id: str
+    status: str
+    filename: str
+    size: int
+    chunk_size: int
+    chunk_count: int
+    received_chunks: int
+    # Bytes recibidos sin huecos desde el principio y primer tramo que falta
+    offset: int
+    next_chunk: Optional[int] = None
+    file_id: Optional[int] = None
+    created_at: datetime
+    updated_at: datetime
+    expires_at: datetime
+
+class BulkDeleteRequest(BaseModel):
+    # Una lista de ids o un prefijo de geohash
+    ids: Optional[List[int]] = None
+    geohash_prefix: Optional[str] = None
+
+class FileListItem(BaseModel):
+    # Con ?fields= solo se rellenan (y se devuelven) los campos pedidos
+    id: Optional[int] = None
+    filename: Optional[str] = None
+    geohash: Optional[str] = None
+    size: Optional[int] = None
+    content_type: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class FilePage(BaseModel):
+    items: List[FileListItem]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,95 @@
+from datetime import datetime
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import Blob, File
+
+class BlobService:
+    """Contador de referencias de los objetos cifrados direccionados por contenido."""
+
+    @staticmethod
+    def key_for(geohash: str, content_hash: str) -> str:
+        return f"blobs/{geohash}/{content_hash}"
+
+    @staticmethod
+    async def find(session: AsyncSession, geohash: str, content_hash: str) -> Optional[Blob]:
+        return (await session.exec(
+            select(Blob).where(Blob.geohash == geohash, Blob.content_hash == content_hash)
+        )).first()
+
+    @staticmethod
+    async def register(
+        session: AsyncSession,
+        geohash: str,
+        content_hash: str,
+        size: int,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, bool]:
+        """Añade una referencia al blob, creándolo si no existe, de forma atómica.
+
+        Devuelve la clave y si el blob ya existía.
+        """
+        dialect = session.sync_session.get_bind().dialect.name
+        insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+        table = Blob.__table__
+        s3_key = BlobService.key_for(geohash, content_hash)
+        statement = insert(table).values(
+            s3_key=s3_key,
+            geohash=geohash,
+            content_hash=content_hash,
+            size=size,
+            ref_count=1,
+            created_at=datetime.utcnow(),
+            **(stats or {})
+        )
+        values = {"ref_count": table.c.ref_count + 1}
+        if stats:
+            # Dos subidas simultáneas del mismo contenido: el objeto es el de la última en escribir
+            values.update({name: statement.excluded[name] for name in stats})
+        await session.execute(statement.on_conflict_do_update(
+            index_elements=["geohash", "content_hash"],
+            set_=values
+        ))
+        # La fila queda bloqueada por la escritura hasta confirmar: el contador es el nuestro
+        ref_count = (await session.exec(select(Blob.ref_count).where(Blob.s3_key == s3_key))).one()
+        return s3_key, ref_count > 1
+
+    @staticmethod
+    async def set_stats(session: AsyncSession, s3_key: str, stats: Dict[str, Any]):
+        await session.execute(update(Blob).where(Blob.s3_key == s3_key).values(**stats))
+
+    @staticmethod
+    async def release_many(session: AsyncSession, files: List[File]) -> List[str]:
+        """Quita una referencia por archivo; devuelve las claves que ya no usa ningún archivo."""
+        counts = Counter(file.s3_key for file in files)
+        keys = list(counts)
+        if not keys:
+            return []
+        blob_keys = set((await session.exec(select(Blob.s3_key).where(Blob.s3_key.in_(keys)))).all())
+        if blob_keys:
+            table = Blob.__table__
+            await session.execute(
+                update(table)
+                .where(table.c.s3_key == bindparam("key"))
+                .values(ref_count=table.c.ref_count - bindparam("references")),
+                [{"key": key, "references": counts[key]} for key in sorted(blob_keys)]
+            )
+        orphaned = list((await session.exec(
+            select(Blob.s3_key).where(Blob.s3_key.in_(blob_keys), Blob.ref_count <= 0)
+        )).all()) if blob_keys else []
+        if orphaned:
+            await session.execute(delete(Blob).where(Blob.s3_key.in_(orphaned)))
+
+        # Objetos anteriores a la deduplicación: comprobar si otro archivo apunta a la misma clave
+        legacy = [key for key in keys if key not in blob_keys]
+        if legacy:
+            ids = [file.id for file in files]
+            used = set((await session.exec(
+                select(File.s3_key).where(File.s3_key.in_(legacy), File.id.not_in(ids))
+            )).all())
+            orphaned.extend(key for key in legacy if key not in used)
+        return orphaned
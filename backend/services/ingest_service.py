@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from typing import Optional
+from fastapi import UploadFile
+from sqlmodel.ext.asyncio.session import AsyncSession
+import geohash2
+import crypto
+import metrics
+from models import File
+from services.blob_service import BlobService
+from services.storage import storage
+from services.tile_service import TileService
+from services.tombstone_service import TombstoneService
+from config.settings import COMPRESSION_ENABLED, ZSTD_LEVEL
+
+logger = logging.getLogger(__name__)
+
+class IngestProgress:
+    """Etapa y bytes procesados de una subida en curso."""
+
+    def __init__(self):
+        self.stage = "pending"
+        self.encryptor: Optional[crypto.StreamEncryptor] = None
+
+    @property
+    def bytes_processed(self) -> int:
+        return self.encryptor.plaintext_size if self.encryptor is not None else 0
+
+class IngestService:
+    """Cifrado, almacenamiento y registro de los archivos subidos."""
+
+    @staticmethod
+    async def compression_level(file: UploadFile) -> Optional[int]:
+        """Nivel de zstd para el archivo, o None si no merece la pena comprimirlo."""
+        if not COMPRESSION_ENABLED or not crypto.compression_available():
+            return None
+        sample = await file.read(crypto.COMPRESSION_SAMPLE_SIZE)
+        await file.seek(0)
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, crypto.should_compress, file.content_type, sample):
+            return ZSTD_LEVEL
+        return None
+
+    @staticmethod
+    def blob_stats(encryptor: crypto.StreamEncryptor) -> dict:
+        return {
+            "compressed": encryptor.compressed,
+            "stored_size": encryptor.stored_size,
+            "compression_ratio": round(encryptor.compression_ratio, 4),
+            "compression_cpu_ms": round(encryptor.compress_seconds * 1000, 3),
+        }
+
+    @staticmethod
+    async def store(
+        file: UploadFile,
+        key: bytes,
+        s3_key: str,
+        progress: Optional[IngestProgress] = None,
+        revive: bool = True
+    ) -> crypto.StreamEncryptor:
+        """Cifra el archivo en bloques acotados y lo sube a S3 a medida que se produce."""
+        level = await IngestService.compression_level(file)
+        encryptor = crypto.StreamEncryptor(key, compression_level=level)
+        if progress is not None:
+            progress.stage = "encrypting"
+            progress.encryptor = encryptor
+        if revive:
+            # Un objeto borrado hace poco puede estar aún pendiente de recolectar
+            await TombstoneService.revive(s3_key)
+        if not await storage.put_stream(crypto.encrypt_upload(file, encryptor), s3_key):
+            raise RuntimeError(f"No se pudo guardar {s3_key} en el almacenamiento ({storage.name})")
+        if encryptor.compressed:
+            logger.debug(
+                "Comprimido con zstd nivel %s: %s -> %s bytes (ratio %.3f, %.1f ms de CPU)",
+                level, encryptor.plaintext_size, encryptor.stored_size,
+                encryptor.compression_ratio, encryptor.compress_seconds * 1000
+            )
+        logger.debug("Contenido cifrado: %s -> %s bytes", encryptor.plaintext_size, encryptor.ciphertext_size)
+        return encryptor
+
+    @staticmethod
+    async def restore(session: AsyncSession, file: UploadFile, key: bytes, s3_key: str) -> Optional[dict]:
+        """Recupera el objeto de un blob que se borró entre find y register.
+
+        Se ejecuta en la transacción que ha vuelto a crear el blob, así que la
+        lápida se retira en la misma sesión (revive esperaría a esta transacción).
+        Si el recolector ya se llevó el objeto, se vuelve a subir.
+        """
+        if not await TombstoneService.reclaim(session, s3_key):
+            raise RuntimeError(f"{s3_key} se está eliminando; vuelve a intentar la subida")
+        if await storage.exists(s3_key):
+            return None
+        logger.info("El objeto %s se recolectó durante la deduplicación; se vuelve a subir", s3_key)
+        await file.seek(0)
+        stats = IngestService.blob_stats(await IngestService.store(file, key, s3_key, revive=False))
+        await BlobService.set_stats(session, s3_key, stats)
+        return stats
+
+    @staticmethod
+    async def ingest(
+        session: AsyncSession,
+        file: UploadFile,
+        latitude: float,
+        longitude: float,
+        user_id: int,
+        progress: Optional[IngestProgress] = None
+    ) -> File:
+        """Cifra y guarda el archivo y añade su File y sus agregados a la sesión, sin confirmarla."""
+        # Generar geohash
+        gh = geohash2.encode(latitude, longitude, precision=7)
+        logger.debug("Geohash generado: %s", gh)
+
+        # Identificar el contenido en una primera lectura acotada
+        if progress is not None:
+            progress.stage = "hashing"
+        with metrics.span("key_derivation"):
+            key = crypto.derive_key_from_location(latitude, longitude)
+        with metrics.span("body_read"):
+            content_hash, size = await crypto.digest_upload(file, key)
+        metrics.BYTES_IN.inc(size)
+
+        # Un contenido idéntico en la misma ubicación no se vuelve a cifrar ni a subir
+        stats = None
+        s3_key = BlobService.key_for(gh, content_hash)
+        if await BlobService.find(session, gh, content_hash) is None:
+            await file.seek(0)
+            logger.debug("Intentando subir a S3: %s", s3_key)
+            stats = IngestService.blob_stats(await IngestService.store(file, key, s3_key, progress))
+        else:
+            logger.debug("Contenido duplicado en %s, se reutiliza el objeto existente", gh)
+            await TombstoneService.revive(s3_key)
+        if progress is not None:
+            progress.stage = "saving"
+        s3_key, existed = await BlobService.register(session, gh, content_hash, size, stats)
+        if not existed and stats is None:
+            await IngestService.restore(session, file, key, s3_key)
+
+        db_file = File(
+            filename=file.filename,
+            s3_key=s3_key,
+            geohash=gh,
+            user_id=user_id,
+            size=size,
+            content_type=file.content_type or "application/octet-stream"
+        )
+        session.add(db_file)
+        await TileService.add(session, user_id, [(gh, size)])
+        return db_file
@@ -0,0 +1,80 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+# Coste de bcrypt; los hashes con otro coste se rehacen al iniciar sesión
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = max(int(os.getenv("PASSWORD_HASH_WORKERS", 2)), 1)
+PASSWORD_HASH_MAX_PENDING = max(int(os.getenv("PASSWORD_HASH_MAX_PENDING", 64)), 1)
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+def verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verifica la contraseña y devuelve un hash nuevo si el actual usa otro coste."""
+    return pwd_context.verify_and_update(password, hashed_password)
+
+class PasswordService:
+    """Hashing de contraseñas en un pool de procesos dedicado y acotado."""
+
+    _executor: Optional[ProcessPoolExecutor] = None
+    _pending = 0
+
+    @classmethod
+    def _get_executor(cls) -> ProcessPoolExecutor:
+        if cls._executor is None:
+            # spawn evita heredar locks de los hilos del servidor al hacer fork
+            cls._executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return cls._executor
+
+    @classmethod
+    async def _submit(cls, fn, *args):
+        # Fallar rápido si la cola está llena en lugar de acumular peticiones
+        if cls._pending >= PASSWORD_HASH_MAX_PENDING:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servicio de autenticación saturado, inténtalo de nuevo",
+                headers={"Retry-After": "1"},
+            )
+        cls._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(cls._get_executor(), fn, *args)
+        finally:
+            cls._pending -= 1
+
+    @classmethod
+    async def hash(cls, password: str) -> str:
+        return await cls._submit(hash_password, password)
+
+    @classmethod
+    async def verify_and_update(cls, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await cls._submit(verify_and_update, password, hashed_password)
+
+    @classmethod
+    def pending(cls) -> int:
+        return cls._pending
+
+    @classmethod
+    def shutdown(cls):
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
@@ -0,0 +1,157 @@
+import base64
+import uuid
+from datetime import timedelta
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
+from jose import JWTError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+import geohash2
+import auth
+import crypto
+import metrics
+from models import File, User
+from services.storage import storage
+from services.tile_service import TileService
+from config.settings import PRESIGNED_URL_EXPIRES, PRESIGNED_UPLOAD_MAX_BYTES
+
+class PresignedService:
+    """Transferencias del texto cifrado directamente entre el cliente y S3.
+
+    La API solo firma las URLs y entrega los parámetros de cifrado; el cliente
+    cifra o descifra por su cuenta con el formato segmentado.
+    """
+
+    @staticmethod
+    def _presign(operation: str, s3_key: str) -> str:
+        try:
+            url = storage.presign_get(s3_key, PRESIGNED_URL_EXPIRES) if operation == "get" \
+                else storage.presign_put(s3_key, PRESIGNED_URL_EXPIRES)
+        except NotImplementedError as e:
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+        if url is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="El archivo aún se está replicando, inténtalo de nuevo",
+                headers={"Retry-After": "5"},
+            )
+        return url
+
+    @staticmethod
+    async def _read(s3_key: str, byte_range: Tuple[int, int]) -> bytes:
+        return b"".join([chunk async for chunk in storage.get_stream(s3_key, byte_range)])
+
+    @staticmethod
+    async def download(file: File, key: bytes) -> dict:
+        """URL temporal del texto cifrado y parámetros para descifrarlo."""
+        header = await PresignedService._read(file.s3_key, (0, crypto.HEADER_SIZE - 1))
+        return {
+            "url": PresignedService._presign("get", file.s3_key),
+            "method": "GET",
+            "expires_in": PRESIGNED_URL_EXPIRES,
+            "filename": file.filename,
+            "content_type": file.content_type,
+            "size": file.size,
+            "key": base64.b64encode(key).decode(),
+            "encryption": crypto.format_parameters(crypto.parse_header(header)),
+        }
+
+    @staticmethod
+    def start_upload(user: User, filename: str, content_type: str, size: int, latitude: float, longitude: float) -> dict:
+        """Reserva una clave, firma el PUT y emite el token para completar la subida."""
+        if size > PRESIGNED_UPLOAD_MAX_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Las subidas prefirmadas admiten como máximo {PRESIGNED_UPLOAD_MAX_BYTES} bytes"
+            )
+        gh = geohash2.encode(latitude, longitude, precision=7)
+        s3_key = f"{user.username}/{gh}/{uuid.uuid4().hex}"
+        token = auth.create_upload_token(
+            {
+                "uid": user.id,
+                "key": s3_key,
+                "gh": gh,
+                "filename": filename,
+                "content_type": content_type,
+                "size": size,
+            },
+            # Margen para completar la subida después de que caduque la URL
+            timedelta(seconds=PRESIGNED_URL_EXPIRES * 2)
+        )
+        return {
+            "url": PresignedService._presign("put", s3_key),
+            "method": "PUT",
+            "expires_in": PRESIGNED_URL_EXPIRES,
+            "s3_key": s3_key,
+            "upload_token": token,
+            "key": base64.b64encode(crypto.derive_key_from_geohash(gh)).decode(),
+            "encryption": crypto.format_parameters(
+                (crypto.FORMAT_VERSION, 0, crypto.DEFAULT_SEGMENT_SIZE)
+            ),
+        }
+
+    @staticmethod
+    async def _verify(s3_key: str, key: bytes, declared_size: int) -> Optional[str]:
+        """Comprueba el objeto subido; devuelve el motivo del rechazo o None si es válido."""
+        head = await storage.head(s3_key)
+        if head is None:
+            return "missing"
+        header = await PresignedService._read(s3_key, (0, crypto.HEADER_SIZE - 1))
+        parsed = crypto.parse_header(header)
+        if parsed is None:
+            return "El objeto no tiene el formato segmentado"
+        if parsed[1] != 0:
+            return "Las subidas prefirmadas no admiten compresión"
+        segment_size = parsed[2]
+        if crypto.plaintext_size(head["size"], segment_size) != declared_size:
+            return "El tamaño del objeto no coincide con el declarado"
+        # Descifrar el primer segmento confirma la clave y la cabecera
+        total = crypto.segment_count(declared_size, segment_size)
+        end = min(head["size"], crypto.HEADER_SIZE + segment_size + crypto.SEGMENT_OVERHEAD) - 1
+        segment = await PresignedService._read(s3_key, (crypto.HEADER_SIZE, end))
+        try:
+            crypto.decrypt_segment(key, header, 0, segment, last=total == 1)
+        except ValueError:
+            return "El primer segmento no se puede descifrar con la clave de la ubicación"
+        return None
+
+    @staticmethod
+    async def complete_upload(session: AsyncSession, user: User, upload_token: str) -> File:
+        """Verifica el objeto subido y registra el File; repetir la llamada es inocuo."""
+        try:
+            claims = auth.decode_upload_token(upload_token)
+        except JWTError:
+            raise HTTPException(status_code=400, detail="Token de subida no válido o caducado")
+        if claims["uid"] != user.id:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+        s3_key = claims["key"]
+        existing = (await session.exec(
+            select(File).where(File.s3_key == s3_key, File.user_id == user.id)
+        )).first()
+        if existing is not None:
+            return existing
+
+        error = await PresignedService._verify(
+            s3_key, crypto.derive_key_from_geohash(claims["gh"]), claims["size"]
+        )
+        if error == "missing":
+            raise HTTPException(status_code=409, detail="El objeto aún no se ha subido")
+        if error is not None:
+            await storage.delete(s3_key)
+            raise HTTPException(status_code=422, detail=error)
+
+        db_file = File(
+            filename=claims["filename"],
+            s3_key=s3_key,
+            geohash=claims["gh"],
+            user_id=user.id,
+            size=claims["size"],
+            content_type=claims["content_type"]
+        )
+        session.add(db_file)
+        await TileService.add(session, user.id, [(db_file.geohash, db_file.size)])
+        with metrics.span("db_commit"):
+            await session.commit()
+        await session.refresh(db_file)
+        return db_file
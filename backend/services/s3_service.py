@@ -1,34 +1,363 @@
+import asyncio
+import logging
 import os
-from config.settings import s3, BUCKET_NAME
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+import metrics
+from config.settings import (
+    get_s3_client,
+    BUCKET_NAME,
+    S3_MULTIPART_PART_SIZE,
+    S3_MULTIPART_CONCURRENCY,
+    S3_PART_MAX_RETRIES,
+    S3_MAX_INFLIGHT,
+)
+
+logger = logging.getLogger(__name__)
+
+class S3Pool:
+    """Executor acotado para las llamadas bloqueantes de boto3 con estadísticas de saturación."""
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="s3")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.waited = 0
+        self._wait_seconds = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        """Ejecuta la llamada en el pool sin bloquear el event loop."""
+        submitted = time.monotonic()
+        operation = getattr(fn, "__name__", "call")
+        with self._lock:
+            self.queued += 1
+
+        def call():
+            waited = time.monotonic() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                self._wait_seconds += waited
+                if waited > 0.001:
+                    self.waited += 1
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                metrics.S3_ERRORS.inc(operation=operation)
+                raise
+            finally:
+                metrics.S3_SECONDS.observe(time.perf_counter() - started, operation=operation)
+                with self._lock:
+                    self.in_flight -= 1
+                    self.completed += 1
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, call)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            started = self.completed + self.in_flight
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "peak_in_flight": self.peak_in_flight,
+                "utilization": self.in_flight / self.max_in_flight,
+                "completed": self.completed,
+                "errors": self.errors,
+                "waited": self.waited,
+                "avg_wait_ms": (self._wait_seconds / started * 1000) if started else 0.0,
+            }
+
+_pool = S3Pool(S3_MAX_INFLIGHT)
+
+def _client_call(operation: str):
+    # El cliente se obtiene dentro del hilo del pool: si aún no existe, crearlo no bloquea el event loop
+    def call(**params):
+        return getattr(get_s3_client(), operation)(**params)
+    call.__name__ = operation
+    return call
+
+async def _run(fn, *args, **kwargs):
+    # Ejecutar la llamada bloqueante de boto3 en el pool acotado
+    return await _pool.run(fn, *args, **kwargs)
 
 class S3Service:
+    @staticmethod
+    def pool_stats() -> Dict[str, float]:
+        """Estadísticas de ocupación del pool de operaciones S3."""
+        return _pool.stats()
+
     @staticmethod
     async def upload_file(file_content: bytes, s3_key: str) -> bool:
         try:
-            s3.put_object(
+            await _run(
+                _client_call('put_object'),
                 Bucket=BUCKET_NAME,
                 Key=s3_key,
                 Body=file_content
             )
             return True
         except Exception as e:
-            print(f"Error al subir a S3: {str(e)}")
+            logger.error("Error al subir a S3: %s", e)
+            return False
+
+    @staticmethod
+    async def _upload_part(s3_key: str, upload_id: str, part_number: int, body: bytes, max_retries: int) -> str:
+        for attempt in range(max_retries + 1):
+            try:
+                response = await _run(
+                    _client_call('upload_part'),
+                    Bucket=BUCKET_NAME,
+                    Key=s3_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body
+                )
+                return response['ETag']
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                logger.warning("Reintentando parte %s de %s: %s", part_number, s3_key, e)
+                await asyncio.sleep(0.2 * 2 ** attempt)
+
+    @staticmethod
+    async def create_multipart(s3_key: str) -> str:
+        response = await _run(_client_call('create_multipart_upload'), Bucket=BUCKET_NAME, Key=s3_key)
+        return response['UploadId']
+
+    @staticmethod
+    async def upload_part(s3_key: str, upload_id: str, part_number: int, body: bytes) -> str:
+        return await S3Service._upload_part(s3_key, upload_id, part_number, body, S3_PART_MAX_RETRIES)
+
+    @staticmethod
+    async def complete_multipart(s3_key: str, upload_id: str, parts: List[Tuple[int, str]]):
+        """Une las partes (número, ETag) en el objeto final."""
+        await _run(
+            _client_call('complete_multipart_upload'),
+            Bucket=BUCKET_NAME,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [{'ETag': etag, 'PartNumber': number} for number, etag in parts]}
+        )
+
+    @staticmethod
+    async def abort_multipart(s3_key: str, upload_id: str):
+        """Descarta las partes subidas; no falla si la subida ya no existe."""
+        try:
+            await _run(_client_call('abort_multipart_upload'), Bucket=BUCKET_NAME, Key=s3_key, UploadId=upload_id)
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+
+    @staticmethod
+    async def upload_stream(
+        chunks: AsyncIterable[bytes],
+        s3_key: str,
+        part_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None
+    ) -> bool:
+        """Sube un flujo de bloques; usa multiparte en paralelo si supera una parte."""
+        part_size = part_size or S3_MULTIPART_PART_SIZE
+        concurrency = concurrency or S3_MULTIPART_CONCURRENCY
+        max_retries = S3_PART_MAX_RETRIES if max_retries is None else max_retries
+
+        buffer = bytearray()
+        upload_id = None
+        part_number = 0
+        etags: Dict[int, str] = {}
+        pending = set()
+        # Limita las partes en vuelo y, con ello, la memoria usada por la subida
+        slots = asyncio.Semaphore(concurrency)
+
+        async def upload_part(number: int, body: bytes):
+            try:
+                etags[number] = await S3Service._upload_part(s3_key, upload_id, number, body, max_retries)
+            finally:
+                slots.release()
+
+        async def submit(body: bytes):
+            nonlocal part_number
+            await slots.acquire()
+            for task in [t for t in pending if t.done()]:
+                pending.discard(task)
+                task.result()  # Propaga el primer error sin esperar al resto
+            part_number += 1
+            pending.add(asyncio.ensure_future(upload_part(part_number, body)))
+
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                while len(buffer) >= part_size:
+                    if upload_id is None:
+                        upload_id = await S3Service.create_multipart(s3_key)
+                    body = bytes(buffer[:part_size])
+                    del buffer[:part_size]
+                    await submit(body)
+
+            if upload_id is None:
+                # Archivo pequeño: una sola petición PUT
+                await _run(_client_call('put_object'), Bucket=BUCKET_NAME, Key=s3_key, Body=bytes(buffer))
+                return True
+
+            if buffer:
+                await submit(bytes(buffer))
+                buffer.clear()
+            await asyncio.gather(*pending)
+            pending.clear()
+
+            await S3Service.complete_multipart(s3_key, upload_id, sorted(etags.items()))
+            return True
+        except Exception as e:
+            logger.error("Error en la subida multiparte a S3: %s", e)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if upload_id is not None:
+                try:
+                    await S3Service.abort_multipart(s3_key, upload_id)
+                except Exception as abort_error:
+                    logger.error("Error al abortar la subida multiparte: %s", abort_error)
             return False
 
     @staticmethod
     async def download_file(s3_key: str) -> bytes:
         try:
-            response = s3.get_object(Bucket=BUCKET_NAME, Key=s3_key)
-            return response['Body'].read()
+            response = await _run(_client_call('get_object'), Bucket=BUCKET_NAME, Key=s3_key)
+            return await _run(response['Body'].read)
+        except Exception as e:
+            logger.error("Error al descargar de S3: %s", e)
+            raise
+
+    @staticmethod
+    async def download_stream(
+        s3_key: str,
+        byte_range: Optional[Tuple[int, int]] = None,
+        chunk_size: int = 64 * 1024
+    ) -> AsyncIterator[bytes]:
+        """Descarga un objeto (o un rango de bytes inclusivo) en bloques acotados."""
+        params = {'Bucket': BUCKET_NAME, 'Key': s3_key}
+        if byte_range is not None:
+            params['Range'] = f"bytes={byte_range[0]}-{byte_range[1]}"
+        try:
+            response = await _run(_client_call('get_object'), **params)
+        except Exception as e:
+            logger.error("Error al descargar de S3: %s", e)
+            raise
+        body = response['Body']
+        try:
+            while True:
+                chunk = await _run(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    @staticmethod
+    async def head(s3_key: str) -> Optional[Dict[str, object]]:
+        """ETag y tamaño del objeto, o None si no existe."""
+        try:
+            response = await _run(_client_call('head_object'), Bucket=BUCKET_NAME, Key=s3_key)
         except Exception as e:
-            print(f"Error al descargar de S3: {str(e)}")
+            # ClientError de botocore; se comprueba por atributo para no importarlo al cargar el módulo
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
             raise
+        return {'etag': response['ETag'].strip('"'), 'size': response['ContentLength']}
+
+    @staticmethod
+    def presigned_url(operation: str, s3_key: str, expires_in: int) -> str:
+        """URL prefirmada de get_object o put_object; se firma localmente, sin llamar a S3."""
+        return get_s3_client().generate_presigned_url(
+            operation,
+            Params={'Bucket': BUCKET_NAME, 'Key': s3_key},
+            ExpiresIn=expires_in
+        )
+
+    @staticmethod
+    async def check_bucket():
+        """Crea el cliente si hace falta y comprueba el acceso al bucket; lanza la excepción si falla."""
+        await _run(_client_call('head_bucket'), Bucket=BUCKET_NAME)
+        logger.info("Acceso al bucket %s verificado", BUCKET_NAME)
+
+    @staticmethod
+    async def list_objects(
+        prefix: str = '',
+        delimiter: Optional[str] = None,
+        page_size: int = 1000
+    ) -> AsyncIterator[Dict[str, object]]:
+        """Recorre las claves bajo el prefijo en orden, una página de list_objects_v2 cada vez.
+
+        Con delimitador, los prefijos comunes salen intercalados como entradas con size None.
+        """
+        params = {'Bucket': BUCKET_NAME, 'Prefix': prefix, 'MaxKeys': page_size}
+        if delimiter:
+            params['Delimiter'] = delimiter
+        while True:
+            response = await _run(_client_call('list_objects_v2'), **params)
+            entries = [
+                {'key': item['Key'], 'size': item['Size'], 'last_modified': item['LastModified']}
+                for item in response.get('Contents', [])
+            ]
+            entries.extend(
+                {'key': item['Prefix'], 'size': None, 'last_modified': None}
+                for item in response.get('CommonPrefixes', [])
+            )
+            # S3 pagina claves y prefijos juntos en orden binario
+            entries.sort(key=lambda entry: entry['key'])
+            for entry in entries:
+                yield entry
+            if not response.get('IsTruncated'):
+                return
+            params['ContinuationToken'] = response['NextContinuationToken']
+
+    @staticmethod
+    async def exists(s3_key: str) -> bool:
+        return await S3Service.head(s3_key) is not None
+
+    @staticmethod
+    async def delete_objects(keys: List[str], batch_size: int = 1000) -> List[str]:
+        """Borra las claves con DeleteObjects (hasta 1000 por llamada) en paralelo.
+
+        Devuelve las claves que no se pudieron borrar; las que no existen cuentan como borradas.
+        """
+        async def delete_batch(batch: List[str]) -> List[str]:
+            try:
+                response = await _run(
+                    _client_call('delete_objects'),
+                    Bucket=BUCKET_NAME,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+            except Exception as e:
+                logger.error("Error al eliminar %s objetos de S3: %s", len(batch), e)
+                return batch
+            errors = response.get('Errors', [])
+            for error in errors[:3]:
+                logger.error("Error al eliminar %s de S3: %s", error.get('Key'), error.get('Message'))
+            return [error['Key'] for error in errors]
+
+        batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+        failed = await asyncio.gather(*[delete_batch(batch) for batch in batches])
+        return [key for batch in failed for key in batch]
 
     @staticmethod
     async def delete_file(s3_key: str) -> bool:
         try:
-            s3.delete_object(Bucket=BUCKET_NAME, Key=s3_key)
+            await _run(_client_call('delete_object'), Bucket=BUCKET_NAME, Key=s3_key)
             return True
         except Exception as e:
-            print(f"Error al eliminar de S3: {str(e)}")
-            return False 
\ No newline at end of file
+            logger.error("Error al eliminar de S3: %s", e)
+            return False
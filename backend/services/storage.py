@@ -0,0 +1,801 @@
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+import metrics
+from services.s3_service import S3Service
+from config.settings import (
+    STORAGE_BACKEND,
+    STORAGE_LOCAL_DIR,
+    STORAGE_WRITE_BEHIND,
+    WRITE_BEHIND_DIR,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_MAX_BACKOFF,
+    BLOB_CACHE_MEMORY_BYTES,
+    BLOB_CACHE_DISK_BYTES,
+    BLOB_CACHE_DIR,
+    BLOB_CACHE_MAX_OBJECT_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+ByteRange = Optional[Tuple[int, int]]
+
+class StorageBackend(ABC):
+    """Almacén de blobs cifrados; las claves son las mismas que en S3."""
+
+    name = "base"
+
+    @abstractmethod
+    async def put_stream(self, chunks: AsyncIterable[bytes], key: str) -> bool:
+        """Guarda el flujo bajo la clave; devuelve False si no se pudo guardar."""
+
+    @abstractmethod
+    def get_stream(self, key: str, byte_range: ByteRange = None) -> AsyncIterator[bytes]:
+        """Lee el objeto (o un rango de bytes inclusivo) en bloques acotados."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Elimina el objeto; devuelve False si no se pudo eliminar."""
+
+    @abstractmethod
+    async def head(self, key: str) -> Optional[Dict[str, object]]:
+        """ETag y tamaño del objeto, o None si no existe."""
+
+    async def exists(self, key: str) -> bool:
+        return await self.head(key) is not None
+
+    async def delete_many(self, keys: List[str]) -> List[str]:
+        """Elimina varios objetos; devuelve las claves que no se pudieron eliminar."""
+        results = await asyncio.gather(*[self.delete(key) for key in keys])
+        return [key for key, deleted in zip(keys, results) if not deleted]
+
+    def presign_get(self, key: str, expires_in: int) -> Optional[str]:
+        """URL temporal para leer el objeto sin pasar por la API; None si ahora no es posible."""
+        raise NotImplementedError(f"El almacenamiento {self.name} no admite URLs prefirmadas")
+
+    def presign_put(self, key: str, expires_in: int) -> Optional[str]:
+        """URL temporal para escribir el objeto sin pasar por la API."""
+        raise NotImplementedError(f"El almacenamiento {self.name} no admite URLs prefirmadas")
+
+    async def create_multipart(self, key: str) -> str:
+        """Inicia una escritura por partes y devuelve su identificador."""
+        raise NotImplementedError(f"El almacenamiento {self.name} no admite escrituras por partes")
+
+    async def put_part(self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        """Guarda la parte number (desde 1), sustituyendo la anterior; devuelve su ETag."""
+        raise NotImplementedError(f"El almacenamiento {self.name} no admite escrituras por partes")
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]):
+        """Une las partes (número, ETag) en orden en el objeto final."""
+        raise NotImplementedError(f"El almacenamiento {self.name} no admite escrituras por partes")
+
+    async def abort_multipart(self, key: str, upload_id: str):
+        """Descarta las partes; no falla si la escritura ya no existe."""
+        raise NotImplementedError(f"El almacenamiento {self.name} no admite escrituras por partes")
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def check(self):
+        """Prepara y comprueba el acceso al destino; lanza una excepción si no está disponible."""
+        pass
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": self.name}
+
+class S3StorageBackend(StorageBackend):
+    name = "s3"
+
+    async def put_stream(self, chunks: AsyncIterable[bytes], key: str) -> bool:
+        return await S3Service.upload_stream(chunks, key)
+
+    def get_stream(self, key: str, byte_range: ByteRange = None) -> AsyncIterator[bytes]:
+        return S3Service.download_stream(key, byte_range)
+
+    async def delete(self, key: str) -> bool:
+        return await S3Service.delete_file(key)
+
+    async def delete_many(self, keys: List[str]) -> List[str]:
+        return await S3Service.delete_objects(keys)
+
+    async def head(self, key: str) -> Optional[Dict[str, object]]:
+        return await S3Service.head(key)
+
+    def presign_get(self, key: str, expires_in: int) -> Optional[str]:
+        return S3Service.presigned_url('get_object', key, expires_in)
+
+    def presign_put(self, key: str, expires_in: int) -> Optional[str]:
+        return S3Service.presigned_url('put_object', key, expires_in)
+
+    async def create_multipart(self, key: str) -> str:
+        return await S3Service.create_multipart(key)
+
+    async def put_part(self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        return await S3Service.upload_part(key, upload_id, number, body)
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]):
+        await S3Service.complete_multipart(key, upload_id, parts)
+
+    async def abort_multipart(self, key: str, upload_id: str):
+        await S3Service.abort_multipart(key, upload_id)
+
+    async def check(self):
+        await S3Service.check_bucket()
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": self.name, "pool": S3Service.pool_stats()}
+
+class LocalStorageBackend(StorageBackend):
+    """Blobs en un directorio local; cada escritura es atómica (temporal + rename)."""
+
+    name = "local"
+    TMP_SUFFIX = ".tmp"
+    # Partes de las escrituras por partes en curso, fuera del espacio de claves
+    MULTIPART_DIR = ".multipart"
+
+    def __init__(self, root: str, chunk_size: int = 64 * 1024):
+        self.root = os.path.abspath(root)
+        self.chunk_size = chunk_size
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Clave no válida: {key}")
+        return path
+
+    async def put_stream(self, chunks: AsyncIterable[bytes], key: str) -> bool:
+        path = self.path_for(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}{self.TMP_SUFFIX}"
+        loop = asyncio.get_running_loop()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    await loop.run_in_executor(None, f.write, chunk)
+                await loop.run_in_executor(None, f.flush)
+                await loop.run_in_executor(None, os.fsync, f.fileno())
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logger.error("Error al guardar %s en %s: %s", key, self.root, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    async def get_stream(self, key: str, byte_range: ByteRange = None) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        # open() falla antes del primer bloque si el objeto no existe
+        with open(self.path_for(key), "rb") as f:
+            remaining = None
+            if byte_range is not None:
+                f.seek(byte_range[0])
+                remaining = byte_range[1] - byte_range[0] + 1
+            while remaining is None or remaining > 0:
+                size = self.chunk_size if remaining is None else min(self.chunk_size, remaining)
+                chunk = await loop.run_in_executor(None, f.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def delete(self, key: str) -> bool:
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error("Error al eliminar %s de %s: %s", key, self.root, e)
+            return False
+        return True
+
+    async def head(self, key: str) -> Optional[Dict[str, object]]:
+        try:
+            info = os.stat(self.path_for(key))
+        except FileNotFoundError:
+            return None
+        # Las escrituras son atómicas: fecha y tamaño identifican el contenido
+        return {"etag": f"{info.st_mtime_ns:x}-{info.st_size:x}", "size": info.st_size}
+
+    def _part_dir(self, upload_id: str) -> str:
+        if not upload_id.isalnum():
+            raise ValueError(f"Escritura por partes no válida: {upload_id}")
+        return os.path.join(self.root, self.MULTIPART_DIR, upload_id)
+
+    async def create_multipart(self, key: str) -> str:
+        self.path_for(key)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._part_dir(upload_id))
+        return upload_id
+
+    async def put_part(self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        path = os.path.join(self._part_dir(upload_id), str(number))
+        tmp_path = f"{path}.{uuid.uuid4().hex}{self.TMP_SUFFIX}"
+
+        def write():
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            return hashlib.md5(body).hexdigest()
+
+        return await asyncio.get_running_loop().run_in_executor(None, write)
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]):
+        directory = self._part_dir(upload_id)
+        loop = asyncio.get_running_loop()
+
+        async def chunks():
+            for number, _ in parts:
+                with open(os.path.join(directory, str(number)), "rb") as f:
+                    while True:
+                        chunk = await loop.run_in_executor(None, f.read, self.chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+
+        if not await self.put_stream(chunks(), key):
+            raise RuntimeError(f"No se pudieron unir las partes de {key}")
+        shutil.rmtree(directory, ignore_errors=True)
+
+    async def abort_multipart(self, key: str, upload_id: str):
+        shutil.rmtree(self._part_dir(upload_id), ignore_errors=True)
+
+    def _walk(self):
+        for directory, dirnames, filenames in os.walk(self.root):
+            if directory == self.root and self.MULTIPART_DIR in dirnames:
+                dirnames.remove(self.MULTIPART_DIR)
+            yield directory, filenames
+
+    def keys(self):
+        """Claves guardadas, ignorando escrituras temporales a medias."""
+        for directory, filenames in self._walk():
+            for filename in filenames:
+                if filename.endswith(self.TMP_SUFFIX):
+                    continue
+                path = os.path.join(directory, filename)
+                yield os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def remove_temporary(self) -> int:
+        removed = 0
+        for directory, filenames in self._walk():
+            for filename in filenames:
+                if filename.endswith(self.TMP_SUFFIX):
+                    os.remove(os.path.join(directory, filename))
+                    removed += 1
+        return removed
+
+class MemoryStorageBackend(StorageBackend):
+    """Blobs en memoria del proceso; pensado para pruebas y desarrollo."""
+
+    name = "memory"
+
+    def __init__(self, chunk_size: int = 64 * 1024):
+        self.chunk_size = chunk_size
+        self._objects: Dict[str, bytes] = {}
+        self._parts: Dict[str, Dict[int, bytes]] = {}
+
+    async def put_stream(self, chunks: AsyncIterable[bytes], key: str) -> bool:
+        buffer = bytearray()
+        async for chunk in chunks:
+            buffer += chunk
+        self._objects[key] = bytes(buffer)
+        return True
+
+    async def get_stream(self, key: str, byte_range: ByteRange = None) -> AsyncIterator[bytes]:
+        data = self._objects[key]
+        start, end = byte_range if byte_range is not None else (0, len(data) - 1)
+        for offset in range(start, min(end, len(data) - 1) + 1, self.chunk_size):
+            yield data[offset:min(offset + self.chunk_size, end + 1)]
+
+    async def delete(self, key: str) -> bool:
+        self._objects.pop(key, None)
+        return True
+
+    async def head(self, key: str) -> Optional[Dict[str, object]]:
+        data = self._objects.get(key)
+        if data is None:
+            return None
+        return {"etag": hashlib.md5(data).hexdigest(), "size": len(data)}
+
+    async def create_multipart(self, key: str) -> str:
+        upload_id = uuid.uuid4().hex
+        self._parts[upload_id] = {}
+        return upload_id
+
+    async def put_part(self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        self._parts[upload_id][number] = body
+        return hashlib.md5(body).hexdigest()
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]):
+        stored = self._parts.pop(upload_id)
+        self._objects[key] = b"".join(stored[number] for number, _ in parts)
+
+    async def abort_multipart(self, key: str, upload_id: str):
+        self._parts.pop(upload_id, None)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.name,
+            "objects": len(self._objects),
+            "bytes": sum(len(data) for data in self._objects.values()),
+        }
+
+class WriteBehindStorageBackend(StorageBackend):
+    """Confirma las escrituras al guardarlas en disco local y las replica después al destino.
+
+    Un worker en segundo plano sube los objetos pendientes por lotes, con
+    reintentos y espera exponencial; las lecturas miran primero el disco local.
+    Al arrancar se vuelven a encolar los objetos que quedaron pendientes.
+    """
+
+    name = "write-behind"
+
+    def __init__(
+        self,
+        staging: LocalStorageBackend,
+        remote: StorageBackend,
+        batch_size: int = 16,
+        max_backoff: float = 60.0,
+        base_backoff: float = 0.5
+    ):
+        self.staging = staging
+        self.remote = remote
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.base_backoff = base_backoff
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Versión de cada clave pendiente: una sobrescritura durante la subida la invalida
+        self._pending: Dict[str, int] = {}
+        self._attempts: Dict[str, int] = {}
+        self._staged_at: Dict[str, float] = {}
+        self._version = 0
+        self.replicated = 0
+        self.failures = 0
+
+    def _enqueue(self, key: str):
+        if self._queue is not None:
+            self._queue.put_nowait(key)
+
+    async def start(self):
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        removed = self.staging.remove_temporary()
+        if removed:
+            logger.warning("Descartadas %s escrituras locales incompletas", removed)
+        for key in self.staging.keys():
+            self._version += 1
+            self._pending[key] = self._version
+            self._staged_at[key] = time.time()
+        for key in self._pending:
+            self._enqueue(key)
+        if self._pending:
+            logger.info("Reanudando la replicación de %s objetos pendientes", len(self._pending))
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        self._worker = None
+        self._queue = None
+
+    async def put_stream(self, chunks: AsyncIterable[bytes], key: str) -> bool:
+        if not await self.staging.put_stream(chunks, key):
+            return False
+        self._staged(key)
+        return True
+
+    def _staged(self, key: str):
+        self._version += 1
+        already_queued = key in self._pending
+        self._pending[key] = self._version
+        self._attempts.pop(key, None)
+        self._staged_at[key] = time.time()
+        metrics.STORAGE_EVENTS.inc(event="write_behind_staged")
+        if not already_queued:
+            self._enqueue(key)
+
+    async def get_stream(self, key: str, byte_range: ByteRange = None) -> AsyncIterator[bytes]:
+        if key in self._pending:
+            # El objeto puede terminar de replicarse justo antes de abrirlo
+            try:
+                stream = self.staging.get_stream(key, byte_range)
+                first = await stream.__anext__()
+            except FileNotFoundError:
+                stream = None
+            except StopAsyncIteration:
+                return
+            if stream is not None:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+                return
+        async for chunk in self.remote.get_stream(key, byte_range):
+            yield chunk
+
+    async def delete(self, key: str) -> bool:
+        self._forget(key)
+        await self.staging.delete(key)
+        return await self.remote.delete(key)
+
+    async def delete_many(self, keys: List[str]) -> List[str]:
+        for key in keys:
+            self._forget(key)
+        await self.staging.delete_many(keys)
+        return await self.remote.delete_many(keys)
+
+    async def head(self, key: str) -> Optional[Dict[str, object]]:
+        if key in self._pending:
+            head = await self.staging.head(key)
+            if head is not None:
+                return head
+        return await self.remote.head(key)
+
+    def presign_get(self, key: str, expires_in: int) -> Optional[str]:
+        # Un objeto aún no replicado solo existe en el disco local
+        if key in self._pending:
+            return None
+        return self.remote.presign_get(key, expires_in)
+
+    def presign_put(self, key: str, expires_in: int) -> Optional[str]:
+        return self.remote.presign_put(key, expires_in)
+
+    # Las partes se guardan en el disco local y el objeto unido se replica como cualquier otro
+    async def create_multipart(self, key: str) -> str:
+        return await self.staging.create_multipart(key)
+
+    async def put_part(self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        return await self.staging.put_part(key, upload_id, number, body)
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]):
+        await self.staging.complete_multipart(key, upload_id, parts)
+        self._staged(key)
+
+    async def abort_multipart(self, key: str, upload_id: str):
+        await self.staging.abort_multipart(key, upload_id)
+
+    async def check(self):
+        await self.remote.check()
+
+    def _forget(self, key: str):
+        self._pending.pop(key, None)
+        self._attempts.pop(key, None)
+        self._staged_at.pop(key, None)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # Claves repetidas en la cola o ya eliminadas no se suben
+            batch = [key for key in dict.fromkeys(batch) if key in self._pending]
+            await asyncio.gather(*[self._replicate(key) for key in batch])
+
+    async def _replicate(self, key: str):
+        version = self._pending[key]
+        try:
+            uploaded = await self.remote.put_stream(self.staging.get_stream(key), key)
+        except Exception as e:
+            logger.error("Error al replicar %s: %s", key, e)
+            uploaded = False
+        if key not in self._pending:
+            # Eliminado mientras se subía: no dejar la copia remota huérfana
+            if uploaded:
+                await self.remote.delete(key)
+            return
+        if not uploaded:
+            self._retry_later(key)
+            return
+        if self._pending[key] != version:
+            # Sobrescrito durante la subida: replicar la versión nueva
+            self._enqueue(key)
+            return
+        self._forget(key)
+        await self.staging.delete(key)
+        self.replicated += 1
+        metrics.STORAGE_EVENTS.inc(event="write_behind_replicated")
+
+    def _retry_later(self, key: str):
+        self.failures += 1
+        metrics.STORAGE_EVENTS.inc(event="write_behind_retry")
+        attempt = self._attempts.get(key, 0)
+        self._attempts[key] = attempt + 1
+        delay = min(self.base_backoff * 2 ** attempt, self.max_backoff)
+        logger.warning("Replicación de %s fallida (intento %s), reintento en %.1fs", key, attempt + 1, delay)
+        asyncio.get_running_loop().call_later(delay, self._requeue, key)
+
+    def _requeue(self, key: str):
+        if key in self._pending:
+            self._enqueue(key)
+
+    def stats(self) -> Dict[str, object]:
+        oldest = min(self._staged_at.values(), default=None)
+        return {
+            "backend": self.name,
+            "remote": self.remote.stats(),
+            "pending": len(self._pending),
+            "retrying": len(self._attempts),
+            "oldest_pending_seconds": (time.time() - oldest) if oldest is not None else 0.0,
+            "replicated": self.replicated,
+            "failures": self.failures,
+        }
+
+class CachedStorageBackend(StorageBackend):
+    """Caché de lectura del texto cifrado en dos niveles: LRU en memoria y disco local.
+
+    Las entradas se identifican por clave y ETag. Los blobs direccionados por
+    contenido (blobs/) no cambian y no se revalidan; el resto se comprueba con
+    un HEAD antes de servirlos. Nunca se guarda texto plano.
+    """
+
+    name = "cached"
+    IMMUTABLE_PREFIXES = ("blobs/",)
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        memory_bytes: int,
+        disk_dir: str,
+        disk_bytes: int,
+        max_object_bytes: int,
+        chunk_size: int = 64 * 1024
+    ):
+        self.backend = backend
+        self.memory_bytes = memory_bytes
+        self.disk_dir = os.path.abspath(disk_dir)
+        self.disk_bytes = disk_bytes
+        self.max_object_bytes = max_object_bytes
+        # Los objetos grandes van directamente a disco para no vaciar la memoria
+        self.memory_object_bytes = min(max_object_bytes, memory_bytes // 8)
+        self.chunk_size = chunk_size
+        self._memory: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._memory_size = 0
+        self._disk: "OrderedDict[str, Tuple[str, str, int]]" = OrderedDict()
+        self._disk_size = 0
+        # Cambia con cada invalidación: un llenado iniciado antes no se guarda
+        self._generation = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    async def start(self):
+        if self.disk_bytes > 0:
+            # El índice del disco vive en memoria: se empieza siempre vacío
+            os.makedirs(self.disk_dir, exist_ok=True)
+            for filename in os.listdir(self.disk_dir):
+                os.remove(os.path.join(self.disk_dir, filename))
+        await self.backend.start()
+
+    async def stop(self):
+        await self.backend.stop()
+
+    async def check(self):
+        await self.backend.check()
+
+    async def put_stream(self, chunks: AsyncIterable[bytes], key: str) -> bool:
+        self.invalidate(key)
+        stored = await self.backend.put_stream(chunks, key)
+        self.invalidate(key)
+        return stored
+
+    async def delete(self, key: str) -> bool:
+        self.invalidate(key)
+        return await self.backend.delete(key)
+
+    async def delete_many(self, keys: List[str]) -> List[str]:
+        for key in keys:
+            self.invalidate(key)
+        return await self.backend.delete_many(keys)
+
+    async def head(self, key: str) -> Optional[Dict[str, object]]:
+        return await self.backend.head(key)
+
+    def presign_get(self, key: str, expires_in: int) -> Optional[str]:
+        return self.backend.presign_get(key, expires_in)
+
+    def presign_put(self, key: str, expires_in: int) -> Optional[str]:
+        self.invalidate(key)
+        return self.backend.presign_put(key, expires_in)
+
+    async def create_multipart(self, key: str) -> str:
+        return await self.backend.create_multipart(key)
+
+    async def put_part(self, key: str, upload_id: str, number: int, body: bytes) -> str:
+        return await self.backend.put_part(key, upload_id, number, body)
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]):
+        self.invalidate(key)
+        await self.backend.complete_multipart(key, upload_id, parts)
+        self.invalidate(key)
+
+    async def abort_multipart(self, key: str, upload_id: str):
+        await self.backend.abort_multipart(key, upload_id)
+
+    def invalidate(self, key: str):
+        self._generation += 1
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= len(entry[1])
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self._disk_size -= entry[2]
+            self._remove_file(entry[1])
+
+    async def get_stream(self, key: str, byte_range: ByteRange = None) -> AsyncIterator[bytes]:
+        tier = await self._lookup(key)
+        if tier == "memory":
+            self.memory_hits += 1
+            metrics.STORAGE_EVENTS.inc(event="cache_hit_memory")
+            data = self._memory[key][1]
+            start, end = byte_range if byte_range is not None else (0, len(data) - 1)
+            for offset in range(start, min(end, len(data) - 1) + 1, self.chunk_size):
+                yield data[offset:min(offset + self.chunk_size, end + 1)]
+            return
+        if tier == "disk":
+            self.disk_hits += 1
+            metrics.STORAGE_EVENTS.inc(event="cache_hit_disk")
+            async for chunk in self._read_disk(self._disk[key][1], byte_range):
+                yield chunk
+            return
+
+        self.misses += 1
+        metrics.STORAGE_EVENTS.inc(event="cache_miss")
+        head = await self.backend.head(key) if byte_range is None else None
+        if head is None or head["size"] > self.max_object_bytes:
+            # Los rangos y los objetos demasiado grandes no se cachean
+            async for chunk in self.backend.get_stream(key, byte_range):
+                yield chunk
+            return
+        generation = self._generation
+        buffer = bytearray()
+        async for chunk in self.backend.get_stream(key):
+            buffer += chunk
+            yield chunk
+        if len(buffer) == head["size"] and generation == self._generation:
+            await self._store(key, head["etag"], bytes(buffer))
+
+    async def _lookup(self, key: str) -> Optional[str]:
+        if key in self._memory:
+            tier, etag = "memory", self._memory[key][0]
+        elif key in self._disk:
+            tier, etag = "disk", self._disk[key][0]
+        else:
+            return None
+        if not key.startswith(self.IMMUTABLE_PREFIXES):
+            self.revalidations += 1
+            head = await self.backend.head(key)
+            if head is None or head["etag"] != etag:
+                self.invalidate(key)
+                return None
+        (self._memory if tier == "memory" else self._disk).move_to_end(key)
+        return tier
+
+    async def _read_disk(self, path: str, byte_range: ByteRange) -> AsyncIterator[bytes]:
+        # mmap sigue siendo válido aunque el archivo se expulse durante la lectura
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                start, end = byte_range if byte_range is not None else (0, len(view) - 1)
+                end = min(end, len(view) - 1)
+                for offset in range(start, end + 1, self.chunk_size):
+                    yield view[offset:min(offset + self.chunk_size, end + 1)]
+
+    async def _store(self, key: str, etag: str, data: bytes):
+        if len(data) <= self.memory_object_bytes:
+            self._memory[key] = (etag, data)
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                evicted_key, (evicted_etag, evicted) = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+                self.evictions += 1
+                # Lo expulsado de memoria baja al disco
+                await self._store_disk(evicted_key, evicted_etag, evicted)
+        else:
+            await self._store_disk(key, etag, data)
+
+    async def _store_disk(self, key: str, etag: str, data: bytes):
+        if not data or len(data) > self.disk_bytes:
+            return
+        generation = self._generation
+        name = hashlib.sha256(f"{key}\0{etag}".encode()).hexdigest()
+        path = os.path.join(self.disk_dir, name)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_file, path, data)
+        except Exception as e:
+            logger.error("Error al guardar %s en la caché de disco: %s", key, e)
+            return
+        if generation != self._generation or key in self._memory:
+            self._remove_file(path)
+            return
+        previous = self._disk.pop(key, None)
+        if previous is not None:
+            self._disk_size -= previous[2]
+            if previous[1] != path:
+                self._remove_file(previous[1])
+        self._disk[key] = (etag, path, len(data))
+        self._disk_size += len(data)
+        while self._disk_size > self.disk_bytes:
+            _, (_, evicted_path, size) = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self.evictions += 1
+            self._remove_file(evicted_path)
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, object]:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "backend": self.name,
+            "inner": self.backend.stats(),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_size,
+        }
+
+def create_storage() -> StorageBackend:
+    """Construye el almacenamiento configurado por STORAGE_BACKEND y STORAGE_WRITE_BEHIND."""
+    if STORAGE_BACKEND == "s3":
+        backend = S3StorageBackend()
+    elif STORAGE_BACKEND == "local":
+        backend = LocalStorageBackend(STORAGE_LOCAL_DIR)
+    elif STORAGE_BACKEND == "memory":
+        backend = MemoryStorageBackend()
+    else:
+        raise ValueError(f"STORAGE_BACKEND no válido: {STORAGE_BACKEND}")
+    if STORAGE_WRITE_BEHIND:
+        backend = WriteBehindStorageBackend(
+            LocalStorageBackend(WRITE_BEHIND_DIR),
+            backend,
+            batch_size=WRITE_BEHIND_BATCH_SIZE,
+            max_backoff=WRITE_BEHIND_MAX_BACKOFF
+        )
+    if BLOB_CACHE_MEMORY_BYTES > 0 or BLOB_CACHE_DISK_BYTES > 0:
+        backend = CachedStorageBackend(
+            backend,
+            memory_bytes=BLOB_CACHE_MEMORY_BYTES,
+            disk_dir=BLOB_CACHE_DIR,
+            disk_bytes=BLOB_CACHE_DISK_BYTES,
+            max_object_bytes=BLOB_CACHE_MAX_OBJECT_BYTES
+        )
+    return backend
+
+storage = create_storage()
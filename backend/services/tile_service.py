@@ -0,0 +1,107 @@
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import and_, delete, func, literal, or_, select as sa_select, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+import geo
+from models import File, GeohashTile
+
+# Precisiones de geohash que se agregan (de ~156 km a ~153 m de celda)
+TILE_PRECISIONS = range(3, 8)
+
+class TileService:
+    """Agregados por celda de geohash mantenidos en la misma transacción que los File."""
+
+    @staticmethod
+    async def _apply(session: AsyncSession, user_id: int, changes: Iterable[Tuple[str, int, int]]):
+        # Sumar los cambios por (precisión, prefijo) antes de escribir
+        totals: Dict[Tuple[int, str], List[int]] = {}
+        for geohash, count, size in changes:
+            for precision in TILE_PRECISIONS:
+                if len(geohash) < precision:
+                    break
+                entry = totals.setdefault((precision, geohash[:precision]), [0, 0])
+                entry[0] += count
+                entry[1] += size
+        if not totals:
+            return
+
+        dialect = session.sync_session.get_bind().dialect.name
+        insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+        table = GeohashTile.__table__
+        # Filas en orden fijo: dos transacciones no se bloquean en orden inverso
+        statement = insert(table).values([
+            {"user_id": user_id, "precision": precision, "prefix": prefix, "file_count": count, "total_bytes": size}
+            for (precision, prefix), (count, size) in sorted(totals.items())
+        ])
+        statement = statement.on_conflict_do_update(
+            index_elements=["user_id", "precision", "prefix"],
+            set_={
+                "file_count": table.c.file_count + statement.excluded.file_count,
+                "total_bytes": table.c.total_bytes + statement.excluded.total_bytes,
+            }
+        )
+        await session.execute(statement)
+        # Las celdas que se quedan sin archivos desaparecen
+        emptied = [key for key, (count, _) in totals.items() if count < 0]
+        if emptied:
+            await session.execute(
+                delete(GeohashTile).where(
+                    GeohashTile.user_id == user_id,
+                    tuple_(GeohashTile.precision, GeohashTile.prefix).in_(emptied),
+                    GeohashTile.file_count <= 0
+                )
+            )
+
+    @staticmethod
+    async def add(session: AsyncSession, user_id: int, files: Iterable[Tuple[str, int]]):
+        """Suma los archivos (geohash, tamaño) a los agregados del usuario."""
+        await TileService._apply(session, user_id, [(geohash, 1, size) for geohash, size in files])
+
+    @staticmethod
+    async def remove(session: AsyncSession, user_id: int, files: Iterable[Tuple[str, int]]):
+        """Resta los archivos (geohash, tamaño) de los agregados del usuario."""
+        await TileService._apply(session, user_id, [(geohash, -1, -size) for geohash, size in files])
+
+    @staticmethod
+    async def tiles(
+        session: AsyncSession,
+        user_id: int,
+        bbox: Tuple[float, float, float, float],
+        precision: int
+    ) -> List[GeohashTile]:
+        """Celdas de la precisión dada que se solapan con la caja, con un rango del índice por prefijo."""
+        ranges = [geo.prefix_range(prefix) for prefix in geo.cover_bbox(bbox, max_precision=precision)]
+        tiles = (await session.exec(
+            select(GeohashTile).where(
+                GeohashTile.user_id == user_id,
+                GeohashTile.precision == precision,
+                or_(*[and_(GeohashTile.prefix >= low, GeohashTile.prefix < high) for low, high in ranges])
+            ).order_by(GeohashTile.prefix)
+        )).all()
+        return [tile for tile in tiles if geo.bbox_overlaps(geo.cell_bounds(tile.prefix), bbox)]
+
+    @staticmethod
+    async def backfill(session: AsyncSession) -> bool:
+        """Calcula los agregados a partir de File si la tabla está vacía y hay archivos."""
+        if (await session.exec(select(GeohashTile.user_id).limit(1))).first() is not None:
+            return False
+        if (await session.exec(select(File.id).limit(1))).first() is None:
+            return False
+        for precision in TILE_PRECISIONS:
+            prefix = func.substr(File.geohash, 1, precision)
+            await session.execute(
+                GeohashTile.__table__.insert().from_select(
+                    ["user_id", "precision", "prefix", "file_count", "total_bytes"],
+                    sa_select(
+                        File.user_id,
+                        literal(precision),
+                        prefix,
+                        func.count(),
+                        func.coalesce(func.sum(File.size), 0)
+                    ).where(func.length(File.geohash) >= precision).group_by(File.user_id, prefix)
+                )
+            )
+        await session.commit()
+        return True
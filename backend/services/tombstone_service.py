@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import delete, or_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+import metrics
+from database import async_session
+from models import Blob, File, Tombstone
+from services.storage import storage
+from config.settings import GC_INTERVAL, GC_BATCH_SIZE, GC_MAX_BACKOFF, GC_CLAIM_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class TombstoneService:
+    """Borrado diferido de los objetos que ya no usa ningún archivo.
+
+    Las lápidas se crean en la misma transacción que borra los File; un worker
+    las reclama por lotes, comprueba que el objeto sigue sin referencias y lo
+    borra del almacenamiento, reintentando los fallos con espera exponencial.
+    """
+
+    _task: Optional[asyncio.Task] = None
+    _wakeup: Optional[asyncio.Event] = None
+    deleted = 0
+    skipped = 0
+    failures = 0
+
+    @staticmethod
+    async def bury(session: AsyncSession, keys: List[str]):
+        """Añade las lápidas a la transacción de la sesión, sin confirmarla."""
+        if not keys:
+            return
+        dialect = session.sync_session.get_bind().dialect.name
+        insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+        now = datetime.utcnow()
+        await session.execute(
+            insert(Tombstone.__table__).values([
+                {"s3_key": key, "attempts": 0, "next_attempt_at": now, "created_at": now}
+                for key in sorted(set(keys))
+            ]).on_conflict_do_nothing(index_elements=["s3_key"])
+        )
+
+    @staticmethod
+    async def revive(s3_key: str):
+        """Retira la lápida de una clave que se va a volver a escribir.
+
+        Si el worker ya la está borrando, espera a que termine para que el
+        borrado no se lleve la escritura nueva.
+        """
+        while True:
+            async with async_session() as session:
+                if (await session.exec(select(Tombstone.id).where(Tombstone.s3_key == s3_key))).first() is None:
+                    return
+                stale = datetime.utcnow() - timedelta(seconds=GC_CLAIM_TIMEOUT)
+                result = await session.execute(
+                    delete(Tombstone).where(
+                        Tombstone.s3_key == s3_key,
+                        or_(Tombstone.claim.is_(None), Tombstone.claimed_at < stale)
+                    )
+                )
+                await session.commit()
+                if result.rowcount > 0:
+                    return
+            await asyncio.sleep(0.1)
+
+    @staticmethod
+    async def reclaim(session: AsyncSession, s3_key: str) -> bool:
+        """Retira la lápida de una clave en la transacción de la sesión, sin confirmarla.
+
+        A diferencia de revive no espera al worker: devuelve False si la lápida
+        está reclamada y el objeto puede estar borrándose.
+        """
+        stale = datetime.utcnow() - timedelta(seconds=GC_CLAIM_TIMEOUT)
+        await session.execute(
+            delete(Tombstone).where(
+                Tombstone.s3_key == s3_key,
+                or_(Tombstone.claim.is_(None), Tombstone.claimed_at < stale)
+            )
+        )
+        return (await session.exec(select(Tombstone.id).where(Tombstone.s3_key == s3_key))).first() is None
+
+    @classmethod
+    def notify(cls):
+        """Despierta al worker para que procese las lápidas nuevas sin esperar al intervalo."""
+        if cls._wakeup is not None:
+            cls._wakeup.set()
+
+    @classmethod
+    async def collect(cls) -> int:
+        """Procesa un lote de lápidas pendientes; devuelve cuántas reclamó."""
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        async with async_session() as session:
+            # Liberar las reclamaciones de workers que se detuvieron a mitad
+            await session.execute(
+                update(Tombstone)
+                .where(Tombstone.claim.isnot(None), Tombstone.claimed_at < now - timedelta(seconds=GC_CLAIM_TIMEOUT))
+                .values(claim=None, claimed_at=None)
+            )
+            ids = (await session.exec(
+                select(Tombstone.id)
+                .where(Tombstone.claim.is_(None), Tombstone.next_attempt_at <= now)
+                .order_by(Tombstone.next_attempt_at)
+                .limit(GC_BATCH_SIZE)
+            )).all()
+            if ids:
+                # Otro worker puede reclamar las mismas: solo cuentan las que se quedan con este token
+                await session.execute(
+                    update(Tombstone)
+                    .where(Tombstone.id.in_(ids), Tombstone.claim.is_(None))
+                    .values(claim=token, claimed_at=now)
+                )
+            await session.commit()
+            if not ids:
+                return 0
+
+            tombstones = (await session.exec(select(Tombstone).where(Tombstone.claim == token))).all()
+            keys = [tombstone.s3_key for tombstone in tombstones]
+            # Un objeto que vuelve a tener referencias no se borra
+            referenced = set((await session.exec(select(Blob.s3_key).where(Blob.s3_key.in_(keys)))).all())
+            referenced.update((await session.exec(select(File.s3_key).where(File.s3_key.in_(keys)))).all())
+            to_delete = [key for key in keys if key not in referenced]
+            failed = set(await storage.delete_many(to_delete)) if to_delete else set()
+
+            done = [tombstone.id for tombstone in tombstones if tombstone.s3_key not in failed]
+            if done:
+                await session.execute(delete(Tombstone).where(Tombstone.id.in_(done)))
+            for tombstone in tombstones:
+                if tombstone.s3_key in failed:
+                    delay = min(2 ** tombstone.attempts, GC_MAX_BACKOFF)
+                    tombstone.attempts += 1
+                    tombstone.next_attempt_at = now + timedelta(seconds=delay)
+                    tombstone.claim = None
+                    tombstone.claimed_at = None
+                    tombstone.error = "No se pudo eliminar del almacenamiento"
+                    session.add(tombstone)
+            await session.commit()
+
+        deleted = len(to_delete) - len(failed)
+        cls.deleted += deleted
+        cls.skipped += len(referenced)
+        cls.failures += len(failed)
+        metrics.STORAGE_EVENTS.inc(deleted, event="gc_deleted")
+        metrics.STORAGE_EVENTS.inc(len(failed), event="gc_retry")
+        if failed:
+            logger.warning("No se pudieron eliminar %s objetos; se reintentará", len(failed))
+        return len(tombstones)
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            try:
+                # Vaciar la cola mientras haya lotes completos
+                while await cls.collect() >= GC_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                logger.error("Error en la recolección de objetos sin referencias: %s", e)
+            try:
+                await asyncio.wait_for(cls._wakeup.wait(), GC_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            cls._wakeup.clear()
+
+    @classmethod
+    def start(cls):
+        if cls._task is not None:
+            return
+        cls._wakeup = asyncio.Event()
+        cls._task = asyncio.ensure_future(cls._run())
+
+    @classmethod
+    async def stop(cls):
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        await asyncio.gather(cls._task, return_exceptions=True)
+        cls._task = None
+        cls._wakeup = None
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        return {"deleted": cls.deleted, "skipped": cls.skipped, "failures": cls.failures}
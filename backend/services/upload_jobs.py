@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+from fastapi import HTTPException, UploadFile, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.datastructures import Headers
+import metrics
+from database import async_session
+from models import UploadJob
+from services.ingest_service import IngestProgress, IngestService
+from config.settings import (
+    UPLOAD_JOBS_DIR,
+    UPLOAD_JOB_WORKERS,
+    UPLOAD_JOBS_MAX_PENDING,
+    UPLOAD_JOB_MAX_ATTEMPTS,
+)
+
+logger = logging.getLogger(__name__)
+
+class UploadJobService:
+    """Cola acotada de subidas asíncronas, persistida en la base de datos.
+
+    La petición solo guarda los bytes en disco y crea el UploadJob; los
+    workers del proceso cifran, suben y registran el archivo. Al arrancar se
+    reanudan los trabajos que quedaron pendientes.
+    """
+
+    _queue: Optional[asyncio.Queue] = None
+    _workers: List[asyncio.Task] = []
+    _progress: Dict[int, IngestProgress] = {}
+
+    @classmethod
+    def pending(cls) -> int:
+        return len(cls._progress)
+
+    @classmethod
+    async def _stage(cls, file: UploadFile, chunk_size: int = 1024 * 1024) -> str:
+        os.makedirs(UPLOAD_JOBS_DIR, exist_ok=True)
+        path = os.path.join(UPLOAD_JOBS_DIR, uuid.uuid4().hex)
+        loop = asyncio.get_running_loop()
+        try:
+            with open(path, "wb") as f:
+                while True:
+                    chunk = await file.read(chunk_size)
+                    if not chunk:
+                        break
+                    await loop.run_in_executor(None, f.write, chunk)
+                await loop.run_in_executor(None, f.flush)
+                await loop.run_in_executor(None, os.fsync, f.fileno())
+        except Exception:
+            os.remove(path)
+            raise
+        return path
+
+    @classmethod
+    async def submit(
+        cls,
+        session: AsyncSession,
+        file: UploadFile,
+        latitude: float,
+        longitude: float,
+        user_id: int
+    ) -> UploadJob:
+        """Guarda los bytes en disco y encola el trabajo; 503 si la cola está llena."""
+        if cls._queue is None:
+            raise RuntimeError("El servicio de subidas asíncronas no está iniciado")
+        if cls.pending() >= UPLOAD_JOBS_MAX_PENDING:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Demasiadas subidas en cola, inténtalo de nuevo",
+                headers={"Retry-After": "5"},
+            )
+        path = await cls._stage(file)
+        job = UploadJob(
+            user_id=user_id,
+            filename=file.filename,
+            content_type=file.content_type or "application/octet-stream",
+            latitude=latitude,
+            longitude=longitude,
+            staged_path=path,
+            size=os.path.getsize(path)
+        )
+        try:
+            session.add(job)
+            await session.commit()
+            await session.refresh(job)
+        except Exception:
+            os.remove(path)
+            raise
+        cls._enqueue(job.id)
+        return job
+
+    @classmethod
+    def progress(cls, job_id: int) -> Optional[IngestProgress]:
+        return cls._progress.get(job_id)
+
+    @classmethod
+    def _enqueue(cls, job_id: int):
+        cls._progress[job_id] = IngestProgress()
+        cls._queue.put_nowait(job_id)
+
+    @classmethod
+    async def start(cls):
+        if cls._queue is not None:
+            return
+        # Los trabajos interrumpidos por una parada vuelven a la cola
+        async with async_session() as session:
+            jobs = (await session.exec(
+                select(UploadJob)
+                .where(UploadJob.status.in_(("pending", "processing")))
+                .order_by(UploadJob.id)
+            )).all()
+            for job in jobs:
+                if job.status == "processing":
+                    job.status = "pending"
+                    job.updated_at = datetime.utcnow()
+                    session.add(job)
+            await session.commit()
+        cls._queue = asyncio.Queue()
+        for job in jobs:
+            cls._enqueue(job.id)
+        if jobs:
+            logger.info("Reanudando %s subidas asíncronas pendientes", len(jobs))
+        cls._workers = [asyncio.ensure_future(cls._worker()) for _ in range(UPLOAD_JOB_WORKERS)]
+
+    @classmethod
+    async def stop(cls):
+        for worker in cls._workers:
+            worker.cancel()
+        await asyncio.gather(*cls._workers, return_exceptions=True)
+        cls._workers = []
+        cls._queue = None
+        cls._progress.clear()
+
+    @classmethod
+    async def _worker(cls):
+        while True:
+            job_id = await cls._queue.get()
+            try:
+                await cls._process(job_id)
+            except Exception as e:
+                logger.error("Error inesperado en la subida asíncrona %s: %s", job_id, e)
+            finally:
+                cls._progress.pop(job_id, None)
+
+    @classmethod
+    async def _process(cls, job_id: int):
+        progress = cls._progress.setdefault(job_id, IngestProgress())
+        async with async_session() as session:
+            job = await session.get(UploadJob, job_id)
+            if job is None or job.status not in ("pending", "processing"):
+                return
+            job.status = "processing"
+            job.attempts += 1
+            job.updated_at = datetime.utcnow()
+            session.add(job)
+            await session.commit()
+
+            try:
+                if job.attempts > UPLOAD_JOB_MAX_ATTEMPTS:
+                    raise RuntimeError(f"Se superaron los {UPLOAD_JOB_MAX_ATTEMPTS} intentos")
+                with open(job.staged_path, "rb") as f:
+                    upload = UploadFile(
+                        file=f,
+                        filename=job.filename,
+                        size=job.size,
+                        headers=Headers({"content-type": job.content_type})
+                    )
+                    db_file = await IngestService.ingest(
+                        session, upload, job.latitude, job.longitude, job.user_id, progress
+                    )
+                    await session.flush()
+                # El File y el estado del trabajo se confirman juntos
+                job.status = "done"
+                job.file_id = db_file.id
+                job.updated_at = datetime.utcnow()
+                session.add(job)
+                with metrics.span("db_commit"):
+                    await session.commit()
+                logger.info("Subida asíncrona %s completada: archivo %s", job_id, db_file.id)
+            except Exception as e:
+                logger.error("Error en la subida asíncrona %s: %s", job_id, e)
+                await session.rollback()
+                job = await session.get(UploadJob, job_id)
+                job.status = "failed"
+                job.error = str(e)
+                job.updated_at = datetime.utcnow()
+                session.add(job)
+                await session.commit()
+
+        # Solo se borra el archivo recibido cuando el trabajo ha terminado
+        try:
+            os.remove(job.staged_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def describe(job: UploadJob, progress: Optional[IngestProgress]) -> dict:
+        if job.status == "done":
+            stage, processed = "done", job.size
+        elif job.status == "failed":
+            stage, processed = "failed", 0
+        elif progress is not None:
+            stage, processed = progress.stage, progress.bytes_processed
+        else:
+            stage, processed = job.status, 0
+        return {
+            "id": job.id,
+            "status": job.status,
+            "stage": stage,
+            "filename": job.filename,
+            "size": job.size,
+            "bytes_processed": processed,
+            "progress": processed / job.size if job.size else float(job.status == "done"),
+            "file_id": job.file_id,
+            "error": job.error,
+            "created_at": job.created_at,
+            "updated_at": job.updated_at,
+        }
@@ -0,0 +1,384 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterable, List, Optional
+from fastapi import HTTPException, status
+from sqlalchemy import and_, delete, or_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+import geohash2
+import crypto
+import metrics
+from database import async_session
+from models import File, UploadSession, UploadSessionPart, User
+from services.storage import storage
+from services.tile_service import TileService
+from services.tombstone_service import TombstoneService
+from config.settings import (
+    UPLOAD_SESSION_CHUNK_SIZE,
+    UPLOAD_SESSION_MAX_BYTES,
+    UPLOAD_SESSION_TTL,
+    UPLOAD_SESSION_CLEANUP_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Los tramos ocupan segmentos completos: cada uno se cifra sin depender de los demás
+CHUNK_SIZE = -(-UPLOAD_SESSION_CHUNK_SIZE // crypto.DEFAULT_SEGMENT_SIZE) * crypto.DEFAULT_SEGMENT_SIZE
+# Partes como máximo de una subida multiparte de S3
+MAX_CHUNKS = 10000
+# Segundos tras los que una finalización interrumpida se puede reintentar
+COMPLETE_TIMEOUT = 300
+
+class UploadSessionService:
+    """Subidas reanudables en tramos numerados.
+
+    Cada tramo se cifra con los índices de segmento que le corresponden y se
+    guarda como una parte de una escritura por partes, así que un tramo que
+    falla se reenvía solo. Al finalizar se unen las partes y se registra el
+    File; las sesiones sin actividad caducan y se descartan.
+    """
+
+    _task: Optional[asyncio.Task] = None
+    expired = 0
+
+    @staticmethod
+    def chunk_count(upload: UploadSession) -> int:
+        return max(1, -(-upload.size // upload.chunk_size))
+
+    @staticmethod
+    def chunk_length(upload: UploadSession, number: int) -> int:
+        return min(upload.chunk_size, upload.size - number * upload.chunk_size)
+
+    @staticmethod
+    async def create(
+        session: AsyncSession,
+        user: User,
+        filename: str,
+        content_type: str,
+        size: int,
+        latitude: float,
+        longitude: float
+    ) -> UploadSession:
+        """Reserva la clave e inicia la escritura por partes."""
+        if size > UPLOAD_SESSION_MAX_BYTES or -(-size // CHUNK_SIZE) > MAX_CHUNKS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Las subidas reanudables admiten como máximo {min(UPLOAD_SESSION_MAX_BYTES, CHUNK_SIZE * MAX_CHUNKS)} bytes"
+            )
+        gh = geohash2.encode(latitude, longitude, precision=7)
+        session_id = uuid.uuid4().hex
+        s3_key = f"{user.username}/{gh}/{session_id}"
+        try:
+            upload_id = await storage.create_multipart(s3_key)
+        except NotImplementedError as e:
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+
+        now = datetime.utcnow()
+        upload = UploadSession(
+            id=session_id,
+            user_id=user.id,
+            filename=filename,
+            content_type=content_type,
+            geohash=gh,
+            size=size,
+            chunk_size=CHUNK_SIZE,
+            s3_key=s3_key,
+            upload_id=upload_id,
+            created_at=now,
+            updated_at=now,
+            expires_at=now + timedelta(seconds=UPLOAD_SESSION_TTL)
+        )
+        try:
+            session.add(upload)
+            await session.commit()
+        except Exception:
+            await storage.abort_multipart(s3_key, upload_id)
+            raise
+        return upload
+
+    @staticmethod
+    async def get(session: AsyncSession, user: User, session_id: str) -> UploadSession:
+        upload = await session.get(UploadSession, session_id)
+        if upload is None or upload.user_id != user.id:
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        return upload
+
+    @staticmethod
+    async def received(session: AsyncSession, session_id: str) -> List[int]:
+        return (await session.exec(
+            select(UploadSessionPart.number)
+            .where(UploadSessionPart.session_id == session_id)
+            .order_by(UploadSessionPart.number)
+        )).all()
+
+    @staticmethod
+    def describe(upload: UploadSession, received: List[int]) -> dict:
+        count = UploadSessionService.chunk_count(upload)
+        if upload.status == "completed":
+            # Las partes se olvidan al finalizar
+            received = list(range(count))
+        present = set(received)
+        next_chunk = next((number for number in range(count) if number not in present), None)
+        # Offset: bytes recibidos sin huecos desde el principio
+        contiguous = count if next_chunk is None else next_chunk
+        return {
+            "id": upload.id,
+            "status": upload.status,
+            "filename": upload.filename,
+            "size": upload.size,
+            "chunk_size": upload.chunk_size,
+            "chunk_count": count,
+            "received_chunks": len(present),
+            "offset": min(contiguous * upload.chunk_size, upload.size),
+            "next_chunk": next_chunk,
+            "file_id": upload.file_id,
+            "created_at": upload.created_at,
+            "updated_at": upload.updated_at,
+            "expires_at": upload.expires_at,
+        }
+
+    @staticmethod
+    def _check_active(upload: UploadSession):
+        if upload.status != "active":
+            raise HTTPException(status_code=409, detail="La subida ya se ha finalizado")
+        if upload.expires_at < datetime.utcnow():
+            raise HTTPException(status_code=410, detail="La sesión de subida ha caducado")
+
+    @staticmethod
+    async def _read_chunk(chunks: AsyncIterable[bytes], expected: int) -> bytes:
+        body = bytearray()
+        async for chunk in chunks:
+            body += chunk
+            if len(body) > expected:
+                raise HTTPException(status_code=413, detail=f"El tramo debe tener {expected} bytes")
+        if len(body) != expected:
+            raise HTTPException(status_code=400, detail=f"El tramo debe tener {expected} bytes, llegaron {len(body)}")
+        return bytes(body)
+
+    @staticmethod
+    async def put_chunk(
+        session: AsyncSession,
+        user: User,
+        session_id: str,
+        number: int,
+        chunks: AsyncIterable[bytes]
+    ) -> dict:
+        """Cifra el tramo y lo guarda como la parte number + 1; repetirlo sustituye la anterior."""
+        upload = await UploadSessionService.get(session, user, session_id)
+        UploadSessionService._check_active(upload)
+        count = UploadSessionService.chunk_count(upload)
+        if not 0 <= number < count:
+            raise HTTPException(status_code=400, detail=f"El número de tramo debe estar entre 0 y {count - 1}")
+        # No mantener la transacción abierta mientras llega el tramo por una red lenta
+        await session.commit()
+        data = await UploadSessionService._read_chunk(chunks, UploadSessionService.chunk_length(upload, number))
+        metrics.BYTES_IN.inc(len(data))
+
+        loop = asyncio.get_running_loop()
+        with metrics.span("encrypt"):
+            body = await loop.run_in_executor(
+                None,
+                crypto.encrypt_segments,
+                crypto.derive_key_from_geohash(upload.geohash),
+                data,
+                number * upload.chunk_size // crypto.DEFAULT_SEGMENT_SIZE,
+                number == count - 1
+            )
+        try:
+            etag = await storage.put_part(upload.s3_key, upload.upload_id, number + 1, body)
+        except Exception as e:
+            logger.error("Error al guardar el tramo %s de la subida %s: %s", number, session_id, e)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="No se pudo guardar el tramo, inténtalo de nuevo",
+                headers={"Retry-After": "5"},
+            )
+
+        dialect = session.sync_session.get_bind().dialect.name
+        insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+        statement = insert(UploadSessionPart.__table__).values(
+            session_id=session_id, number=number, etag=etag, size=len(data)
+        )
+        await session.execute(statement.on_conflict_do_update(
+            index_elements=["session_id", "number"],
+            set_={"etag": statement.excluded.etag, "size": statement.excluded.size}
+        ))
+        # La actividad aplaza la caducidad; una finalización en curso gana
+        now = datetime.utcnow()
+        result = await session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == session_id, UploadSession.status == "active")
+            .values(updated_at=now, expires_at=now + timedelta(seconds=UPLOAD_SESSION_TTL))
+        )
+        if result.rowcount == 0:
+            await session.rollback()
+            raise HTTPException(status_code=409, detail="La subida ya se ha finalizado")
+        with metrics.span("db_commit"):
+            await session.commit()
+        await session.refresh(upload)
+        return UploadSessionService.describe(upload, await UploadSessionService.received(session, session_id))
+
+    @staticmethod
+    async def complete(session: AsyncSession, user: User, session_id: str) -> File:
+        """Une las partes y registra el File; repetir la llamada es inocuo."""
+        upload = await UploadSessionService.get(session, user, session_id)
+        if upload.status == "completed":
+            db_file = await session.get(File, upload.file_id)
+            if db_file is None:
+                raise HTTPException(status_code=410, detail="El archivo de esta subida ya se eliminó")
+            return db_file
+        if upload.expires_at < datetime.utcnow():
+            raise HTTPException(status_code=410, detail="La sesión de subida ha caducado")
+
+        parts = (await session.exec(
+            select(UploadSessionPart.number, UploadSessionPart.etag)
+            .where(UploadSessionPart.session_id == session_id)
+            .order_by(UploadSessionPart.number)
+        )).all()
+        received = {number for number, _ in parts}
+        missing = [number for number in range(UploadSessionService.chunk_count(upload)) if number not in received]
+        if missing:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Faltan {len(missing)} tramos; el primero es el {missing[0]}"
+            )
+
+        # Solo una petición une las partes; una finalización interrumpida se puede retomar
+        now = datetime.utcnow()
+        claim = await session.execute(
+            update(UploadSession)
+            .where(
+                UploadSession.id == session_id,
+                or_(
+                    UploadSession.status == "active",
+                    and_(
+                        UploadSession.status == "completing",
+                        UploadSession.updated_at < now - timedelta(seconds=COMPLETE_TIMEOUT)
+                    )
+                )
+            )
+            .values(status="completing", updated_at=now)
+        )
+        await session.commit()
+        if claim.rowcount == 0:
+            raise HTTPException(status_code=409, detail="La subida ya se está finalizando")
+
+        try:
+            await storage.complete_multipart(
+                upload.s3_key, upload.upload_id, [(number + 1, etag) for number, etag in parts]
+            )
+        except Exception as e:
+            # Un reintento tras una finalización interrumpida encuentra el objeto ya unido
+            head = await storage.head(upload.s3_key)
+            if head is None or head["size"] != crypto.encrypted_size(upload.size):
+                logger.error("Error al finalizar la subida %s: %s", session_id, e)
+                await session.execute(
+                    update(UploadSession).where(UploadSession.id == session_id).values(status="active")
+                )
+                await session.commit()
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="No se pudo finalizar la subida, inténtalo de nuevo",
+                    headers={"Retry-After": "5"},
+                )
+
+        db_file = File(
+            filename=upload.filename,
+            s3_key=upload.s3_key,
+            geohash=upload.geohash,
+            user_id=user.id,
+            size=upload.size,
+            content_type=upload.content_type
+        )
+        session.add(db_file)
+        await TileService.add(session, user.id, [(db_file.geohash, db_file.size)])
+        await session.flush()
+        # La sesión se conserva hasta que caduque para responder a los reintentos
+        now = datetime.utcnow()
+        await session.execute(
+            update(UploadSession).where(UploadSession.id == session_id).values(
+                status="completed",
+                file_id=db_file.id,
+                updated_at=now,
+                expires_at=now + timedelta(seconds=UPLOAD_SESSION_TTL)
+            )
+        )
+        await session.execute(delete(UploadSessionPart).where(UploadSessionPart.session_id == session_id))
+        with metrics.span("db_commit"):
+            await session.commit()
+        await session.refresh(db_file)
+        return db_file
+
+    @staticmethod
+    async def _discard(session: AsyncSession, upload: UploadSession):
+        """Descarta las partes y borra la sesión de la transacción, sin confirmarla."""
+        if upload.status != "completed":
+            await storage.abort_multipart(upload.s3_key, upload.upload_id)
+        if upload.status == "completing":
+            # Las partes pueden estar ya unidas: el recolector borra el objeto si ningún File lo usa
+            await TombstoneService.bury(session, [upload.s3_key])
+        await session.execute(delete(UploadSessionPart).where(UploadSessionPart.session_id == upload.id))
+        await session.execute(delete(UploadSession).where(UploadSession.id == upload.id))
+
+    @staticmethod
+    async def abort(session: AsyncSession, user: User, session_id: str):
+        """Cancela la subida; una ya finalizada conserva su archivo."""
+        upload = await UploadSessionService.get(session, user, session_id)
+        if upload.status == "completing":
+            raise HTTPException(status_code=409, detail="La subida se está finalizando")
+        await UploadSessionService._discard(session, upload)
+        await session.commit()
+
+    @classmethod
+    async def expire(cls) -> int:
+        """Descarta un lote de sesiones caducadas; devuelve cuántas descartó."""
+        async with async_session() as session:
+            uploads = (await session.exec(
+                select(UploadSession)
+                .where(UploadSession.expires_at < datetime.utcnow())
+                .order_by(UploadSession.expires_at)
+                .limit(100)
+            )).all()
+            discarded = 0
+            for upload in uploads:
+                try:
+                    await cls._discard(session, upload)
+                    await session.commit()
+                    discarded += 1
+                except Exception as e:
+                    # La sesión se queda para el siguiente intento
+                    await session.rollback()
+                    logger.warning("No se pudo descartar la subida caducada %s: %s", upload.id, e)
+        if discarded:
+            cls.expired += discarded
+            TombstoneService.notify()
+            logger.info("Descartadas %s subidas reanudables caducadas", discarded)
+        return len(uploads)
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            try:
+                while await cls.expire() >= 100:
+                    pass
+            except Exception as e:
+                logger.error("Error en la limpieza de subidas reanudables: %s", e)
+            await asyncio.sleep(UPLOAD_SESSION_CLEANUP_INTERVAL)
+
+    @classmethod
+    def start(cls):
+        if cls._task is not None:
+            return
+        cls._task = asyncio.ensure_future(cls._run())
+
+    @classmethod
+    async def stop(cls):
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        await asyncio.gather(cls._task, return_exceptions=True)
+        cls._task = None
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+from database import async_session, init_db
+from services.storage import storage
+from services.tile_service import TileService
+from services.tombstone_service import TombstoneService
+from services.upload_jobs import UploadJobService
+from services.upload_session_service import UploadSessionService
+from config.settings import WARMUP_MAX_BACKOFF
+
+logger = logging.getLogger(__name__)
+
+class WarmupService:
+    """Prepara las dependencias en segundo plano tras arrancar el worker.
+
+    El arranque no espera a la base de datos ni a S3: el worker responde a
+    /healthz de inmediato y /readyz indica cuándo cada dependencia está lista.
+    Los pasos que fallan se reintentan con espera exponencial.
+    """
+
+    _task: Optional[asyncio.Task] = None
+    _started_at: Optional[float] = None
+    _ready_at: Optional[float] = None
+    _checks: Dict[str, bool] = {}
+    _errors: Dict[str, str] = {}
+
+    @classmethod
+    def start(cls):
+        if cls._task is not None:
+            return
+        cls._started_at = time.monotonic()
+        cls._ready_at = None
+        cls._checks = {"database": False, "storage": False}
+        cls._errors = {}
+        cls._task = asyncio.ensure_future(cls._run())
+
+    @classmethod
+    async def stop(cls):
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        await asyncio.gather(cls._task, return_exceptions=True)
+        cls._task = None
+
+    @classmethod
+    async def _database(cls):
+        await init_db()
+        async with async_session() as session:
+            # Bases de datos anteriores a los agregados por celda
+            if await TileService.backfill(session):
+                logger.info("Agregados por celda de geohash calculados a partir de los archivos")
+        # Los trabajos pendientes necesitan sus tablas
+        await UploadJobService.start()
+
+    @classmethod
+    async def _storage(cls):
+        await storage.start()
+        await storage.check()
+
+    @classmethod
+    async def _step(cls, name: str, step):
+        attempt = 0
+        while True:
+            try:
+                await step()
+                cls._checks[name] = True
+                cls._errors.pop(name, None)
+                return
+            except Exception as e:
+                cls._errors[name] = str(e)
+                delay = min(0.5 * 2 ** attempt, WARMUP_MAX_BACKOFF)
+                logger.warning("%s no disponible (intento %s), reintento en %.1fs: %s", name, attempt + 1, delay, e)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    @classmethod
+    async def _run(cls):
+        await asyncio.gather(
+            cls._step("database", cls._database),
+            cls._step("storage", cls._storage),
+        )
+        cls._ready_at = time.monotonic()
+        # El recolector y la limpieza de subidas necesitan la base de datos y el almacenamiento
+        TombstoneService.start()
+        UploadSessionService.start()
+        logger.info("Dependencias listas en %.3fs", cls._ready_at - cls._started_at)
+
+    @classmethod
+    def ready(cls) -> bool:
+        return cls._ready_at is not None
+
+    @classmethod
+    def status(cls) -> dict:
+        return {
+            "ready": cls.ready(),
+            "checks": dict(cls._checks),
+            "errors": dict(cls._errors),
+            "warmup_seconds": (cls._ready_at - cls._started_at) if cls.ready() else None,
+        }
@@ -1,9 +1,11 @@
 import requests
 import os
+import geohash2
+from urllib.parse import unquote
 from datetime import datetime
 
 # Configuración
-BASE_URL = "http://localhost:8000"
+BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 TEST_USER = {
     "username": f"testuser_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
     "email": "test@example.com",
@@ -13,7 +15,7 @@ TEST_USER = {
 def test_registration():
     print("\n=== Probando registro de usuario ===")
     try:
-        response = requests.post(f"{BASE_URL}/register", json=TEST_USER)
+        response = requests.post(f"{BASE_URL}/auth/register", json=TEST_USER)
         print(f"Status code: {response.status_code}")
         print(f"Response text: {response.text}")
         if response.status_code == 200:
@@ -27,7 +29,7 @@ def test_login():
     print("\n=== Probando login ===")
     try:
         response = requests.post(
-            f"{BASE_URL}/token",
+            f"{BASE_URL}/auth/token",
             data={
                 "username": TEST_USER["username"],
                 "password": TEST_USER["password"]
@@ -55,7 +57,7 @@ def test_upload_file(token, file_path, latitude, longitude):
                 "longitude": longitude
             }
             response = requests.post(
-                f"{BASE_URL}/upload",
+                f"{BASE_URL}/files/upload",
                 headers=headers,
                 files=files,
                 data=data
@@ -75,12 +77,12 @@ def test_list_files(token):
     print("\n=== Probando listado de archivos ===")
     headers = {"Authorization": f"Bearer {token}"}
     try:
-        response = requests.get(f"{BASE_URL}/files", headers=headers)
+        response = requests.get(f"{BASE_URL}/files/", headers=headers)
         print(f"Status code: {response.status_code}")
         print(f"Response text: {response.text}")
         if response.status_code == 200:
             print(f"Response JSON: {response.json()}")
-            return response.json()
+            return response.json()["items"]
         return None
     except Exception as e:
         print(f"Error durante el listado: {str(e)}")
@@ -90,21 +92,19 @@ def test_download_file(token, file_id, latitude, longitude):
     print("\n=== Probando descarga de archivo ===")
     headers = {"Authorization": f"Bearer {token}"}
     params = {
-        "latitude": latitude,
-        "longitude": longitude
+        "geohash": geohash2.encode(latitude, longitude, precision=7)
     }
     try:
         response = requests.get(
-            f"{BASE_URL}/download/{file_id}",
+            f"{BASE_URL}/files/download/{file_id}",
             headers=headers,
             params=params
         )
         print(f"Status code: {response.status_code}")
-        print(f"Response text: {response.text}")
         
         if response.status_code == 200:
             # Guardar el archivo descargado
-            filename = response.headers.get("content-disposition", "").split("filename=")[-1]
+            filename = unquote(response.headers.get("content-disposition", "").split("''")[-1])
             with open(f"downloaded_{filename}", "wb") as f:
                 f.write(response.content)
             print(f"Archivo guardado como: downloaded_{filename}")
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import time
+import uuid
+import pytest
+from moto import mock_aws
+
+# La configuración se lee al importar los módulos: el entorno de las pruebas va antes
+_workdir = tempfile.mkdtemp(prefix="geocrypt-tests-")
+os.environ.update(
+    AWS_ACCESS_KEY_ID="testing",
+    AWS_SECRET_ACCESS_KEY="testing",
+    AWS_DEFAULT_REGION="us-east-1",
+    AWS_BUCKET_NAME="geocrypt-tests",
+    DATABASE_URL=f"sqlite:///{os.path.join(_workdir, 'tests.db')}",
+    STORAGE_BACKEND="s3",
+    STORAGE_WRITE_BEHIND="false",
+    WRITE_BEHIND_DIR=os.path.join(_workdir, "uploads"),
+)
+os.environ.pop("S3_ENDPOINT_URL", None)
+
+@pytest.fixture
+def s3():
+    """Bucket vacío en un S3 simulado; devuelve el cliente de boto3."""
+    from config import settings
+    with mock_aws():
+        # El cliente en caché podría ser de otra prueba (u otro endpoint)
+        settings._s3_client = None
+        client = settings.get_s3_client()
+        client.create_bucket(Bucket=settings.BUCKET_NAME)
+        yield client
+        settings._s3_client = None
+
+@pytest.fixture
+def client(s3):
+    """Aplicación completa sobre el S3 simulado, ya preparada (/readyz en 200)."""
+    from concurrent.futures import ThreadPoolExecutor
+    from fastapi.testclient import TestClient
+    import main
+    from services.password_service import PasswordService
+    # Sin procesos hijo: el hash de contraseñas se hace en hilos
+    PasswordService._executor = ThreadPoolExecutor(2)
+    with TestClient(main.app) as test_client:
+        for _ in range(500):
+            if test_client.get("/readyz").status_code == 200:
+                break
+            time.sleep(0.01)
+        yield test_client
+
+@pytest.fixture
+def auth_headers(client):
+    """Registra un usuario nuevo y devuelve la cabecera Authorization."""
+    username = f"user-{uuid.uuid4().hex[:12]}"
+    client.post("/auth/register", json={"username": username, "email": f"{username}@example.com", "password": "secret"})
+    response = client.post("/auth/token", data={"username": username, "password": "secret"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
@@ -0,0 +1,19 @@
+import auth
+
+def test_user_cache_stats_are_exported(client, auth_headers):
+    auth.user_cache.clear()
+    for _ in range(3):
+        assert client.get("/files/", headers=auth_headers).status_code == 200
+    stats = auth.user_cache.stats()
+    assert stats["misses"] >= 1 and stats["hits"] >= 2
+
+    body = client.get("/metrics").text
+    assert f'geocrypt_auth_cache_events{{event="hits"}} {stats["hits"]}' in body
+    assert "geocrypt_auth_cache_entries " in body
+
+def test_invalidate_user_drops_cached_tokens(client, auth_headers):
+    assert client.get("/files/", headers=auth_headers).status_code == 200
+    assert auth.user_cache.stats()["entries"] >= 1
+    username = next(user.username for user, _ in auth.user_cache._entries.values())
+    auth.invalidate_user(username)
+    assert all(user.username != username for user, _ in auth.user_cache._entries.values())
@@ -0,0 +1,125 @@
+import os
+import pytest
+from Crypto.Cipher import AES
+import crypto
+from routes.files import _parse_range
+
+KEY = crypto.derive_key_from_geohash("ezjmgtw")
+SEGMENT = 64
+
+def encrypt(data: bytes, segment_size: int = SEGMENT, chunk: int = 1000) -> bytes:
+    chunks = [data[i:i + chunk] for i in range(0, len(data), chunk)]
+    return b"".join(crypto.encrypt_chunks(chunks, KEY, segment_size))
+
+def decrypt(blob: bytes, chunk: int = 37) -> bytes:
+    return b"".join(crypto.decrypt_chunks([blob[i:i + chunk] for i in range(0, len(blob), chunk)], KEY))
+
+def segments(blob: bytes, segment_size: int = SEGMENT):
+    body = blob[crypto.HEADER_SIZE:]
+    size = segment_size + crypto.SEGMENT_OVERHEAD
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+@pytest.mark.parametrize("size", [0, 1, SEGMENT - 1, SEGMENT, SEGMENT + 1, 5 * SEGMENT, 5 * SEGMENT + 1])
+def test_round_trip_at_segment_boundaries(size):
+    data = os.urandom(size)
+    blob = encrypt(data)
+    assert len(blob) == crypto.encrypted_size(size, SEGMENT)
+    assert crypto.plaintext_size(len(blob), SEGMENT) == size
+    assert len(segments(blob)) == crypto.segment_count(size, SEGMENT)
+    assert decrypt(blob) == data
+
+def test_round_trip_default_segment_size():
+    data = os.urandom(3 * crypto.DEFAULT_SEGMENT_SIZE + 1)
+    blob = b"".join(crypto.encrypt_chunks([data], KEY))
+    assert crypto.parse_header(blob) == (crypto.FORMAT_VERSION, 0, crypto.DEFAULT_SEGMENT_SIZE)
+    assert crypto.decrypt_bytes(blob, KEY) == data
+
+def test_segment_aligned_chunks_match_stream_format():
+    # Tramos cifrados por separado (subidas reanudables) forman un blob normal
+    data = os.urandom(4 * SEGMENT + 5)
+    blob = crypto.encrypt_segments(KEY, data[:2 * SEGMENT], 0, False, SEGMENT) \
+        + crypto.encrypt_segments(KEY, data[2 * SEGMENT:], 2, True, SEGMENT)
+    assert decrypt(blob) == data
+
+def legacy_blob(data: bytes) -> bytes:
+    cipher = AES.new(KEY, AES.MODE_GCM, nonce=os.urandom(crypto.LEGACY_NONCE_SIZE))
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    return cipher.nonce + tag + ciphertext
+
+@pytest.mark.parametrize("size", [0, 5, 1000])
+def test_legacy_blobs_are_detected_and_decrypted(size):
+    data = os.urandom(size)
+    blob = legacy_blob(data)
+    assert crypto.parse_header(blob) is None
+    assert crypto.format_parameters(crypto.parse_header(blob))["format"] == "legacy"
+    assert decrypt(blob) == data
+
+def test_tampered_legacy_blob_is_rejected():
+    blob = bytearray(legacy_blob(b"contenido"))
+    blob[-1] ^= 1
+    with pytest.raises(ValueError):
+        decrypt(bytes(blob))
+
+@pytest.fixture
+def blob_and_data():
+    data = os.urandom(3 * SEGMENT + 10)
+    return encrypt(data), data
+
+def test_tampered_segment_is_rejected(blob_and_data):
+    blob = bytearray(blob_and_data[0])
+    blob[crypto.HEADER_SIZE + SEGMENT + crypto.SEGMENT_OVERHEAD + 20] ^= 1
+    with pytest.raises(ValueError):
+        decrypt(bytes(blob))
+
+def test_tampered_header_is_rejected(blob_and_data):
+    # La cabecera forma parte de los datos autenticados de cada segmento
+    blob = bytearray(blob_and_data[0])
+    blob[crypto.HEADER_SIZE - 1] ^= 1
+    with pytest.raises(ValueError):
+        decrypt(bytes(blob))
+
+def test_truncated_blob_is_rejected(blob_and_data):
+    blob = blob_and_data[0]
+    parts = segments(blob)
+    # Sin el último segmento, el anterior no está marcado como final
+    with pytest.raises(ValueError):
+        decrypt(blob[:crypto.HEADER_SIZE] + b"".join(parts[:-1]))
+    # Corte a mitad de un segmento
+    with pytest.raises(ValueError):
+        decrypt(blob[:-5])
+
+def test_reordered_segments_are_rejected(blob_and_data):
+    blob = blob_and_data[0]
+    parts = segments(blob)
+    parts[0], parts[1] = parts[1], parts[0]
+    with pytest.raises(ValueError):
+        decrypt(blob[:crypto.HEADER_SIZE] + b"".join(parts))
+
+def test_appended_segment_is_rejected(blob_and_data):
+    blob = blob_and_data[0]
+    with pytest.raises(ValueError):
+        decrypt(blob + segments(blob)[1])
+
+def test_encrypted_range_mapping():
+    size = SEGMENT + crypto.SEGMENT_OVERHEAD
+    assert crypto.encrypted_range(0, 0, SEGMENT) == (crypto.HEADER_SIZE, crypto.HEADER_SIZE + size - 1, 0, 0)
+    assert crypto.encrypted_range(SEGMENT + 4, 2 * SEGMENT, SEGMENT) == (
+        crypto.HEADER_SIZE + size, crypto.HEADER_SIZE + 3 * size - 1, 1, 4
+    )
+
+def read_range(blob: bytes, plaintext_size: int, start: int, end: int) -> bytes:
+    # Igual que la descarga por rangos: solo los segmentos que cubren el rango
+    enc_start, enc_end, first, skip = crypto.encrypted_range(start, end, SEGMENT)
+    decryptor = crypto.StreamDecryptor(
+        KEY, blob[:crypto.HEADER_SIZE], first, crypto.segment_count(plaintext_size, SEGMENT)
+    )
+    plain = decryptor.update(blob[enc_start:min(enc_end, len(blob) - 1) + 1]) + decryptor.finalize()
+    return plain[skip:skip + end - start + 1]
+
+@pytest.mark.parametrize("header", [
+    "bytes=0-0", "bytes=0-63", "bytes=63-64", "bytes=100-", "bytes=64-127", "bytes=-1", "bytes=-70", "bytes=-10000",
+])
+def test_range_and_suffix_requests(blob_and_data, header):
+    blob, data = blob_and_data
+    start, end = _parse_range(header, len(data))
+    assert read_range(blob, len(data), start, end) == data[start:end + 1]
@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+import database
+
+def test_create_all_adds_nullable_columns_and_rejects_required_ones(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        # Esquema antiguo: sin la columna opcional de Blob ni la obligatoria de File
+        connection.exec_driver_sql('CREATE TABLE blob (id INTEGER PRIMARY KEY, s3_key VARCHAR, geohash VARCHAR, '
+                                   'content_hash VARCHAR, size INTEGER, ref_count INTEGER, created_at DATETIME)')
+        connection.exec_driver_sql('CREATE TABLE file (id INTEGER PRIMARY KEY, filename VARCHAR)')
+        with pytest.raises(RuntimeError, match="file"):
+            database._create_all(connection)
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE file")
+        database._create_all(connection)
+        columns = {column["name"] for column in inspect(connection).get_columns("blob")}
+        assert {"stored_size", "compressed"} <= columns
@@ -0,0 +1,46 @@
+import geohash2
+
+def upload(client, headers, latitude: float, longitude: float, name: str = "a.txt", body: bytes = b"contenido"):
+    response = client.post(
+        "/files/upload",
+        data={"latitude": latitude, "longitude": longitude},
+        files={"file": (name, body, "text/plain")},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_near_returns_neighbouring_cells_up_to_limit(client, auth_headers):
+    for i in range(3):
+        upload(client, auth_headers, 40.4168, -3.7038, name=f"{i}.txt")
+    upload(client, auth_headers, -33.8688, 151.2093, name="lejos.txt")
+
+    response = client.get("/files/near", params={"latitude": 40.4168, "longitude": -3.7038}, headers=auth_headers)
+    assert response.status_code == 200
+    assert sorted(file["filename"] for file in response.json()) == ["0.txt", "1.txt", "2.txt"]
+
+    response = client.get("/files/near", params={"latitude": 40.4168, "longitude": -3.7038, "limit": 2},
+                          headers=auth_headers)
+    assert len(response.json()) == 2
+    assert all(file["geohash"].startswith(geohash2.encode(40.4168, -3.7038, precision=4)) for file in response.json())
+
+def test_list_is_paginated_with_typed_items(client, auth_headers):
+    for i in range(3):
+        upload(client, auth_headers, 40.4168, -3.7038, name=f"{i}.txt")
+
+    first = client.get("/files/", params={"limit": 2}, headers=auth_headers).json()
+    assert [item["filename"] for item in first["items"]] == ["2.txt", "1.txt"]
+    assert set(first["items"][0]) == {"id", "filename", "geohash", "size", "content_type", "created_at"}
+    assert first["items"][0]["size"] == len(b"contenido")
+
+    second = client.get("/files/", params={"limit": 2, "cursor": first["next_cursor"]}, headers=auth_headers).json()
+    assert [item["filename"] for item in second["items"]] == ["0.txt"]
+    assert second["next_cursor"] is None
+
+def test_list_returns_only_selected_fields(client, auth_headers):
+    upload(client, auth_headers, 40.4168, -3.7038)
+    page = client.get("/files/", params={"fields": "filename,size"}, headers=auth_headers).json()
+    assert page["items"] == [{"filename": "a.txt", "size": len(b"contenido")}]
+
+    response = client.get("/files/", params={"fields": "filename,s3_key"}, headers=auth_headers)
+    assert response.status_code == 400
@@ -0,0 +1,79 @@
+from sqlmodel import select
+from config.settings import BUCKET_NAME
+from database import async_session
+from models import Blob, File
+from routes.files import _delete_files
+from services.blob_service import BlobService
+from services.tombstone_service import TombstoneService
+from tests.test_files import upload
+
+LATITUDE, LONGITUDE = 40.4168, -3.7038
+
+def delete_during_dedup(monkeypatch, collect: bool):
+    """Borra el único archivo del blob (y opcionalmente recolecta el objeto) justo después de find."""
+    find = BlobService.find
+
+    async def racing_find(session, geohash, content_hash):
+        blob = await find(session, geohash, content_hash)
+        if blob is not None:
+            async with async_session() as other:
+                files = (await other.exec(select(File).where(File.s3_key == blob.s3_key))).all()
+                await _delete_files(other, files[0].user_id, files)
+            if collect:
+                await TombstoneService.collect()
+        return blob
+    monkeypatch.setattr(BlobService, "find", racing_find)
+
+def only_key(s3) -> str:
+    # Cada prueba empieza con el bucket vacío
+    (entry,) = s3.list_objects_v2(Bucket=BUCKET_NAME)["Contents"]
+    return entry["Key"]
+
+def test_dedup_reuploads_object_collected_during_race(client, auth_headers, s3, monkeypatch):
+    first = upload(client, auth_headers, LATITUDE, LONGITUDE, body=b"contenido compartido")
+    s3_key = only_key(s3)
+
+    delete_during_dedup(monkeypatch, collect=True)
+    second = upload(client, auth_headers, LATITUDE, LONGITUDE, body=b"contenido compartido")
+
+    assert s3.head_object(Bucket=BUCKET_NAME, Key=s3_key)
+    response = client.get(f"/files/download/{second['file_id']}", params={"geohash": s3_key.split("/")[1]},
+                          headers=auth_headers)
+    assert response.content == b"contenido compartido"
+
+def test_dedup_retires_tombstone_buried_during_race(client, auth_headers, s3, monkeypatch):
+    upload(client, auth_headers, LATITUDE, LONGITUDE, body=b"otro contenido")
+    s3_key = only_key(s3)
+
+    delete_during_dedup(monkeypatch, collect=False)
+    upload(client, auth_headers, LATITUDE, LONGITUDE, body=b"otro contenido")
+
+    # El recolector ya no tiene nada que borrar: la lápida se retiró con el nuevo registro
+    monkeypatch.undo()
+    client.portal.call(TombstoneService.collect)
+    assert s3.head_object(Bucket=BUCKET_NAME, Key=s3_key)
+
+    async def ref_count():
+        async with async_session() as session:
+            return (await session.exec(select(Blob.ref_count).where(Blob.s3_key == s3_key))).one()
+    assert client.portal.call(ref_count) == 1
+
+async def test_register_reports_existing_blob_and_keeps_latest_stats():
+    import uuid
+    from database import init_db
+    await init_db()
+    content_hash = uuid.uuid4().hex
+    async with async_session() as session:
+        s3_key, existed = await BlobService.register(
+            session, "ezjmgtw", content_hash, 100, {"compressed": True, "stored_size": 40}
+        )
+        assert not existed
+        # Otra subida simultánea del mismo contenido que no comprimió
+        assert await BlobService.register(
+            session, "ezjmgtw", content_hash, 100, {"compressed": False, "stored_size": 100}
+        ) == (s3_key, True)
+        # Una deduplicación no toca las estadísticas
+        assert await BlobService.register(session, "ezjmgtw", content_hash, 100) == (s3_key, True)
+        blob = (await session.exec(select(Blob).where(Blob.s3_key == s3_key))).one()
+        assert (blob.ref_count, blob.compressed, blob.stored_size) == (3, False, 100)
+        await session.rollback()
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+import pytest
+from config.settings import BUCKET_NAME
+from services import s3_service
+from services.s3_service import S3Service
+
+MiB = 1024 * 1024
+PART_SIZE = 5 * MiB
+
+async def stream(data: bytes, chunk: int = MiB):
+    for i in range(0, len(data), chunk):
+        yield data[i:i + chunk]
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Registra las operaciones de S3 y permite sustituir algunas llamadas."""
+    recorded = []
+    hooks = {}
+    original = s3_service._client_call
+
+    def client_call(operation):
+        call = original(operation)
+
+        def wrapper(**params):
+            recorded.append((operation, params.get("PartNumber")))
+            if operation in hooks:
+                hooks[operation](params)
+            return call(**params)
+        wrapper.__name__ = operation
+        return wrapper
+
+    monkeypatch.setattr(s3_service, "_client_call", client_call)
+    return recorded, hooks
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # Sin esperas entre reintentos
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, "sleep", lambda seconds: sleep(0))
+
+def operations(recorded):
+    return [operation for operation, _ in recorded]
+
+def stored(s3, key: str) -> bytes:
+    return s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+
+async def test_small_upload_uses_single_put(s3, calls):
+    recorded, _ = calls
+    data = os.urandom(PART_SIZE - 1)
+    assert await S3Service.upload_stream(stream(data), "small", part_size=PART_SIZE)
+    assert operations(recorded) == ["put_object"]
+    assert stored(s3, "small") == data
+
+async def test_empty_upload_creates_empty_object(s3, calls):
+    assert await S3Service.upload_stream(stream(b""), "empty", part_size=PART_SIZE)
+    assert stored(s3, "empty") == b""
+
+async def test_multipart_reassembles_parts_in_order(s3, calls):
+    recorded, hooks = calls
+    data = os.urandom(2 * PART_SIZE + 123)
+
+    def slow_first_part(params):
+        # La primera parte termina la última: el orden depende del número, no de la llegada
+        if params["PartNumber"] == 1:
+            time.sleep(0.3)
+    hooks["upload_part"] = slow_first_part
+
+    assert await S3Service.upload_stream(stream(data), "large", part_size=PART_SIZE, concurrency=3)
+    assert sorted(number for operation, number in recorded if operation == "upload_part") == [1, 2, 3]
+    assert operations(recorded)[-1] == "complete_multipart_upload"
+    assert stored(s3, "large") == data
+
+async def test_failing_part_is_retried(s3, calls):
+    recorded, hooks = calls
+    data = os.urandom(PART_SIZE + 1)
+    failures = []
+
+    def fail_once(params):
+        if params["PartNumber"] == 2 and not failures:
+            failures.append(params["PartNumber"])
+            raise ConnectionError("conexión reiniciada")
+    hooks["upload_part"] = fail_once
+
+    assert await S3Service.upload_stream(stream(data), "retried", part_size=PART_SIZE, max_retries=2)
+    assert [number for operation, number in recorded if operation == "upload_part"].count(2) == 2
+    assert stored(s3, "retried") == data
+
+async def test_final_failure_aborts_upload(s3, calls):
+    recorded, hooks = calls
+    data = os.urandom(2 * PART_SIZE + 1)
+
+    def always_fail(params):
+        if params["PartNumber"] == 2:
+            raise ConnectionError("conexión reiniciada")
+    hooks["upload_part"] = always_fail
+
+    assert not await S3Service.upload_stream(stream(data), "failed", part_size=PART_SIZE, max_retries=1)
+    assert [number for operation, number in recorded if operation == "upload_part"].count(2) == 2
+    assert "abort_multipart_upload" in operations(recorded)
+    assert "complete_multipart_upload" not in operations(recorded)
+    assert not s3.list_multipart_uploads(Bucket=BUCKET_NAME).get("Uploads")
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET_NAME)